@@ -1,48 +1,334 @@
+import asyncio
 import aiohttp
 import logging
-from urllib.parse import quote
+import time
+from functools import partial
+from urllib.parse import quote, urlencode
+from batching import bounded_map
+from config import config
 from data_validation import DataValidation  # Re-import DataValidation
+from hedging import hedged, hedger as default_hedger
+from json_decoding import PredictionStreamParser, decode
+from rate_limiter import estimate_tokens, get_limiter
+from resilience import CircuitOpenError, resilience as default_resilience
+from response_cache import ResponseCache
+from scheduler import BATCH, INTERACTIVE, NORMAL, get_scheduler
+from single_flight import SingleFlight
 
 
 class APIHandler:
     """
     This class handles API requests and responses.
+
+    A single pooled ``aiohttp.ClientSession`` is opened lazily on first use and
+    reused for every query, so connections, DNS lookups and TLS sessions are
+    shared between calls. Call ``close()`` (or use the handler as an async
+    context manager) on shutdown to release the pool.
     """
 
-    def __init__(self, gui=None):
+    BASE_URL = "https://api.example.com/generate"
+
+    def __init__(
+        self,
+        gui=None,
+        base_url=None,
+        pool_size=None,
+        per_host_limit=None,
+        keepalive_timeout=None,
+        dns_cache_ttl=None,
+        model_params=None,
+        cache=None,
+        decoder=None,
+        stream_threshold=None,
+        resilience=None,
+        limiter=None,
+        hedger=None,
+        scheduler=None,
+    ):
         """
-        Initialize the APIHandler with a GUI instance.
+        Initialize the APIHandler with a GUI instance and connection pool settings.
+
+        :param gui: Optional GUI whose ``display_responses`` receives the results.
+        :param base_url: The generation endpoint, defaults to ``BASE_URL``.
+        :param pool_size: Maximum number of simultaneous connections (0 for no limit).
+        :param per_host_limit: Maximum connections to a single host (0 for no limit).
+        :param keepalive_timeout: Seconds an idle connection is kept open for reuse.
+        :param dns_cache_ttl: Seconds resolved addresses are cached.
+        :param model_params: Extra model settings sent with every query.
+        :param cache: The ``ResponseCache`` consulted before each request; one
+            sized from the config is created if omitted.
+        :param decoder: Function decoding a response body from bytes; defaults
+            to ``json_decoding.decode`` (ujson when installed).
+        :param stream_threshold: Bodies larger than this many bytes (or of
+            unknown length) are stream-parsed instead of decoded whole.
+        :param resilience: The ``Resilience`` retrying requests and tracking the
+            endpoint's circuit breaker; defaults to the shared one.
+        :param limiter: The ``RateLimiter`` pacing requests; defaults to the
+            shared limiter of the configured model (or the endpoint).
+        :param hedger: The ``Hedger`` duplicating slow requests; defaults to the
+            shared one, which exists only when ``hedge_requests`` is enabled.
+        :param scheduler: The ``Scheduler`` ordering requests by priority;
+            defaults to the shared scheduler of the endpoint.
         """
         self.gui = gui
-        self.data_validation = DataValidation()
+        self.data_validation = DataValidation(
+            strict=config.get("strict_validation", False)
+        )
+        self.base_url = base_url or self.BASE_URL
+        self.model_params = dict(model_params or {})
+        self.connector_options = {
+            "limit": _setting(pool_size, "http_pool_size", 100),
+            "limit_per_host": _setting(per_host_limit, "http_per_host_limit", 0),
+            "keepalive_timeout": _setting(
+                keepalive_timeout, "http_keepalive_timeout", 30.0
+            ),
+            "ttl_dns_cache": _setting(dns_cache_ttl, "http_dns_cache_ttl", 300),
+        }
+        self._session = None
+        self._session_loop = None
+        self._single_flight = SingleFlight()
+        if cache is None:
+            cache = ResponseCache(
+                max_entries=config.get("response_cache_entries", 1024),
+                max_bytes=config.get("response_cache_bytes", 16 * 1024 * 1024),
+                ttl=config.get("response_cache_ttl", 300.0),
+            )
+        self.cache = cache
+        self.decoder = decoder or decode
+        self.stream_threshold = _setting(
+            stream_threshold, "stream_decode_threshold", 4 * 1024 * 1024
+        )
+        self.resilience = resilience or default_resilience
+        self.limiter = limiter or get_limiter(
+            self.model_params.get("model", self.base_url)
+        )
+        self.hedger = hedger or default_hedger
+        self.scheduler = scheduler or get_scheduler(self.base_url)
+        self.decode_seconds = 0.0
+        self.decode_count = 0
+        self.decoded_bytes = 0
 
-    async def make_async_request(self, query: str):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """
+        Return the shared session, opening it on first use.
+
+        A session is bound to the event loop it was created on, so a new one is
+        opened if the handler is later used from a different loop.
+        """
+        loop = asyncio.get_running_loop()
+        if (
+            self._session is None
+            or self._session.closed
+            or self._session_loop is not loop
+        ):
+            connector = aiohttp.TCPConnector(**self.connector_options)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        """
+        Close the shared session and every pooled connection.
+        """
+        session, self._session = self._session, None
+        self._session_loop = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def make_async_request(
+        self, query: str, display: bool = True, priority: str = INTERACTIVE
+    ):
         """
         Make an asynchronous request to the API with the given query.
+
+        :param query: The query to send.
+        :param display: Push the results to the GUI, if one is attached.
+        :param priority: Scheduling class; a single query usually has someone
+            waiting on it, so it is interactive by default.
+        """
+        try:
+            responses = await self._fetch(query, priority)
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError) as e:
+            logging.error(f"Request failed: {e}")
+            # Handle the error appropriately
+            return []  # Return an empty list in case of an error
+        except ValueError as e:
+            logging.error(f"Validation error: {e}")
+            # Handle the validation error appropriately
+            return []  # Return an empty list in case of an error
+        if display and self.gui is not None:
+            self.gui.display_responses(responses)
+        return responses  # Ensure data is always a list or iterable
+
+    async def make_async_requests(
+        self, queries, concurrency=None, ordered=False, display=False, priority=BATCH
+    ):
+        """
+        Run many queries over the pooled session with bounded concurrency.
+
+        Queries are read lazily from ``queries`` and results are yielded as
+        ``BatchResult`` objects as soon as they finish. A failed query is
+        yielded with its ``error`` set rather than raised, so the batch keeps
+        going.
+
+        :param queries: An iterable of query strings.
+        :param concurrency: Maximum number of requests in flight.
+        :param ordered: Yield results in input order instead of completion order.
+        :param display: Push each successful result to the GUI, if one is attached.
+        :param priority: Scheduling class of the requests; batch by default,
+            so they use the capacity interactive queries leave over.
         """
-        async with aiohttp.ClientSession() as session:
-            try:
-                url = "https://api.example.com/generate?query=" f"{quote(query)}"
-                async with session.get(url) as resp:
-                    data = await resp.json()
-                    self.data_validation.validate_response(
-                        data
-                    )  # Validate the response
-                    responses = self.parse_response(data)
-                    self.gui.display_responses(responses)
-                    return responses  # Ensure data is always a list or iterable
-            except aiohttp.ClientError as e:
-                logging.error(f"Request failed: {e}")
-                # Handle the error appropriately
-                return []  # Return an empty list in case of an error
-            except ValueError as e:
-                logging.error(f"Validation error: {e}")
-                # Handle the validation error appropriately
-                return []  # Return an empty list in case of an error
-
-    def parse_response(self, data: dict) -> list:
-        """
-        Parse the response data and return a list of generated texts.
-        """
-        responses = [item["generated_text"] for item in data["predictions"]]
+        if concurrency is None:
+            concurrency = config.get("batch_concurrency", 32)
+        fetch = partial(self._fetch, priority=priority)
+        async for result in bounded_map(fetch, queries, concurrency, ordered):
+            if display and result.ok and self.gui is not None:
+                self.gui.display_responses(result.value)
+            yield result
+
+    def request_key(self, query: str) -> tuple:
+        """
+        Return the key identifying equivalent requests for ``query``.
+
+        Queries differing only in whitespace map to the same key.
+        """
+        return (" ".join(query.split()), tuple(sorted(self.model_params.items())))
+
+    async def _fetch(self, query: str, priority: str = NORMAL) -> list:
+        """
+        Request, validate and parse the responses for one query.
+
+        Unlike ``make_async_request`` errors are raised to the caller. Cached
+        responses are returned without a request or re-validation, and
+        identical queries already in flight are joined instead of sent again
+        (at the priority of whichever arrived first).
+        """
+        key = self.request_key(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached)
+        return list(
+            await self._single_flight.do(key, lambda: self._request(key, priority))
+        )
+
+    async def _request(self, key: tuple, priority: str = NORMAL) -> list:
+        # One deadline for the request, however many attempts it takes.
+        deadline = self.scheduler.deadline(priority)
+        tokens = estimate_tokens(key[0])
+        # The hedge sits inside the scheduler and limiter: it only times and
+        # duplicates the request itself, never the wait for a slot or budget.
+        # A backup copy is only sent if the limiter has budget for it too.
+        responses = await self.resilience.call_async(
+            self.base_url,
+            lambda: self.scheduler.call_async(
+                lambda: self.limiter.call_async(
+                    lambda: hedged(
+                        self.hedger,
+                        self.base_url,
+                        lambda: self._request_once(key),
+                        lambda: self.limiter.try_reserve(tokens),
+                    ),
+                    tokens,
+                ),
+                priority,
+                deadline,
+            ),
+        )
+        self.cache.set(key, tuple(responses))
+        return responses
+
+    async def _request_once(self, key: tuple) -> list:
+        query, params = key
+        session = await self.get_session()
+        url = f"{self.base_url}?query={quote(query)}"
+        if params:
+            url = f"{url}&{urlencode(params)}"
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            length = resp.content_length
+            if self.data_validation.strict or (
+                length is not None and length <= self.stream_threshold
+            ):
+                body = await resp.read()
+            elif length is not None:
+                return await self._stream_decode(resp)
+            else:
+                # Chunked or compressed: buffer the body, and only switch to
+                # stream parsing once it turns out to be large.
+                buffered = bytearray()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    buffered += chunk
+                    if len(buffered) > self.stream_threshold:
+                        return await self._stream_decode(resp, bytes(buffered))
+                body = bytes(buffered)
+        started = time.perf_counter()
+        data = self.decoder(body)
+        self._record_decode(started, len(body))
+        return self.data_validation.validate_and_extract(data)
+
+    async def _stream_decode(self, resp, head=b"") -> list:
+        """
+        Extract the generated texts while the body is still arriving.
+
+        :param head: The start of the body, already read from ``resp``.
+        """
+        parser = PredictionStreamParser()
+        started = time.perf_counter()
+        parser.feed(head)
+        elapsed = time.perf_counter() - started
+        size = len(head)
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            started = time.perf_counter()
+            parser.feed(chunk)
+            elapsed += time.perf_counter() - started
+            size += len(chunk)
+        started = time.perf_counter()
+        responses = parser.close()
+        self._record_decode(started - elapsed, size)
         return responses
+
+    def _record_decode(self, started, size):
+        self.decode_seconds += time.perf_counter() - started
+        self.decode_count += 1
+        self.decoded_bytes += size
+
+    def stats(self) -> dict:
+        """
+        Return counters describing how the handler served its requests.
+        """
+        coalescing = self._single_flight.stats()
+        cache = self.cache.stats()
+        return {
+            "coalesce_hits": coalescing["hits"],
+            "coalesce_misses": coalescing["misses"],
+            "coalesce_in_flight": coalescing["in_flight"],
+            "cache_hits": cache["hits"],
+            "cache_misses": cache["misses"],
+            "cache_evictions": cache["evictions"],
+            "cache_entries": cache["entries"],
+            "cache_bytes": cache["bytes"],
+            "decode_seconds": self.decode_seconds,
+            "decode_count": self.decode_count,
+            "decoded_bytes": self.decoded_bytes,
+            "resilience": self.resilience.stats().get(self.base_url, {}),
+            "rate_limit": self.limiter.stats(),
+            "scheduler": self.scheduler.stats(),
+            "hedging": (
+                self.hedger.stats().get(self.base_url, {}) if self.hedger else {}
+            ),
+        }
+
+
+def _setting(value, key, default):
+    """
+    Resolve a handler setting from an explicit value, the config, or a default.
+    """
+    if value is not None:
+        return value
+    return config.get(key, default)
@@ -0,0 +1,96 @@
+# background_loop.py
+import asyncio
+import threading
+
+
+class BackgroundLoop:
+    """
+    An asyncio event loop running forever on a daemon thread.
+
+    Synchronous code (Tk callbacks, Flask views) hands coroutines to the loop
+    with ``submit`` and gets a ``concurrent.futures.Future`` back, so it never
+    blocks on network I/O and never has to create a loop of its own.
+    """
+
+    def __init__(self, name="asyncio-background"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """
+        Schedule ``coro`` on the loop and return a ``concurrent.futures.Future``.
+
+        Cancelling the returned future cancels the task running on the loop.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Run ``coro`` on the loop and block the calling thread for its result.
+        """
+        return self.submit(coro).result(timeout)
+
+    def stop(self, timeout=5.0):
+        """
+        Cancel outstanding tasks, stop the loop and wait for the thread to exit.
+        """
+        if not self._thread.is_alive():
+            return
+        self.run(self._cancel_tasks(), timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self.loop.close()
+
+    @staticmethod
+    async def _cancel_tasks():
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_shared_loop = None
+_shared_lock = threading.Lock()
+
+
+def shared_loop():
+    """
+    Return the process-wide background loop, starting it on first use.
+    """
+    global _shared_loop
+    with _shared_lock:
+        if _shared_loop is None:
+            _shared_loop = BackgroundLoop(name="shared-asyncio").start()
+    return _shared_loop
+
+
+def run_sync(coro, timeout=None):
+    """
+    Run ``coro`` on the shared background loop and block for its result.
+
+    This lets synchronous callers use async clients whose connections are
+    bound to one long-lived loop. It must not be called from that loop.
+    """
+    return shared_loop().run(coro, timeout)
+
+
+def stop_shared_loop(timeout=5.0):
+    """
+    Stop the process-wide background loop if it was started.
+
+    Pending coroutines are cancelled; a later ``run_sync`` starts a new loop.
+    """
+    global _shared_loop
+    with _shared_lock:
+        loop, _shared_loop = _shared_loop, None
+    if loop is not None:
+        loop.stop(timeout)
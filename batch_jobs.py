@@ -0,0 +1,266 @@
+# batch_jobs.py
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+
+def count_lines(path) -> int:
+    """
+    Count the lines of a file without holding it in memory.
+    """
+    count = 0
+    last = b"\n"
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(1024 * 1024)
+            if not block:
+                break
+            count += block.count(b"\n")
+            last = block[-1:]
+    return count + (last != b"\n")
+
+
+class Checkpoint:
+    """
+    Tracks which input lines of a batch are finished, for resuming a run.
+
+    Finished lines are kept as a low watermark plus the set of lines finished
+    above it, so the state stays small however long the input is. The size of
+    the output file at the time of saving is stored too: output written after
+    the last save is truncated on resume and those lines are redone, so every
+    line appears in the output exactly once.
+    """
+
+    def __init__(self, path, save_interval=1.0):
+        """
+        :param path: The checkpoint file; loaded if it exists.
+        :param save_interval: Minimum seconds between saves from ``maybe_save``.
+        """
+        self.path = path
+        self.save_interval = save_interval
+        self.next_line = 0
+        self.done = set()
+        self.output_bytes = 0
+        self.resumed = os.path.exists(path)
+        if self.resumed:
+            with open(path) as file:
+                state = json.load(file)
+            self.next_line = state["next_line"]
+            self.done = set(state["done"])
+            self.output_bytes = state["output_bytes"]
+        self._saved_at = time.monotonic()
+
+    def __len__(self):
+        return self.next_line + len(self.done)
+
+    def reset(self) -> None:
+        """
+        Forget every finished line, so the run starts over.
+        """
+        self.next_line = 0
+        self.done = set()
+        self.output_bytes = 0
+        self.resumed = False
+
+    def is_done(self, line) -> bool:
+        return line < self.next_line or line in self.done
+
+    def mark(self, line) -> None:
+        self.done.add(line)
+        while self.next_line in self.done:
+            self.done.remove(self.next_line)
+            self.next_line += 1
+
+    def save(self, output_bytes) -> None:
+        """
+        Atomically write the state; ``output`` must be flushed up to here.
+        """
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(
+                {
+                    "next_line": self.next_line,
+                    "done": sorted(self.done),
+                    "output_bytes": output_bytes,
+                },
+                file,
+            )
+        os.replace(temporary, self.path)
+        self.output_bytes = output_bytes
+        self._saved_at = time.monotonic()
+
+    def maybe_save(self, output) -> None:
+        """
+        Flush ``output`` and save if ``save_interval`` has passed.
+        """
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            output.flush()
+            self.save(output.tell())
+
+
+class Progress:
+    """
+    A single, periodically rewritten "done/total, rate, ETA" status line.
+    """
+
+    def __init__(self, total, done=0, stream=None, interval=0.5, label="items"):
+        self.total = total
+        self.done = done
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.label = label
+        self.started = time.monotonic()
+        self._initial = done
+        self._printed_at = 0.0
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return (self.done - self._initial) / elapsed if elapsed > 0 else 0.0
+
+    def line(self) -> str:
+        rate = self.rate()
+        remaining = max(0, self.total - self.done)
+        eta = time.strftime("%H:%M:%S", time.gmtime(remaining / rate)) if rate else "--"
+        return f"{self.done}/{self.total} {self.label}  {rate:.1f}/s  ETA {eta}"
+
+    def update(self, count=1) -> None:
+        self.done += count
+        now = time.monotonic()
+        if now - self._printed_at >= self.interval:
+            self._printed_at = now
+            self.stream.write(f"\r{self.line()}")
+            self.stream.flush()
+
+    def finish(self) -> None:
+        self.stream.write(f"\r{self.line()}\n")
+        self.stream.flush()
+
+
+def parse_query(raw):
+    """
+    Return ``(id, query)`` for one input line.
+
+    A line is either a JSON string or an object with a ``query`` (or
+    ``prompt``) field and an optional ``id``.
+
+    :raises ValueError: If the line holds no query.
+    """
+    record = json.loads(raw)
+    if isinstance(record, str):
+        return None, record
+    if isinstance(record, dict):
+        query = record.get("query", record.get("prompt"))
+        if isinstance(query, str):
+            return record.get("id"), query
+    raise ValueError("Line has no query")
+
+
+def open_output(path, checkpoint):
+    """
+    Open the output JSONL for appending, dropping output the checkpoint lacks.
+
+    If the output is missing or shorter than the checkpoint records, results
+    of lines marked done are gone, so the checkpoint is reset and the run
+    starts over rather than skipping them.
+    """
+    if checkpoint.resumed:
+        size = os.path.getsize(path) if os.path.exists(path) else None
+        if size is None or size < checkpoint.output_bytes:
+            logging.warning(
+                f"{path} is missing or shorter than its checkpoint records "
+                f"({size} < {checkpoint.output_bytes} bytes); starting over"
+            )
+            checkpoint.reset()
+    output = open(path, "r+b" if checkpoint.resumed else "wb")
+    output.truncate(checkpoint.output_bytes)
+    output.seek(0, os.SEEK_END)
+    return output
+
+
+def write_record(output, record) -> None:
+    output.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+async def run_query_file(
+    api_handler,
+    input_path,
+    output_path,
+    checkpoint_path=None,
+    concurrency=None,
+    progress=True,
+):
+    """
+    Run every query of a JSONL file through ``api_handler``.
+
+    Input is read lazily and each result is appended to ``output_path`` as
+    soon as it finishes, as ``{"line", "id", "query", "responses"}`` or with
+    an ``error`` instead of ``responses``. Memory use does not grow with the
+    input size. A run that is killed resumes from its checkpoint.
+
+    :param api_handler: The ``APIHandler`` whose pooled session is used.
+    :param input_path: The JSONL file of queries.
+    :param output_path: The JSONL file the results are written to.
+    :param checkpoint_path: The checkpoint file, ``<output>.checkpoint`` by default.
+    :param concurrency: Maximum number of requests in flight.
+    :param progress: Print a live throughput/ETA line to stderr.
+    :return: Counts of succeeded, failed and skipped (already done) lines.
+    """
+    checkpoint = Checkpoint(checkpoint_path or f"{output_path}.checkpoint")
+    total = count_lines(input_path)
+    output = open_output(output_path, checkpoint)
+    status = Progress(
+        total,
+        done=len(checkpoint),
+        stream=sys.stderr if progress else io.StringIO(),
+        label="queries",
+    )
+    summary = {"succeeded": 0, "failed": 0, "skipped": len(checkpoint)}
+    # BatchResult.index counts the queries yielded so far; map it to the line.
+    issued = itertools.count()
+    in_flight = {}
+
+    with open(input_path, "rb") as source, output:
+
+        def finish(line, record):
+            write_record(output, record)
+            checkpoint.mark(line)
+            summary["failed" if "error" in record else "succeeded"] += 1
+            status.update()
+            checkpoint.maybe_save(output)
+
+        def queries():
+            for line, raw in enumerate(source):
+                if checkpoint.is_done(line):
+                    continue
+                if not raw.strip():
+                    checkpoint.mark(line)
+                    status.update()
+                    continue
+                try:
+                    record_id, query = parse_query(raw)
+                except ValueError as error:
+                    finish(line, {"line": line, "error": str(error)})
+                    continue
+                in_flight[next(issued)] = (line, record_id)
+                yield query
+
+        try:
+            async for result in api_handler.make_async_requests(queries(), concurrency):
+                line, record_id = in_flight.pop(result.index)
+                record = {"line": line, "id": record_id, "query": result.item}
+                if result.ok:
+                    record["responses"] = result.value
+                else:
+                    record["error"] = f"{type(result.error).__name__}: {result.error}"
+                finish(line, record)
+        finally:
+            # Everything marked so far has been written, so the state is
+            # consistent even when the run is interrupted.
+            output.flush()
+            checkpoint.save(output.tell())
+    status.finish()
+    return summary
@@ -0,0 +1,89 @@
+# batching.py
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Optional
+
+
+@dataclass
+class BatchResult:
+    """
+    The outcome of one item of a batch.
+
+    Exactly one of ``value`` and ``error`` is meaningful: failures are reported
+    here instead of being raised so one bad item cannot stop the batch.
+    """
+
+    index: int
+    item: Any
+    value: Any = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def _run_item(func, index, item) -> BatchResult:
+    try:
+        return BatchResult(index, item, value=await func(item))
+    except Exception as error:
+        return BatchResult(index, item, error=error)
+
+
+async def bounded_map(
+    func: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    limit: int,
+    ordered: bool = False,
+) -> AsyncIterator[BatchResult]:
+    """
+    Apply ``func`` to every item with at most ``limit`` calls in flight.
+
+    Items are pulled from ``items`` lazily, only when a slot frees up, so the
+    input can be a generator over a file of any size. Results are yielded as
+    they finish, or in input order when ``ordered`` is set. In ordered mode a
+    finished result keeps its slot until it is yielded, which bounds the
+    reorder buffer to ``limit`` entries as well.
+
+    :param func: Coroutine function called with each item.
+    :param items: The items to process.
+    :param limit: Maximum number of items in flight (and buffered).
+    :param ordered: Yield results in input order instead of completion order.
+    """
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    semaphore = asyncio.Semaphore(limit)
+    iterator = enumerate(items)
+    pending = set()
+    buffered = {}
+    next_index = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and not semaphore.locked():
+                try:
+                    index, item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                await semaphore.acquire()
+                pending.add(asyncio.ensure_future(_run_item(func, index, item)))
+            if not pending and not buffered:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                result = task.result()
+                if ordered:
+                    buffered[result.index] = result
+                else:
+                    semaphore.release()
+                    yield result
+            while next_index in buffered:
+                semaphore.release()
+                yield buffered.pop(next_index)
+                next_index += 1
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,579 @@
+# benchmarks.py
+"""
+Local micro-benchmarks. Every benchmark talks to in-process stubs, so no API
+keys or network access are needed.
+
+Usage:
+    python benchmarks.py session-pool --requests 2000 --concurrency 50
+    python benchmarks.py gui-render --lines 10000    (needs a display)
+    python benchmarks.py model-registry --requests 500
+    python benchmarks.py validation --predictions 1000 100000
+    python benchmarks.py hedging --requests 1000 --concurrency 20
+    python benchmarks.py image-preprocess --images 10
+    python benchmarks.py serve-load --workers 2 --threads 8 --levels 1 8 32
+    python benchmarks.py scheduler --batch 600 --rate 100
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+
+from api_handler import APIHandler
+
+
+def percentile(samples, fraction):
+    """
+    Return the value at ``fraction`` (0-1) of the sorted samples.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(label, latencies, elapsed):
+    """
+    Print requests per second and p50/p99 latency for one benchmark run.
+    """
+    print(
+        f"{label:<18} {len(latencies) / elapsed:10.1f} req/s"
+        f"   p50 {percentile(latencies, 0.50) * 1000:8.2f} ms"
+        f"   p99 {percentile(latencies, 0.99) * 1000:8.2f} ms"
+    )
+
+
+async def start_stub_server(handler, host="127.0.0.1"):
+    """
+    Start an aiohttp stub server on an ephemeral port.
+
+    :param handler: The request handler serving every path.
+    :return: The runner (for cleanup) and the base URL of the server.
+    """
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+async def generate_stub(request):
+    """
+    Stub of the generation endpoint returning a single prediction.
+    """
+    return web.json_response(
+        {"predictions": [{"generated_text": request.query.get("query", "")}]}
+    )
+
+
+async def _run_concurrently(call, requests, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await call(f"query {i}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(requests)))
+    return latencies, time.perf_counter() - started
+
+
+async def bench_session_pool(requests, concurrency):
+    """
+    Compare a new ClientSession per query against APIHandler's pooled session.
+    """
+    runner, base_url = await start_stub_server(generate_stub)
+    url = f"{base_url}/generate"
+    try:
+
+        async def per_call_session(query):
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url, params={"query": query}) as resp:
+                    return await resp.json()
+
+        latencies, elapsed = await _run_concurrently(
+            per_call_session, requests, concurrency
+        )
+        report("per-call session", latencies, elapsed)
+
+        async with APIHandler(base_url=url) as handler:
+            latencies, elapsed = await _run_concurrently(
+                handler.make_async_request, requests, concurrency
+            )
+        report("pooled session", latencies, elapsed)
+    finally:
+        await runner.cleanup()
+
+
+def _report_frames(label, frames, elapsed, stall_ms):
+    stalls = [frame for frame in frames if frame * 1000 > stall_ms]
+    print(
+        f"{label:<18} total {elapsed * 1000:9.1f} ms"
+        f"   frames {len(frames):6d}   stalls>{stall_ms}ms {len(stalls):5d}"
+        f"   worst frame {max(frames) * 1000:8.1f} ms"
+    )
+
+
+def bench_gui_render(lines, stall_ms):
+    """
+    Measure Tk frame stalls while rendering ``lines`` response lines.
+
+    Each ``root.update()`` call processes everything Tk has pending, so its
+    duration is how long the window was unresponsive during that frame.
+    """
+    from tkinter import END
+    from gui import GUI
+
+    responses = [f"generated line {i} " + "lorem ipsum " * 6 for i in range(lines)]
+    gui = GUI(history_path=os.devnull)
+    gui.layout()
+    gui.root.update()
+    try:
+        # The previous implementation: one blocking pass over every response.
+        started = time.perf_counter()
+        gui.response_text.delete(1.0, END)
+        for response in responses:
+            gui.response_text.insert(END, response + "\n")
+        gui.root.update()
+        elapsed = time.perf_counter() - started
+        _report_frames("single pass", [elapsed], elapsed, stall_ms)
+
+        gui.response_text.delete(1.0, END)
+        gui.root.update()
+        frames = []
+        started = time.perf_counter()
+        gui.display_responses(responses)
+        while gui.render_id is not None:
+            frame_started = time.perf_counter()
+            gui.root.update()
+            frames.append(time.perf_counter() - frame_started)
+        _report_frames("chunked", frames, time.perf_counter() - started, stall_ms)
+    finally:
+        gui.loop.stop()
+        gui.root.destroy()
+
+
+def bench_model_registry(requests):
+    """
+    Per-request cost of obtaining ready-to-call Gemini model handles.
+
+    "before" replays the old DynamicGeminiModel constructor: reconfigure the
+    global client and build two models, after which the first call has to
+    build a fresh gRPC client. "after" goes through the shared registry. No
+    request is sent in either case.
+    """
+    import google.generativeai as genai
+    from google.generativeai import client
+
+    from dynamic_gemini_model import DynamicGeminiModel
+    from model_registry import get_model
+
+    def before():
+        genai.configure(api_key="benchmark-key")
+        genai.GenerativeModel("gemini-pro")
+        genai.GenerativeModel("gemini-pro-vision")
+        client.get_default_generative_client()
+
+    def after():
+        DynamicGeminiModel(api_key="benchmark-key")
+        get_model("gemini-pro", "benchmark-key")
+        get_model("gemini-pro-vision", "benchmark-key")
+
+    for label, setup in (("before", before), ("after", after)):
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(requests):
+            call_started = time.perf_counter()
+            setup()
+            latencies.append(time.perf_counter() - call_started)
+        report(label, latencies, time.perf_counter() - started)
+
+
+def bench_validation(sizes, repeat):
+    """
+    Compare Pydantic validation + parsing with the one-pass fast path.
+    """
+    from data_validation import DataValidation
+
+    strict = DataValidation(strict=True)
+    fast = DataValidation()
+    for size in sizes:
+        data = {
+            "predictions": [
+                {"generated_text": f"text {i}", "safety": {"score": 0.1}}
+                for i in range(size)
+            ]
+        }
+
+        for label, validate in (
+            (f"pydantic {size}", lambda: strict.validate_and_extract(data)),
+            (f"fast path {size}", lambda: fast.validate_and_extract(data)),
+        ):
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(repeat):
+                call_started = time.perf_counter()
+                validate()
+                latencies.append(time.perf_counter() - call_started)
+            report(label, latencies, time.perf_counter() - started)
+
+
+async def bench_hedging(requests, concurrency, slow_fraction, percentile, max_extra):
+    """
+    p99 latency with and without hedging against a heavy-tailed stub.
+
+    Most stub responses take 5-15 ms; ``slow_fraction`` of them take
+    200-800 ms, independently of the query, like a congested backend
+    replica. The extra cost is upstream requests sent per logical request.
+    """
+    import random
+
+    from hedging import Hedger
+
+    hits = 0
+
+    async def heavy_tailed(request):
+        nonlocal hits
+        hits += 1
+        if random.random() < slow_fraction:
+            await asyncio.sleep(random.uniform(0.2, 0.8))
+        else:
+            await asyncio.sleep(random.uniform(0.005, 0.015))
+        return await generate_stub(request)
+
+    runner, base_url = await start_stub_server(heavy_tailed)
+    url = f"{base_url}/generate"
+    try:
+        for label, hedger in (
+            ("no hedging", None),
+            (
+                f"hedge at p{percentile * 100:g}",
+                Hedger(percentile=percentile, max_extra=max_extra),
+            ),
+        ):
+            hits = 0
+            async with APIHandler(base_url=url, hedger=hedger) as handler:
+                latencies, elapsed = await _run_concurrently(
+                    handler.make_async_request, requests, concurrency
+                )
+            report(label, latencies, elapsed)
+            print(f"{'':<18} {hits / requests:10.3f} upstream requests per request")
+    finally:
+        await runner.cleanup()
+
+
+async def bench_scheduler(batch, interactive, rate, concurrency, slots):
+    """
+    Interactive latency while a batch saturates a rate-limited upstream.
+
+    ``batch`` queries run with ``concurrency`` in flight while ``interactive``
+    single queries arrive every 100 ms, all limited to ``rate`` requests per
+    second. Without scheduling every call queues first-come in the limiter;
+    with it only ``slots`` calls are let into the limiter at a time, in
+    priority order.
+    """
+    from rate_limiter import RateLimiter
+    from scheduler import Scheduler
+
+    runner, base_url = await start_stub_server(generate_stub)
+    url = f"{base_url}/generate"
+    try:
+        for label, scheduler in (
+            ("no scheduling", Scheduler("off", max_in_flight=10**9)),
+            (f"{slots} slots", Scheduler("on", max_in_flight=slots)),
+        ):
+            limiter = RateLimiter(
+                "bench", requests_per_minute=rate * 60, burst_seconds=0.1
+            )
+            async with APIHandler(
+                base_url=url, limiter=limiter, scheduler=scheduler
+            ) as handler:
+                latencies = []
+
+                async def run_batch():
+                    queries = (f"batch {label} {i}" for i in range(batch))
+                    async for _ in handler.make_async_requests(queries, concurrency):
+                        pass
+
+                async def run_interactive():
+                    await asyncio.sleep(0.5)
+                    for i in range(interactive):
+                        started = time.perf_counter()
+                        await handler.make_async_request(f"interactive {label} {i}")
+                        latencies.append(time.perf_counter() - started)
+                        await asyncio.sleep(0.1)
+
+                started = time.perf_counter()
+                batch_task = asyncio.ensure_future(run_batch())
+                await run_interactive()
+                await batch_task
+                elapsed = time.perf_counter() - started
+            print(
+                f"{label:<18} interactive p50 {percentile(latencies, 0.5) * 1000:8.1f}"
+                f" ms   p99 {percentile(latencies, 0.99) * 1000:8.1f} ms"
+                f"   batch done in {elapsed:6.2f}s"
+            )
+    finally:
+        await runner.cleanup()
+
+
+def bench_image_preprocess(images, width, height):
+    """
+    Per-image latency and upload size before and after preprocessing.
+
+    The inputs are synthetic phone-sized JPEGs with noise, so they compress
+    like photos. "before" is the old upload path: decode at full resolution
+    and encode the full-size image; "after" is ``preprocess_image``.
+    """
+    import tempfile
+
+    import PIL.Image
+
+    from multimodal_input import MultimodalInputProcessor
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(images):
+            path = os.path.join(directory, f"photo{i}.jpg")
+            noise = PIL.Image.effect_noise((width, height), 40 + i).convert("RGB")
+            noise.save(path, quality=92)
+            paths.append(path)
+        input_bytes = sum(os.path.getsize(path) for path in paths)
+
+        def before(path):
+            image = MultimodalInputProcessor.process_image_input(path)
+            return len(MultimodalInputProcessor.to_blob(image)["data"])
+
+        def after(path):
+            blob, _ = MultimodalInputProcessor.preprocess_image(path)
+            return len(blob["data"])
+
+        print(f"{'input':<18} {input_bytes / images / 1e6:10.2f} MB/image")
+        for label, prepare in (("before", before), ("after", after)):
+            latencies = []
+            output_bytes = 0
+            started = time.perf_counter()
+            for path in paths:
+                call_started = time.perf_counter()
+                output_bytes += prepare(path)
+                latencies.append(time.perf_counter() - call_started)
+            report(label, latencies, time.perf_counter() - started)
+            print(f"{'':<18} {output_bytes / images / 1e6:10.2f} MB/image uploaded")
+
+
+def _serve_stub(port, workers, threads, latency, directory):
+    """
+    Serve ui.app under gunicorn with a sleeping stand-in for gemini-pro-vision.
+    """
+    from types import SimpleNamespace
+
+    import jinja2
+
+    import ui
+    from multimodal_cache import MultimodalResultCache
+    from response_cache import PersistentCache
+    from serve import serve
+
+    class StubVision:
+        MODEL = ui.gemini_api.MODEL
+        key_pool = ui.gemini_api.key_pool
+
+        def generate_content(self, text, image, priority=None):
+            time.sleep(latency)
+            return SimpleNamespace(text=f"stub: {text}")
+
+    ui.gemini_api = StubVision()
+    ui.result_cache = MultimodalResultCache(
+        PersistentCache(os.path.join(directory, "results.sqlite3"))
+    )
+    # The repo ships no templates/ directory; render minimal ones.
+    ui.app.jinja_loader = jinja2.DictLoader(
+        {"index.html": "ok", "result.html": "{{ analysis['text'] }}"}
+    )
+    serve(
+        ui.app,
+        bind=f"127.0.0.1:{port}",
+        workers=workers,
+        threads=threads,
+        loglevel="warning",
+    )
+
+
+async def bench_serve_load(levels, requests, workers, threads, latency):
+    """
+    Requests per second and latency of the production server under load.
+
+    The server runs in a child process with a stubbed Gemini backend that
+    sleeps ``latency`` seconds per call. Every request posts a small image
+    with a unique prompt, so each one misses the result cache and goes
+    through preprocessing and the (stubbed) vision call.
+    """
+    import io
+    import multiprocessing
+    import signal
+    import socket
+    import tempfile
+
+    import PIL.Image
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    url = f"http://127.0.0.1:{port}/"
+    image = io.BytesIO()
+    PIL.Image.effect_noise((640, 480), 40).convert("RGB").save(image, format="JPEG")
+    image = image.getvalue()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = multiprocessing.get_context("fork").Process(
+            target=_serve_stub, args=(port, workers, threads, latency, directory)
+        )
+        server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(200):
+                    try:
+                        async with session.get(url) as resp:
+                            if resp.status == 200:
+                                break
+                    except aiohttp.ClientConnectionError:
+                        pass
+                    await asyncio.sleep(0.05)
+                print(
+                    f"{workers} workers x {threads} threads,"
+                    f" stub latency {latency * 1000:.0f} ms"
+                )
+                for concurrency in levels:
+                    errors = 0
+
+                    async def post(query):
+                        nonlocal errors
+                        form = aiohttp.FormData()
+                        form.add_field("text", f"{query} at {concurrency}")
+                        form.add_field("image", image, filename="photo.jpg")
+                        async with session.post(url, data=form) as resp:
+                            await resp.read()
+                            errors += resp.status != 200
+
+                    latencies, elapsed = await _run_concurrently(
+                        post, requests, concurrency
+                    )
+                    report(f"concurrency {concurrency}", latencies, elapsed)
+                    if errors:
+                        print(f"{'':<18} {errors} failed requests")
+        finally:
+            # SIGTERM drains in-flight requests before the workers exit.
+            os.kill(server.pid, signal.SIGTERM)
+            server.join(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local benchmarks.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    session_pool = subparsers.add_parser(
+        "session-pool", help="per-call ClientSession vs pooled APIHandler session"
+    )
+    session_pool.add_argument("--requests", type=int, default=2000)
+    session_pool.add_argument("--concurrency", type=int, default=50)
+
+    gui_render = subparsers.add_parser(
+        "gui-render", help="frame stalls while rendering many lines in the GUI"
+    )
+    gui_render.add_argument("--lines", type=int, default=10000)
+    gui_render.add_argument("--stall-ms", type=float, default=50.0)
+
+    model_registry = subparsers.add_parser(
+        "model-registry", help="per-request model setup with and without the registry"
+    )
+    model_registry.add_argument("--requests", type=int, default=500)
+
+    validation = subparsers.add_parser(
+        "validation", help="Pydantic ResponseModel vs fast-path validation"
+    )
+    validation.add_argument(
+        "--predictions", type=int, nargs="+", default=[1000, 100000]
+    )
+    validation.add_argument("--repeat", type=int, default=20)
+
+    hedging = subparsers.add_parser(
+        "hedging", help="tail latency with and without hedged requests"
+    )
+    hedging.add_argument("--requests", type=int, default=1000)
+    hedging.add_argument("--concurrency", type=int, default=20)
+    hedging.add_argument("--slow-fraction", type=float, default=0.03)
+    hedging.add_argument("--percentile", type=float, default=0.95)
+    hedging.add_argument("--max-extra", type=float, default=0.1)
+
+    image_preprocess = subparsers.add_parser(
+        "image-preprocess", help="upload size and latency of image preprocessing"
+    )
+    image_preprocess.add_argument("--images", type=int, default=10)
+    image_preprocess.add_argument("--width", type=int, default=4032)
+    image_preprocess.add_argument("--height", type=int, default=3024)
+
+    serve_load = subparsers.add_parser(
+        "serve-load", help="load test of the gunicorn server with a stubbed backend"
+    )
+    serve_load.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32, 64])
+    serve_load.add_argument("--requests", type=int, default=200)
+    serve_load.add_argument("--workers", type=int, default=2)
+    serve_load.add_argument("--threads", type=int, default=8)
+    serve_load.add_argument("--latency", type=float, default=0.2)
+
+    scheduler = subparsers.add_parser(
+        "scheduler", help="interactive latency under batch load, with priorities"
+    )
+    scheduler.add_argument("--batch", type=int, default=600)
+    scheduler.add_argument("--interactive", type=int, default=20)
+    scheduler.add_argument("--rate", type=float, default=100.0)
+    scheduler.add_argument("--concurrency", type=int, default=32)
+    scheduler.add_argument("--slots", type=int, default=4)
+
+    args = parser.parse_args()
+    if args.benchmark == "session-pool":
+        asyncio.run(bench_session_pool(args.requests, args.concurrency))
+    elif args.benchmark == "gui-render":
+        bench_gui_render(args.lines, args.stall_ms)
+    elif args.benchmark == "model-registry":
+        bench_model_registry(args.requests)
+    elif args.benchmark == "validation":
+        bench_validation(args.predictions, args.repeat)
+    elif args.benchmark == "image-preprocess":
+        bench_image_preprocess(args.images, args.width, args.height)
+    elif args.benchmark == "serve-load":
+        asyncio.run(
+            bench_serve_load(
+                args.levels, args.requests, args.workers, args.threads, args.latency
+            )
+        )
+    elif args.benchmark == "scheduler":
+        asyncio.run(
+            bench_scheduler(
+                args.batch, args.interactive, args.rate, args.concurrency, args.slots
+            )
+        )
+    elif args.benchmark == "hedging":
+        asyncio.run(
+            bench_hedging(
+                args.requests,
+                args.concurrency,
+                args.slow_fraction,
+                args.percentile,
+                args.max_extra,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
+import asyncio
 import click
 from api_handler import APIHandler
+from batch_jobs import run_query_file
+from dynamic_gemini_model import DynamicGeminiModel
+from gemini_vision_pro_api import GeminiVisionProAPI
+from multimodal_batch import load_items, report_stages, run_image_batch
 from data_validation import DataValidation
 from utils import (setup_logging, enhanced_logging, secure_api_call, log_error,
                    security_audit, configure_logging, integrate_with_system)
@@ -14,7 +19,7 @@ def cli_tool():
 @cli_tool.command()
 @click.argument('query')
 @click.option('--debug', is_flag=True, help='Enable debug mode')
-async def generate(query, debug):
+def generate(query, debug):
     """
     Generate text based on the provided query.
     Uses an asynchronous call to an API handler to process the query.
@@ -27,12 +32,8 @@ async def generate(query, debug):
     else:
         setup_logging()
 
-    api_handler = APIHandler(gui=None)
-    data_validation = DataValidation()
-    api_handler.data_validation = data_validation
-
     try:
-        responses = await api_handler.make_async_request(query)
+        responses = asyncio.run(_generate(query))
         if responses:
             for response in responses:
                 print(response)
@@ -40,6 +41,106 @@ async def generate(query, debug):
         log_error(e)
         click.echo(f"Error occurred: {e}", err=True)
 
+async def _generate(query):
+    """
+    Run a single query through a pooled APIHandler and close it afterwards.
+
+    :param query: The query string to process.
+    :return: The list of generated texts.
+    """
+    async with APIHandler(gui=None) as api_handler:
+        api_handler.data_validation = DataValidation()
+        return await api_handler.make_async_request(query)
+
+@cli_tool.command()
+@click.argument('input_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output_path', type=click.Path(dir_okay=False))
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Checkpoint file to resume from (default: OUTPUT_PATH.checkpoint)')
+@click.option('--concurrency', type=int, default=None,
+              help='Maximum requests in flight (default: batch_concurrency from the config)')
+def generate_batch(input_path, output_path, checkpoint, concurrency):
+    """
+    Run every query of a JSONL file and write the results to a JSONL file.
+    Each input line is a JSON string or an object with a "query" field.
+    Rerunning the same command after an interruption resumes where it stopped.
+
+    :param input_path: The JSONL file of queries.
+    :param output_path: The JSONL file the results are appended to.
+    :param checkpoint: Optional path of the checkpoint file.
+    :param concurrency: Optional maximum number of requests in flight.
+    """
+    setup_logging()
+    try:
+        summary = asyncio.run(_generate_batch(input_path, output_path, checkpoint, concurrency))
+    except Exception as e:
+        log_error(e)
+        click.echo(f"Error occurred: {e}", err=True)
+        return
+    click.echo(f"{summary['succeeded']} succeeded, {summary['failed']} failed, "
+               f"{summary['skipped']} already done", err=True)
+
+async def _generate_batch(input_path, output_path, checkpoint, concurrency):
+    """
+    Run a query file through one pooled APIHandler and close it afterwards.
+    """
+    async with APIHandler(gui=None) as api_handler:
+        return await run_query_file(api_handler, input_path, output_path, checkpoint, concurrency)
+
+@cli_tool.command()
+@click.argument('source', type=click.Path(exists=True))
+@click.argument('output_path', type=click.Path(dir_okay=False))
+@click.option('--prompt', help='Prompt for images without their own (NAME.txt or a manifest "prompt")')
+@click.option('--concurrency', type=int, default=8, help='Maximum Gemini calls in flight')
+@click.option('--workers', type=int, default=None, help='Image decoding processes (default: CPU count)')
+def describe_images(source, output_path, prompt, concurrency, workers):
+    """
+    Run gemini-pro-vision over a directory of images or a JSONL manifest.
+    Manifest lines look like {"image": "path.jpg", "prompt": "...", "id": ...}.
+    Results are written to OUTPUT_PATH as JSONL; per-stage throughput goes to stderr.
+
+    :param source: A directory of images or a JSONL manifest.
+    :param output_path: The JSONL file the results are written to.
+    :param prompt: Optional default prompt.
+    :param concurrency: Maximum number of Gemini calls in flight.
+    :param workers: Optional number of decoding processes.
+    """
+    setup_logging()
+    try:
+        items, total = load_items(source, prompt)
+        stats = asyncio.run(run_image_batch(items, output_path, GeminiVisionProAPI(),
+                                            decode_workers=workers, concurrency=concurrency,
+                                            total=total))
+    except Exception as e:
+        log_error(e)
+        click.echo(f"Error occurred: {e}", err=True)
+        return
+    report_stages(stats)
+
+@cli_tool.command()
+@click.argument('prompt')
+def stream(prompt):
+    """
+    Stream a Gemini response to stdout as it is generated.
+    Prints time-to-first-token and throughput to stderr when done.
+
+    :param prompt: The prompt to send to the model.
+    """
+    setup_logging()
+    model = DynamicGeminiModel()
+    try:
+        for chunk in model.stream_response(prompt):
+            click.echo(chunk, nl=False)
+        click.echo()
+    except Exception as e:
+        log_error(e)
+        click.echo(f"Error occurred: {e}", err=True)
+        return
+    metrics = model.last_metrics
+    click.echo(f"time to first token: {metrics.time_to_first_token or 0:.3f}s, "
+               f"total: {metrics.total_time:.3f}s, "
+               f"{metrics.tokens_per_second:.1f} tokens/s", err=True)
+
 @cli_tool.command()
 @click.option('--verbose', is_flag=True, help='Enable verbose output')
 def settings(verbose):
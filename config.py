@@ -11,7 +11,79 @@ def load_config():
         # Fallback to environment variables if config.json is not found
         return {
             "gemini_api_key": os.getenv("GEMINI_API_KEY", ""),
+            "gemini_api_keys": os.getenv("GEMINI_API_KEYS", ""),
+            "key_pool_strategy": os.getenv("KEY_POOL_STRATEGY", "lru"),
+            "key_cooldown": float(os.getenv("KEY_COOLDOWN", "60")),
+            "key_auth_cooldown": float(os.getenv("KEY_AUTH_COOLDOWN", "600")),
             "search_url": os.getenv("SEARCH_URL", "https://www.gemini.com/api"),
+            "http_pool_size": int(os.getenv("HTTP_POOL_SIZE", "100")),
+            "http_per_host_limit": int(os.getenv("HTTP_PER_HOST_LIMIT", "0")),
+            "http_keepalive_timeout": float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30")),
+            "http_dns_cache_ttl": int(os.getenv("HTTP_DNS_CACHE_TTL", "300")),
+            "strict_validation": os.getenv("STRICT_VALIDATION", "") == "1",
+            "stream_decode_threshold": int(
+                os.getenv("STREAM_DECODE_THRESHOLD", str(4 * 1024 * 1024))
+            ),
+            "retry_max_attempts": int(os.getenv("RETRY_MAX_ATTEMPTS", "4")),
+            "retry_base_delay": float(os.getenv("RETRY_BASE_DELAY", "0.5")),
+            "retry_max_delay": float(os.getenv("RETRY_MAX_DELAY", "30")),
+            "breaker_failure_threshold": int(
+                os.getenv("BREAKER_FAILURE_THRESHOLD", "5")
+            ),
+            "breaker_reset_timeout": float(os.getenv("BREAKER_RESET_TIMEOUT", "30")),
+            # Per-model budgets, e.g.
+            # {"gemini-pro": {"requests_per_minute": 60, "tokens_per_minute": 32000}}
+            "rate_limits": json.loads(os.getenv("RATE_LIMITS", "{}")),
+            # Outbound scheduling, e.g. {"max_in_flight": 16,
+            # "weights": {"interactive": 8, "normal": 4, "batch": 1},
+            # "deadlines": {"interactive": 30}, "max_wait": 60}
+            "scheduler": json.loads(os.getenv("SCHEDULER", "{}")),
+            "hedge_requests": os.getenv("HEDGE_REQUESTS", "") == "1",
+            "hedge_percentile": float(os.getenv("HEDGE_PERCENTILE", "0.95")),
+            "hedge_max_extra": float(os.getenv("HEDGE_MAX_EXTRA", "0.1")),
+            "image_max_edge": int(os.getenv("IMAGE_MAX_EDGE", "1536")),
+            "image_jpeg_quality": int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+            "multimodal_cache_path": os.getenv(
+                "MULTIMODAL_CACHE_PATH", "multimodal_cache.sqlite3"
+            ),
+            "multimodal_cache_max_entries": int(
+                os.getenv("MULTIMODAL_CACHE_MAX_ENTRIES", "10000")
+            ),
+            "multimodal_cache_max_bytes": int(
+                os.getenv("MULTIMODAL_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+            ),
+            "web_workers": int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1))),
+            "web_threads": int(os.getenv("WEB_THREADS", "8")),
+            "web_timeout": int(os.getenv("WEB_TIMEOUT", "120")),
+            "web_graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30")),
+            "job_queue_path": os.getenv("JOB_QUEUE_PATH", "jobs.sqlite3"),
+            "job_workers": int(os.getenv("JOB_WORKERS", "4")),
+            "job_queue_depth": int(os.getenv("JOB_QUEUE_DEPTH", "64")),
+            "job_result_ttl": float(os.getenv("JOB_RESULT_TTL", "3600")),
+            "job_max_results": int(os.getenv("JOB_MAX_RESULTS", "1000")),
+            "batch_concurrency": int(os.getenv("BATCH_CONCURRENCY", "32")),
+            "response_cache_entries": int(os.getenv("RESPONSE_CACHE_ENTRIES", "1024")),
+            "response_cache_bytes": int(os.getenv("RESPONSE_CACHE_BYTES", "16777216")),
+            "response_cache_ttl": float(os.getenv("RESPONSE_CACHE_TTL", "300")),
+            "model_cache_path": os.getenv("MODEL_CACHE_PATH", "model_cache.sqlite3"),
+            "model_cache_memory_entries": int(
+                os.getenv("MODEL_CACHE_MEMORY_ENTRIES", "256")
+            ),
+            "model_cache_max_entries": int(
+                os.getenv("MODEL_CACHE_MAX_ENTRIES", "10000")
+            ),
+            "model_cache_max_bytes": int(
+                os.getenv("MODEL_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+            ),
+            "model_cache_memory_bytes": int(
+                os.getenv("MODEL_CACHE_MEMORY_BYTES", str(16 * 1024 * 1024))
+            ),
+            # Seconds a cached model response stays valid (unset: until evicted).
+            "model_cache_ttl": (
+                float(os.environ["MODEL_CACHE_TTL"])
+                if os.getenv("MODEL_CACHE_TTL")
+                else None
+            ),
         }
 
 
@@ -27,9 +27,63 @@ class ResponseModel(BaseModel):
         return predictions
 
 
+def extract_generated_texts(data: Dict[str, Any]) -> List[str]:
+    """
+    Check a response against the ``ResponseModel`` rules and return its texts.
+
+    This is the fast path: one pass over the predictions, no model objects and
+    no copies of the prediction dicts.
+
+    :param data: The decoded response.
+    :return: The ``generated_text`` of every prediction.
+    """
+    try:
+        predictions = data["predictions"]
+    except (KeyError, TypeError):
+        raise ValueError("Response has no predictions field") from None
+    if not isinstance(predictions, list):
+        raise ValueError("Predictions must be a list")
+    if not predictions:
+        raise ValueError("No predictions found in the response")
+    try:
+        return [prediction["generated_text"] for prediction in predictions]
+    except (KeyError, TypeError):
+        raise ValueError("Invalid prediction format") from None
+
+
 class DataValidation:
-    def __init__(self):
-        pass
+    def __init__(self, strict: bool = False):
+        """
+        :param strict: Validate through the Pydantic ``ResponseModel`` (with its
+            error logging) instead of the fast path; useful for debugging.
+        """
+        self.strict = strict
+
+    def validate_and_extract(self, data: Dict[str, Any]) -> List[str]:
+        """
+        Validate the response data and return the generated texts.
+
+        :param data: The data to be validated.
+        :return: The ``generated_text`` of every prediction.
+        """
+        if self.strict:
+            self.validate_response(data)
+        return extract_generated_texts(data)
+
+    def validate_batch(self, batch: List[Dict[str, Any]]) -> List[List[str]]:
+        """
+        Validate many responses at once and return the texts of each.
+
+        :param batch: The decoded responses.
+        :return: One list of generated texts per response.
+        """
+        results = []
+        for index, data in enumerate(batch):
+            try:
+                results.append(self.validate_and_extract(data))
+            except ValueError as e:
+                raise ValueError(f"Response {index}: {e}") from None
+        return results
 
     def validate_response(self, data: Dict[str, Any]) -> None:
         """
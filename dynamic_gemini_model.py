@@ -1,23 +1,214 @@
 # dynamic_gemini_model.py
 
-import google.generativeai as genai
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from background_loop import run_sync
+from hedging import hedged, hedger as default_hedger
+from key_pool import get_key_pool
+from model_registry import get_async_model, get_model
+from rate_limiter import estimate_tokens, get_limiter
+from resilience import resilience
+from scheduler import INTERACTIVE, NORMAL, get_scheduler
+
+
+@dataclass
+class GenerationMetrics:
+    """
+    Timings recorded for one streamed generation.
+    """
+
+    time_to_first_token: Optional[float] = None
+    total_time: float = 0.0
+    chunks: int = 0
+    tokens: int = 0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.total_time if self.total_time else 0.0
 
 
 class DynamicGeminiModel:
-    def __init__(self, api_key):
-        self.api_key = api_key
-        self.configure_models()
-
-    def configure_models(self):
-        genai.configure(api_key=self.api_key)
-        self.text_model = genai.GenerativeModel("gemini-pro")
-        self.vision_model = genai.GenerativeModel("gemini-pro-vision")
-
-    def generate_response(self, prompt, is_image_present=False):
-        model = self.vision_model if is_image_present else self.text_model
-        response = model.generate_content(prompt)
+    TEXT_MODEL = "gemini-pro"
+    VISION_MODEL = "gemini-pro-vision"
+    # Number of recent streamed generations whose metrics are kept.
+    METRICS_HISTORY = 100
+
+    def __init__(self, api_key=None, key_pool=None, hedger=None):
+        """
+        :param api_key: A single API key to use; omit to use the configured pool.
+        :param key_pool: The ``KeyPool`` each call draws its key from.
+        :param hedger: The ``Hedger`` duplicating slow calls; defaults to the
+            shared one, which exists only when ``hedge_requests`` is enabled.
+        """
+        self.key_pool = key_pool or get_key_pool(api_key)
+        self.hedger = hedger or default_hedger
+        self.metrics = deque(maxlen=self.METRICS_HISTORY)
+
+    def generate_response(self, prompt, is_image_present=False, priority=NORMAL):
+        # Thin wrapper: the call runs on the shared background loop.
+        return run_sync(
+            self.generate_response_async(prompt, is_image_present, priority)
+        )
+
+    async def generate_response_async(
+        self, prompt, is_image_present=False, priority=NORMAL
+    ):
+        """
+        Generate a response without blocking a thread for the whole call.
+
+        :param priority: Scheduling class of the call (see ``scheduler``).
+        """
+        model_name = self.VISION_MODEL if is_image_present else self.TEXT_MODEL
+        scheduler = get_scheduler(model_name)
+        deadline = scheduler.deadline(priority)
+        response = await resilience.call_async(
+            model_name,
+            lambda: scheduler.call_async(
+                lambda: self._generate_once(model_name, prompt),
+                priority,
+                deadline,
+            ),
+        )
         return response.text
 
+    async def _generate_once(self, model_name, prompt):
+        # Each attempt leases a key, so a retry after a quota error moves on
+        # to another key in the pool. Only the call itself is hedged, so the
+        # hedge delay is not inflated by time spent queued for a slot; a
+        # backup copy uses the same key, so it is charged to its limiter.
+        with self.key_pool.lease(model_name) as key:
+            model = get_async_model(model_name, key)
+            limiter = get_limiter(model_name, key)
+            tokens = estimate_tokens(prompt)
+            return await limiter.call_async(
+                lambda: hedged(
+                    self.hedger,
+                    model_name,
+                    lambda: model.generate_content_async(prompt),
+                    lambda: limiter.try_reserve(tokens),
+                ),
+                tokens,
+            )
+
+    def _leased_stream(self, model_name, prompt):
+        # The key stays leased until the stream is exhausted or closed, so a
+        # quota or auth error part way through still cools the key down.
+        with self.key_pool.lease(model_name) as key:
+            model = get_model(model_name, key)
+            response = get_limiter(model_name, key).call(
+                lambda: model.generate_content(prompt, stream=True),
+                estimate_tokens(prompt),
+            )
+            yield from response
+
+    def _open_stream(self, model_name, prompt):
+        """
+        Start a stream; return its first chunk (None if empty) and the rest.
+        """
+        chunks = self._leased_stream(model_name, prompt)
+        return next(chunks, None), chunks
+
+    async def _leased_stream_async(self, model_name, prompt):
+        with self.key_pool.lease(model_name) as key:
+            model = get_async_model(model_name, key)
+            response = await get_limiter(model_name, key).call_async(
+                lambda: model.generate_content_async(prompt, stream=True),
+                estimate_tokens(prompt),
+            )
+            async for chunk in response:
+                yield chunk
+
+    async def _open_stream_async(self, model_name, prompt):
+        chunks = self._leased_stream_async(model_name, prompt)
+        try:
+            return await chunks.__anext__(), chunks
+        except StopAsyncIteration:
+            return None, chunks
+
+    def stream_response(self, prompt, is_image_present=False, priority=INTERACTIVE):
+        """
+        Yield the response text chunk by chunk as the model produces it.
+
+        Time to first token, total time, chunk count and an estimated token
+        count are appended to ``metrics`` when the stream finishes or is
+        closed early. Someone is usually watching a stream, so it is
+        scheduled as interactive by default; the scheduler slot is held
+        while the stream is opened.
+        """
+        model_name = self.VISION_MODEL if is_image_present else self.TEXT_MODEL
+        scheduler = get_scheduler(model_name)
+        deadline = scheduler.deadline(priority)
+        metrics = GenerationMetrics()
+        started = time.perf_counter()
+        chunks = None
+        try:
+            # Only opening the stream (up to its first chunk) is retried; text
+            # already yielded cannot be taken back if it fails part way.
+            first, chunks = resilience.call(
+                model_name,
+                lambda: scheduler.call(
+                    lambda: self._open_stream(model_name, prompt), priority, deadline
+                ),
+            )
+            if first is not None:
+                yield self._record_chunk(metrics, started, first.text)
+            for chunk in chunks:
+                yield self._record_chunk(metrics, started, chunk.text)
+        finally:
+            if chunks is not None:
+                chunks.close()
+            metrics.total_time = time.perf_counter() - started
+            self.metrics.append(metrics)
+
+    async def stream_response_async(
+        self, prompt, is_image_present=False, priority=INTERACTIVE
+    ):
+        """
+        Async counterpart of ``stream_response``, run on the shared loop.
+
+        Cancelling the task iterating it cancels the underlying gRPC stream,
+        so an abandoned generation stops using quota straight away.
+        """
+        model_name = self.VISION_MODEL if is_image_present else self.TEXT_MODEL
+        scheduler = get_scheduler(model_name)
+        deadline = scheduler.deadline(priority)
+        metrics = GenerationMetrics()
+        started = time.perf_counter()
+        chunks = None
+        try:
+            first, chunks = await resilience.call_async(
+                model_name,
+                lambda: scheduler.call_async(
+                    lambda: self._open_stream_async(model_name, prompt),
+                    priority,
+                    deadline,
+                ),
+            )
+            if first is not None:
+                yield self._record_chunk(metrics, started, first.text)
+            async for chunk in chunks:
+                yield self._record_chunk(metrics, started, chunk.text)
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+            metrics.total_time = time.perf_counter() - started
+            self.metrics.append(metrics)
+
+    @staticmethod
+    def _record_chunk(metrics, started, text):
+        if metrics.time_to_first_token is None:
+            metrics.time_to_first_token = time.perf_counter() - started
+        metrics.chunks += 1
+        metrics.tokens += estimate_tokens(text)
+        return text
+
+    @property
+    def last_metrics(self) -> Optional[GenerationMetrics]:
+        return self.metrics[-1] if self.metrics else None
+
     def adjust_temperature(self, prompt_complexity):
         temperature = 0.4 if prompt_complexity < 5 else 0.9
         return temperature
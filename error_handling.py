@@ -59,13 +59,21 @@ def index():
 
 
 # error_handling.py
+import logging
+from resilience import is_retryable, resilience
+
+
 class ErrorHandling:
     @staticmethod
     def handle_api_error(error):
-        # Custom error handling logic
-        pass
+        # Log the failure and tell the caller whether retrying can help
+        retryable = is_retryable(error)
+        logging.error(
+            f"API error ({'transient' if retryable else 'permanent'}): {error}"
+        )
+        return retryable
 
     @staticmethod
     def optimize_performance():
-        # Logic to optimize API calls and processing
-        pass
+        # Breaker state and retry counters for every upstream endpoint
+        return resilience.stats()
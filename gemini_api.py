@@ -1,8 +1,15 @@
 # gemini_api.py
 
-import google.generativeai as genai
+from key_pool import get_key_pool
+from model_registry import get_model
 
 
-def configure_gemini_model(model_name, api_key):
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel(model_name=model_name)
+def configure_gemini_model(model_name, api_key=None, key_pool=None):
+    """
+    Return a model handle bound to the next key from the pool.
+
+    :param api_key: A single API key to use; omit to use the configured pool.
+    :param key_pool: The ``KeyPool`` to draw the key from.
+    """
+    key = (key_pool or get_key_pool(api_key)).acquire(model_name, hold=False)
+    return get_model(model_name, key)
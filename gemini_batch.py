@@ -0,0 +1,59 @@
+# gemini_batch.py
+import asyncio
+import time
+
+from batching import bounded_map
+from scheduler import BATCH
+
+
+async def generate_many(
+    items,
+    text_model=None,
+    vision_api=None,
+    concurrency=8,
+    call_timeout=60.0,
+    deadline=None,
+    ordered=True,
+    priority=BATCH,
+):
+    """
+    Run many Gemini prompts and image+text pairs concurrently.
+
+    Each item is either a prompt string, sent to ``text_model``, or a
+    ``(text, image)`` pair, sent to ``vision_api``. Results are yielded as
+    ``BatchResult`` objects whose value is the generated text; a failed or
+    timed-out call is yielded with its error instead of stopping the batch.
+
+    :param items: Prompts and ``(text, image)`` pairs, read lazily.
+    :param text_model: A ``DynamicGeminiModel`` for text prompts.
+    :param vision_api: A ``GeminiVisionProAPI`` for image+text pairs.
+    :param concurrency: Maximum number of calls in flight.
+    :param call_timeout: Seconds allowed for each call.
+    :param deadline: Seconds allowed for the whole batch; calls still pending
+        when it passes fail with ``asyncio.TimeoutError``.
+    :param ordered: Yield results in input order instead of completion order.
+    :param priority: Scheduling class of the calls (see ``scheduler``).
+    """
+    batch_deadline = None if deadline is None else time.monotonic() + deadline
+
+    async def generate(item):
+        timeout = call_timeout
+        if batch_deadline is not None:
+            remaining = batch_deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("batch deadline exceeded")
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        if isinstance(item, str):
+            call = text_model.generate_response_async(item, priority=priority)
+        else:
+            text, image = item
+            call = _vision_text(vision_api, text, image, priority)
+        return await asyncio.wait_for(call, timeout)
+
+    async for result in bounded_map(generate, items, concurrency, ordered):
+        yield result
+
+
+async def _vision_text(vision_api, text, image, priority):
+    response = await vision_api.generate_content_async(text, image, priority=priority)
+    return response.text
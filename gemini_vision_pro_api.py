@@ -1,11 +1,45 @@
 # gemini_vision_pro_api.py
-import google.generativeai as genai
+from background_loop import run_sync
+from hedging import hedged, hedger as default_hedger
+from key_pool import get_key_pool
+from model_registry import get_async_model
+from rate_limiter import estimate_tokens, get_limiter
+from resilience import resilience
+from scheduler import NORMAL, get_scheduler
 
 
 class GeminiVisionProAPI:
-    def __init__(self, api_key):
-        genai.configure(api_key=api_key)
+    MODEL = "gemini-pro-vision"
 
-    def generate_content(self, text, image):
-        model = genai.GenerativeModel("gemini-pro-vision")
-        return model.generate_content([text, image])
+    def __init__(self, api_key=None, key_pool=None, hedger=None):
+        self.key_pool = key_pool or get_key_pool(api_key)
+        self.hedger = hedger or default_hedger
+
+    def generate_content(self, text, image, priority=NORMAL):
+        # Thin wrapper: the call runs on the shared background loop.
+        return run_sync(self.generate_content_async(text, image, priority))
+
+    async def generate_content_async(self, text, image, priority=NORMAL):
+        scheduler = get_scheduler(self.MODEL)
+        deadline = scheduler.deadline(priority)
+        return await resilience.call_async(
+            self.MODEL,
+            lambda: scheduler.call_async(
+                lambda: self._generate_once(text, image), priority, deadline
+            ),
+        )
+
+    async def _generate_once(self, text, image):
+        with self.key_pool.lease(self.MODEL) as key:
+            model = get_async_model(self.MODEL, key)
+            limiter = get_limiter(self.MODEL, key)
+            tokens = estimate_tokens(text)
+            return await limiter.call_async(
+                lambda: hedged(
+                    self.hedger,
+                    self.MODEL,
+                    lambda: model.generate_content_async([text, image]),
+                    lambda: limiter.try_reserve(tokens),
+                ),
+                tokens,
+            )
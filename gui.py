@@ -1,33 +1,256 @@
-import asyncio
-from tkinter import Tk, Entry, Button, Text, Scrollbar, END
+import logging
+import queue
+from collections import deque
+from tkinter import (
+    Tk,
+    BooleanVar,
+    Checkbutton,
+    Entry,
+    Button,
+    Frame,
+    Label,
+    Text,
+    Scrollbar,
+    END,
+)
+from tkinter import ttk
 from api_handler import APIHandler
+from background_loop import BackgroundLoop
+from dynamic_gemini_model import DynamicGeminiModel
 
 
 class GUI:
-    def __init__(self):
+    # How often (ms) the Tk thread drains results finished on the background loop.
+    POLL_INTERVAL = 50
+    # Upper bounds on the work done by one rendering tick on the Tk thread.
+    RENDER_CHUNK_LINES = 200
+    RENDER_CHUNK_CHARS = 64 * 1024
+
+    def __init__(
+        self,
+        debounce_ms=400,
+        max_scrollback_lines=5000,
+        history_path="gui_history.txt",
+    ):
+        """
+        :param debounce_ms: Idle time after the last keystroke before a live
+            query is sent.
+        :param max_scrollback_lines: Lines kept in the response widget; older
+            lines are moved to ``history_path``.
+        :param history_path: File receiving lines trimmed from the widget.
+        """
         self.api_handler = APIHandler(self)
+        # All network I/O runs on one background event loop so the Tk thread
+        # never blocks; finished requests come back through a thread-safe queue.
+        self.loop = BackgroundLoop(name="gui-asyncio").start()
+        self.results = queue.Queue()
+        self.pending = {}
+        # Every submission gets the next generation; results from an older
+        # generation are stale and dropped instead of overwriting newer ones.
+        self.generation = 0
+        self.debounce_ms = debounce_ms
+        self.debounce_id = None
+        self.last_live_query = None
+        self.render_queue = deque()
+        # Streamed chunks arrive as (generation, text); text None ends a stream.
+        self.stream_chunks = queue.Queue()
+        self.streams = {}
+        self.stream_model = None
+        self.render_id = None
+        self.max_scrollback_lines = max_scrollback_lines
+        self.history_path = history_path
         self.root = Tk()
         self.root.title("Generative Language API GUI")
+        self.root.protocol("WM_DELETE_WINDOW", self.shutdown)
         self.query_entry = Entry(self.root, width=50)
+        self.query_entry.bind("<KeyRelease>", self.handle_keystroke)
+        self.live_mode = BooleanVar(self.root, value=False)
+        self.live_toggle = Checkbutton(
+            self.root, text="Live query", variable=self.live_mode
+        )
         self.submit_button = Button(
             self.root, text="Submit", command=self.handle_user_input
         )
+        self.stream_button = Button(
+            self.root, text="Stream (Gemini)", command=self.handle_stream_input
+        )
+        self.progress_frame = Frame(self.root)
         self.response_text = Text(self.root, width=50, height=10)
         self.scrollbar = Scrollbar(self.root, command=self.response_text.yview)
         self.response_text["yscrollcommand"] = self.scrollbar.set
 
     def run(self):
+        self.layout()
+        self.root.after(self.POLL_INTERVAL, self.drain_results)
+        self.root.mainloop()
+
+    def layout(self):
         self.query_entry.pack()
         self.submit_button.pack()
+        self.stream_button.pack()
+        self.live_toggle.pack()
+        self.progress_frame.pack(fill="x")
         self.response_text.pack(side="left", fill="y")
         self.scrollbar.pack(side="right", fill="y")
-        self.root.mainloop()
+
+    def shutdown(self):
+        self.loop.run(self.api_handler.close())
+        self.loop.stop()
+        self.root.destroy()
 
     def handle_user_input(self):
         query = self.query_entry.get()
-        asyncio.run(self.api_handler.make_async_request(query))
+        self.generation += 1
+        self.cancel_superseded()
+        future = self.loop.submit(
+            self.api_handler.make_async_request(query, display=False)
+        )
+        self.pending[future] = (self.generation, self.show_progress(query))
+        future.add_done_callback(self.results.put)
+
+    def handle_stream_input(self):
+        """
+        Stream a Gemini response for the query into the response widget.
+
+        The stream is read by a task on the background loop; chunks reach Tk
+        through ``stream_chunks`` and are rendered as they arrive.
+        """
+        query = self.query_entry.get()
+        self.generation += 1
+        self.cancel_superseded()
+        if self.stream_model is None:
+            self.stream_model = DynamicGeminiModel()
+        future = self.loop.submit(self.stream_worker(self.generation, query))
+        self.streams[self.generation] = (future, self.show_progress(query))
+
+    async def stream_worker(self, generation, query):
+        try:
+            async for chunk in self.stream_model.stream_response_async(query):
+                self.stream_chunks.put((generation, chunk))
+        except Exception as e:
+            logging.error(f"Streaming failed: {e}")
+        finally:
+            self.stream_chunks.put((generation, None))
+
+    def cancel_superseded(self):
+        """
+        Cancel every in-flight request and stream from an older generation.
+
+        Cancelling the future cancels its task on the background loop, which
+        aborts the aiohttp request and releases its connection, or cancels
+        the gRPC stream without waiting for its next chunk. Lines queued
+        for rendering all belong to older generations, so they are dropped.
+        """
+        for future, (generation, _) in self.pending.items():
+            if generation < self.generation:
+                future.cancel()
+        for generation, (future, _) in self.streams.items():
+            if generation < self.generation:
+                future.cancel()
+        self.render_queue.clear()
+
+    def handle_keystroke(self, event=None):
+        """
+        In live mode, (re)start the debounce timer on every keystroke.
+        """
+        if not self.live_mode.get():
+            return
+        if self.debounce_id is not None:
+            self.root.after_cancel(self.debounce_id)
+        self.debounce_id = self.root.after(self.debounce_ms, self.submit_live_query)
+
+    def submit_live_query(self):
+        """
+        Send the live query once typing has been idle for ``debounce_ms``.
+        """
+        self.debounce_id = None
+        query = self.query_entry.get()
+        if query.strip() and query != self.last_live_query:
+            self.last_live_query = query
+            self.handle_user_input()
+
+    def show_progress(self, query):
+        """
+        Add a row with an indeterminate progress bar for one in-flight query.
+        """
+        row = Frame(self.progress_frame)
+        Label(row, text=query[:40], anchor="w", width=40).pack(side="left")
+        bar = ttk.Progressbar(row, mode="indeterminate", length=100)
+        bar.pack(side="right")
+        bar.start()
+        row.pack(fill="x")
+        return row
+
+    def drain_results(self):
+        """
+        Display every finished request, then re-arm the poll on the Tk thread.
+        """
+        while True:
+            try:
+                future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            generation, row = self.pending.pop(future)
+            row.destroy()
+            if future.cancelled() or generation != self.generation:
+                continue
+            if future.exception() is not None:
+                logging.error(f"Request failed: {future.exception()}")
+                continue
+            self.display_responses(future.result())
+        while True:
+            try:
+                generation, chunk = self.stream_chunks.get_nowait()
+            except queue.Empty:
+                break
+            if chunk is None:
+                self.streams.pop(generation)[1].destroy()
+            elif generation == self.generation:
+                self.render_queue.append(chunk)
+                if self.render_id is None:
+                    self.render_id = self.root.after_idle(self.render_chunk)
+        self.root.after(self.POLL_INTERVAL, self.drain_results)
 
     def display_responses(self, responses):
-        self.response_text.delete(1.0, END)
+        """
+        Queue responses for rendering; they are appended in bounded chunks.
+        """
         for response in responses:
-            self.response_text.insert(END, response + "\n")
+            self.render_queue.extend(line + "\n" for line in response.split("\n"))
+        if self.render_id is None:
+            self.render_id = self.root.after_idle(self.render_chunk)
+
+    def render_chunk(self):
+        """
+        Append at most one chunk of queued lines, then yield back to Tk.
+        """
+        lines = []
+        chars = 0
+        while (
+            self.render_queue
+            and len(lines) < self.RENDER_CHUNK_LINES
+            and chars < self.RENDER_CHUNK_CHARS
+        ):
+            line = self.render_queue.popleft()
+            lines.append(line)
+            chars += len(line)
+        self.response_text.insert(END, "".join(lines))
+        self.trim_scrollback()
+        self.response_text.see(END)
+        if self.render_queue:
+            self.render_id = self.root.after(1, self.render_chunk)
+        else:
+            self.render_id = None
+
+    def trim_scrollback(self):
+        """
+        Move lines beyond ``max_scrollback_lines`` from the widget to the history file.
+        """
+        line_count = int(self.response_text.index("end-1c").split(".")[0])
+        excess = line_count - self.max_scrollback_lines
+        if excess <= 0:
+            return
+        cutoff = f"{excess + 1}.0"
+        with open(self.history_path, "a", encoding="utf-8") as history:
+            history.write(self.response_text.get("1.0", cutoff))
+        self.response_text.delete("1.0", cutoff)
@@ -0,0 +1,196 @@
+# hedging.py
+import asyncio
+import threading
+import time
+from collections import deque
+
+from config import config
+
+
+class LatencyWindow:
+    """
+    The most recent call latencies of one endpoint.
+
+    The percentile is recomputed every ``refresh`` samples rather than on
+    every call, so reading it stays cheap on hot paths.
+    """
+
+    def __init__(self, size=1000, refresh=50):
+        self.samples = deque(maxlen=size)
+        self.refresh = refresh
+        self._since_refresh = 0
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, latency) -> None:
+        self.samples.append(latency)
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh:
+            self._since_refresh = 0
+            self._cache.clear()
+
+    def percentile(self, fraction) -> float:
+        value = self._cache.get(fraction)
+        if value is None:
+            ordered = sorted(self.samples)
+            index = min(len(ordered) - 1, int(fraction * len(ordered)))
+            value = ordered[index]
+            self._cache[fraction] = value
+        return value
+
+
+class Hedger:
+    """
+    Sends a backup copy of a slow call and keeps whichever answer comes first.
+
+    A call still running after the ``percentile`` latency recently observed for
+    its endpoint is duplicated; the first copy to succeed wins and the other is
+    cancelled. Hedges are only sent while they stay under ``max_extra`` of the
+    endpoint's calls, so a slow upstream is not hit with twice the load, and
+    only when the caller's ``reserve`` callback finds budget for the copy.
+
+    The latency window only learns how long primaries take. When a hedge
+    wins, the cancelled primary's time so far is recorded: it is already past
+    the hedge delay, so hedging does not drag its own trigger down.
+    """
+
+    def __init__(self, percentile=0.95, max_extra=0.1, window=1000, min_samples=20):
+        """
+        :param percentile: Latency percentile (0-1) after which to hedge.
+        :param max_extra: Maximum hedges as a fraction of calls.
+        :param window: Number of recent latencies kept per endpoint.
+        :param min_samples: Latencies needed before an endpoint is hedged.
+        """
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._counters = {}
+
+    def _endpoint(self, endpoint):
+        window = self._windows.get(endpoint)
+        if window is None:
+            window = LatencyWindow(self.window)
+            self._windows[endpoint] = window
+            self._counters[endpoint] = {
+                "calls": 0,
+                "hedges": 0,
+                "hedge_wins": 0,
+                "no_budget": 0,
+            }
+        return window, self._counters[endpoint]
+
+    def hedge_delay(self, endpoint):
+        """
+        Seconds to wait before hedging a call, or None if it should not be.
+        """
+        with self._lock:
+            window, _ = self._endpoint(endpoint)
+            if len(window) < self.min_samples:
+                return None
+            return window.percentile(self.percentile)
+
+    def _start_hedge(self, endpoint, reserve=None) -> bool:
+        with self._lock:
+            _, counters = self._endpoint(endpoint)
+            if counters["hedges"] + 1 > self.max_extra * counters["calls"]:
+                return False
+            if reserve is not None and not reserve():
+                counters["no_budget"] += 1
+                return False
+            counters["hedges"] += 1
+            return True
+
+    def _record(self, endpoint, latency, hedge_won=False):
+        with self._lock:
+            window, counters = self._endpoint(endpoint)
+            if latency is not None:
+                window.add(latency)
+            counters["hedge_wins"] += hedge_won
+
+    async def call(self, endpoint, func, reserve=None):
+        """
+        Await ``func()``, hedging it with a second ``func()`` if it is slow.
+
+        :param endpoint: Name of the upstream endpoint the call goes to.
+        :param func: A zero-argument coroutine function making one request.
+        :param reserve: Called before a hedge is sent; returns whether budget
+            (e.g. ``RateLimiter.try_reserve``) was taken for the extra copy.
+        """
+        with self._lock:
+            self._endpoint(endpoint)[1]["calls"] += 1
+        delay = self.hedge_delay(endpoint)
+        started = time.perf_counter()
+        primary = asyncio.ensure_future(func())
+        tasks = [primary]
+        try:
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                if not primary.done() and self._start_hedge(endpoint, reserve):
+                    tasks.append(asyncio.ensure_future(func()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    winner = primary if primary in winners else winners[0]
+                    # The primary's latency: its full time if it won, its
+                    # time so far if a hedge beat it; nothing if it had
+                    # already failed, as the hedge's time is not its own.
+                    latency = time.perf_counter() - started
+                    if winner is not primary and primary.done():
+                        latency = None
+                    self._record(endpoint, latency, hedge_won=winner is not primary)
+                    return winner.result()
+            # Every copy failed: report the primary's error.
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """
+        Return hedging counters and the current hedge delay per endpoint.
+        """
+        with self._lock:
+            result = {}
+            for endpoint, window in self._windows.items():
+                counters = dict(self._counters[endpoint])
+                counters["extra_load"] = (
+                    counters["hedges"] / counters["calls"] if counters["calls"] else 0.0
+                )
+                counters["hedge_delay"] = (
+                    window.percentile(self.percentile)
+                    if len(window) >= self.min_samples
+                    else None
+                )
+                result[endpoint] = counters
+            return result
+
+
+async def hedged(hedger, endpoint, func, reserve=None):
+    """
+    Await ``func()`` through ``hedger``, or directly when hedging is off.
+    """
+    if hedger is None:
+        return await func()
+    return await hedger.call(endpoint, func, reserve)
+
+
+# Hedging is opt-in: set "hedge_requests" to enable the shared hedger.
+hedger = (
+    Hedger(
+        percentile=config.get("hedge_percentile", 0.95),
+        max_extra=config.get("hedge_max_extra", 0.1),
+        window=config.get("hedge_window", 1000),
+    )
+    if config.get("hedge_requests", False)
+    else None
+)
@@ -0,0 +1,332 @@
+# job_queue.py
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    """
+    Raised by ``JobQueue.submit`` when ``max_depth`` jobs are already waiting.
+    """
+
+
+class JobQueue:
+    """
+    A submit/poll queue of long-running calls backed by one SQLite file.
+
+    Every web worker process on a host opens the same database, so a job can
+    be polled from whichever worker the next request lands on, and the depth
+    limit applies to the host rather than to one process. Each process runs
+    ``workers`` threads that claim queued jobs in immediate transactions, so
+    a job is run exactly once. Finished jobs keep their result for ``ttl``
+    seconds, and at most ``max_results`` of them are kept.
+
+    Threads are started on first use rather than on construction, so a queue
+    created before a server forks its workers still runs in each of them.
+    """
+
+    def __init__(
+        self,
+        path,
+        handler,
+        workers=4,
+        max_depth=64,
+        ttl=3600.0,
+        max_results=1000,
+        poll_interval=0.25,
+        stale_after=900.0,
+        purge_interval=10.0,
+    ):
+        """
+        :param path: The SQLite database file.
+        :param handler: Called with a job's payload in a worker thread; its
+            return value is the job's result. Both must be picklable.
+        :param workers: Worker threads per process.
+        :param max_depth: Maximum number of queued (not yet running) jobs.
+        :param ttl: Seconds a finished job's result is kept.
+        :param max_results: Maximum number of finished jobs kept.
+        :param poll_interval: Seconds between checks for work or results
+            coming from other processes.
+        :param stale_after: Seconds after which a running job is assumed lost
+            with its worker and marked failed.
+        :param purge_interval: Seconds between clean-ups of lost and expired
+            jobs while the queue is idle; every finished job also runs one.
+        """
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self.max_results = max_results
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        # Updated by request and worker threads alike.
+        self._counter_lock = threading.Lock()
+        self._counters = {
+            "submitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "total_wait": 0.0,
+        }
+
+    def _count(self, counter, amount=1):
+        with self._counter_lock:
+            self._counters[counter] += amount
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload BLOB, "
+                "result BLOB, error TEXT, created_at REAL NOT NULL, "
+                "started_at REAL, finished_at REAL, expires_at REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def start(self):
+        """
+        Start this process's worker threads if they are not running.
+        """
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the worker threads once their current jobs finish.
+        """
+        self._stopping.set()
+        with self._changed:
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._start_lock:
+            self._threads, self._pid = [], None
+
+    def submit(self, payload) -> str:
+        """
+        Queue ``payload`` for the handler and return the new job's id.
+
+        :raises QueueFull: If ``max_depth`` jobs are already queued.
+        """
+        self.start()
+        job_id = uuid.uuid4().hex
+        blob = pickle.dumps(payload, protocol=4)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            (depth,) = connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()
+            if depth >= self.max_depth:
+                self._count("rejected")
+                raise QueueFull(f"{depth} jobs are already queued")
+            connection.execute(
+                "INSERT INTO jobs (id, status, payload, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, blob, time.time()),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._count("submitted")
+        with self._changed:
+            self._changed.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Return the state of a job, or None if it is unknown or has expired.
+
+        The dict has ``id``, ``status`` and ``queued_seconds``, plus
+        ``result`` once the job is done or ``error`` if it failed.
+        """
+        self.start()
+        row = (
+            self._connection()
+            .execute(
+                "SELECT status, result, error, created_at, started_at, "
+                "finished_at, expires_at FROM jobs WHERE id = ?",
+                (job_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        status, result, error, created_at, started_at, finished_at, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        job = {
+            "id": job_id,
+            "status": status,
+            "queued_seconds": (started_at or time.time()) - created_at,
+        }
+        if finished_at is not None:
+            job["run_seconds"] = finished_at - started_at
+        if status == DONE:
+            job["result"] = pickle.loads(result)
+        elif status == FAILED:
+            job["error"] = error
+        return job
+
+    def wait(self, job_id, timeout):
+        """
+        Return the job's state once it has finished or ``timeout`` elapses.
+
+        Jobs finished in this process wake the caller at once; ones finished
+        by another process are noticed within ``poll_interval``.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in (DONE, FAILED) or remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, self.poll_interval))
+
+    def _claim(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT id, payload, created_at FROM jobs WHERE status = ? "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            now = time.time()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                    (RUNNING, now, row[0]),
+                )
+            elif now - self._purged_at >= self.purge_interval:
+                # Nothing finishes on an idle queue, so lost and expired jobs
+                # are cleaned up here rather than only in _finish.
+                self._purge(connection, now)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return row
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logging.error(f"Could not claim a job: {e}")
+                row = None
+            if row is None:
+                with self._changed:
+                    self._changed.wait(self.poll_interval)
+                continue
+            job_id, payload, created_at = row
+            self._count("total_wait", time.time() - created_at)
+            # Counted before the job is marked finished, so anyone who sees
+            # it finished also sees it in stats().
+            try:
+                result = self.handler(pickle.loads(payload))
+            except Exception as e:
+                logging.error(f"Job {job_id} failed: {e}")
+                self._count("failed")
+                self._finish(job_id, FAILED, error=f"{type(e).__name__}: {e}")
+            else:
+                self._count("completed")
+                self._finish(job_id, DONE, result=pickle.dumps(result, protocol=4))
+            with self._changed:
+                self._changed.notify_all()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # The payload (e.g. an image) is not needed any more.
+            connection.execute(
+                "UPDATE jobs SET status = ?, payload = NULL, result = ?, "
+                "error = ?, finished_at = ?, expires_at = ? WHERE id = ?",
+                (status, result, error, now, now + self.ttl, job_id),
+            )
+            self._purge(connection, now)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _purge(self, connection, now):
+        self._purged_at = now
+        connection.execute(
+            "UPDATE jobs SET status = ?, payload = NULL, error = ?, "
+            "finished_at = ?, expires_at = ? WHERE status = ? AND started_at < ?",
+            (
+                FAILED,
+                "worker lost",
+                now,
+                now + self.ttl,
+                RUNNING,
+                now - self.stale_after,
+            ),
+        )
+        connection.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+        connection.execute(
+            "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs "
+            "WHERE finished_at IS NOT NULL ORDER BY finished_at DESC "
+            "LIMIT -1 OFFSET ?)",
+            (self.max_results,),
+        )
+
+    def stats(self) -> dict:
+        """
+        Return the host-wide job counts and this process's counters.
+        """
+        counts = dict(
+            self._connection()
+            .execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            .fetchall()
+        )
+        with self._counter_lock:
+            counters = dict(self._counters)
+        total_wait = counters.pop("total_wait")
+        started = counters["completed"] + counters["failed"]
+        return {
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "finished": counts.get(DONE, 0) + counts.get(FAILED, 0),
+            "max_depth": self.max_depth,
+            **counters,
+            "mean_queue_wait": total_wait / started if started else 0.0,
+        }
@@ -0,0 +1,223 @@
+# json_decoding.py
+import codecs
+import json
+import re
+
+try:
+    import ujson as _json
+except ImportError:  # ujson is optional; fall back to the standard library.
+    _json = json
+
+DECODER_NAME = _json.__name__
+
+
+def decode(body: bytes):
+    """
+    Decode a JSON body with the fastest available decoder.
+
+    :param body: The raw response body.
+    :return: The decoded document.
+    """
+    try:
+        return _json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON response: {e}") from None
+
+
+class PredictionStreamParser:
+    """
+    Incrementally extract ``predictions[*].generated_text`` from a response body.
+
+    Chunks are fed as they arrive. The top-level object is scanned key by key
+    (values of other keys are skipped without being decoded), and each
+    complete prediction is decoded on its own and only its ``generated_text``
+    is kept, so the whole body is never held in memory or decoded at once.
+    Scanning resumes where the previous chunk left off, so every byte is
+    looked at once however the body is split. The body is expected to have
+    the generation API's shape, ``{"predictions": [{"generated_text": ...}]}``.
+    """
+
+    _WHITESPACE = " \t\n\r"
+    # What ends or nests a value, inside a string, inside a container and at
+    # the top of a value (where a comma or whitespace ends a number).
+    _STRING_SPECIAL = re.compile(r'["\\]')
+    _NESTED_SPECIAL = re.compile(r'["\[\]{}]')
+    _TOP_SPECIAL = re.compile(r'["\[\]{},\s]')
+
+    def __init__(self):
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        # Where the key or prediction being scanned starts, and its text from
+        # earlier chunks; None while a value that is skipped is scanned.
+        self._start = None
+        self._pieces = []
+        self._state = "object"
+        self._key = None
+        self._depth = 0
+        self._in_string = False
+        self.texts = []
+
+    @property
+    def _done(self):
+        return self._state == "done"
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Consume the next chunk of the body.
+        """
+        self._buffer += self._text.decode(chunk)
+        self._parse()
+
+    def close(self) -> list:
+        """
+        Finish parsing and return the generated texts.
+
+        :raises ValueError: If the body was truncated or has the wrong shape.
+        """
+        self._buffer += self._text.decode(b"", final=True)
+        self._parse()
+        if self._state == "end":
+            raise ValueError("No predictions found in the response")
+        if not self._done:
+            raise ValueError("Response ended before the predictions list was closed")
+        if not self.texts:
+            raise ValueError("No predictions found in the response")
+        return self.texts
+
+    def _next(self):
+        """
+        Skip whitespace and return the next character, or None if none yet.
+        """
+        buffer = self._buffer
+        position = self._position
+        while position < len(buffer) and buffer[position] in self._WHITESPACE:
+            position += 1
+        self._position = position
+        return buffer[position] if position < len(buffer) else None
+
+    def _begin(self, state, keep=True):
+        self._state = state
+        self._start = self._position if keep else None
+
+    def _scan(self) -> bool:
+        """
+        Advance over the current value; return whether its end was reached.
+        """
+        buffer = self._buffer
+        position = self._position
+        while True:
+            if self._in_string:
+                match = self._STRING_SPECIAL.search(buffer, position)
+                if match is None:
+                    self._position = len(buffer)
+                    return False
+                position = match.start()
+                if buffer[position] == "\\":
+                    if position + 1 >= len(buffer):
+                        # The escaped character is in the next chunk.
+                        self._position = position
+                        return False
+                    position += 2
+                    continue
+                self._in_string = False
+                position += 1
+                if self._depth == 0:
+                    self._position = position
+                    return True
+                continue
+            pattern = self._TOP_SPECIAL if self._depth == 0 else self._NESTED_SPECIAL
+            match = pattern.search(buffer, position)
+            if match is None:
+                self._position = len(buffer)
+                return False
+            position = match.start()
+            char = buffer[position]
+            if char == '"':
+                self._in_string = True
+                position += 1
+            elif char in "[{":
+                self._depth += 1
+                position += 1
+            elif self._depth == 0:
+                # A comma, whitespace or closing bracket after a number,
+                # true, false or null.
+                self._position = position
+                return True
+            elif char in "]}":
+                self._depth -= 1
+                position += 1
+                if self._depth == 0:
+                    self._position = position
+                    return True
+
+    def _value(self):
+        self._pieces.append(self._buffer[self._start : self._position])
+        value = decode("".join(self._pieces))
+        self._pieces = []
+        self._start = None
+        return value
+
+    def _parse(self):
+        while self._state not in ("done", "end"):
+            state = self._state
+            if state in ("key_scan", "skip_scan", "element_scan"):
+                if not self._scan():
+                    break
+                if state == "key_scan":
+                    self._key = self._value()
+                    self._state = "colon"
+                elif state == "skip_scan":
+                    self._state = "key"
+                else:
+                    prediction = self._value()
+                    try:
+                        self.texts.append(prediction["generated_text"])
+                    except (KeyError, TypeError):
+                        raise ValueError("Invalid prediction format") from None
+                    self._state = "element"
+                continue
+            char = self._next()
+            if char is None:
+                break
+            if state == "object":
+                if char != "{":
+                    raise ValueError("Response must be a JSON object")
+                self._position += 1
+                self._state = "key"
+            elif state == "key":
+                if char == ",":
+                    self._position += 1
+                elif char == "}":
+                    self._state = "end"
+                elif char == '"':
+                    self._begin("key_scan")
+                else:
+                    raise ValueError("Invalid JSON response: expected a key")
+            elif state == "colon":
+                if char != ":":
+                    raise ValueError("Invalid JSON response: expected ':'")
+                self._position += 1
+                self._state = "array" if self._key == "predictions" else "skip"
+            elif state == "skip":
+                self._begin("skip_scan", keep=False)
+            elif state == "array":
+                if char != "[":
+                    raise ValueError("Predictions must be a list")
+                self._position += 1
+                self._state = "element"
+            elif state == "element":
+                if char == ",":
+                    self._position += 1
+                elif char == "]":
+                    # Whatever follows the list is not needed.
+                    self._state = "done"
+                else:
+                    self._begin("element_scan")
+        # Keep only text not scanned yet; the scanned part of a key or
+        # prediction in progress is set aside until it is complete.
+        if self._start is not None:
+            self._pieces.append(self._buffer[self._start : self._position])
+            self._start = 0
+        self._buffer = "" if self._done else self._buffer[self._position :]
+        self._position = 0
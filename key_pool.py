@@ -0,0 +1,223 @@
+# key_pool.py
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import aiohttp
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # The Gemini SDK is optional for the HTTP-only paths.
+    google_exceptions = None
+
+from config import config
+from rate_limiter import get_limiter
+from resilience import is_throttle, retry_after
+
+
+def is_auth_error(error) -> bool:
+    """
+    Return whether ``error`` means the API key itself was rejected.
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in (401, 403)
+    if google_exceptions is None:
+        return False
+    if isinstance(
+        error, (google_exceptions.PermissionDenied, google_exceptions.Unauthenticated)
+    ):
+        return True
+    # Gemini reports malformed or revoked keys as INVALID_ARGUMENT.
+    return isinstance(error, google_exceptions.InvalidArgument) and "API key" in str(
+        error
+    )
+
+
+def mask_key(key) -> str:
+    """
+    Return a label identifying ``key`` in logs and metrics without leaking it.
+
+    The last characters are kept for recognition, plus a short digest so
+    keys that share a suffix still get distinct labels.
+    """
+    if not key:
+        return "default"
+    digest = hashlib.blake2b(key.encode(), digest_size=3).hexdigest()
+    return f"...{key[-4:]}#{digest}"
+
+
+class KeyPool:
+    """
+    Spreads Gemini calls over several API keys.
+
+    Keys are handed out least-recently-used first (``"lru"``) or by the most
+    unspent rate-limit budget for the model (``"quota"``). A key whose call
+    fails with a quota error is skipped for as long as its ``Retry-After``
+    asks (``cooldown`` seconds without one); one that is rejected outright
+    is skipped for ``auth_cooldown`` seconds. When every key is cooling
+    down the one that recovers first is used rather than failing locally.
+    """
+
+    STRATEGIES = ("lru", "quota")
+
+    def __init__(self, keys, strategy="lru", cooldown=60.0, auth_cooldown=600.0):
+        """
+        :param keys: The API keys; ``None`` stands for the SDK's default key.
+        :param strategy: ``"lru"`` or ``"quota"``.
+        :param cooldown: Seconds a throttled key is taken out of rotation.
+        :param auth_cooldown: Seconds a rejected key is taken out of rotation.
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown key pool strategy: {strategy}")
+        self.keys = list(dict.fromkeys(keys)) or [None]
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.auth_cooldown = auth_cooldown
+        self._lock = threading.Lock()
+        self._usage = {
+            key: {
+                "requests": 0,
+                "successes": 0,
+                "failures": 0,
+                "cooldowns": 0,
+                "in_flight": 0,
+                "last_used": 0.0,
+                "cooling_until": 0.0,
+            }
+            for key in self.keys
+        }
+
+    def __len__(self):
+        return len(self.keys)
+
+    def acquire(self, model=None, hold=True):
+        """
+        Pick the key for the next call to ``model`` and count it as used.
+
+        :param hold: Count the key as in flight until ``release`` is called;
+            pass False when the key is bound to a long-lived handle instead.
+        """
+        with self._lock:
+            now = time.monotonic()
+            ready = [
+                key for key in self.keys if self._usage[key]["cooling_until"] <= now
+            ]
+            if not ready:
+                key = min(self.keys, key=lambda k: self._usage[k]["cooling_until"])
+            elif self.strategy == "quota" and model is not None:
+                key = max(
+                    ready,
+                    key=lambda k: (
+                        get_limiter(model, k).headroom(),
+                        -self._usage[k]["last_used"],
+                    ),
+                )
+            else:
+                key = min(ready, key=lambda k: self._usage[k]["last_used"])
+            usage = self._usage[key]
+            usage["requests"] += 1
+            usage["in_flight"] += hold
+            usage["last_used"] = now
+            return key
+
+    def release(self, key, error=None) -> None:
+        """
+        Record the outcome of a call made with ``key``.
+
+        :param error: The exception the call failed with, or None on success.
+        """
+        with self._lock:
+            usage = self._usage[key]
+            usage["in_flight"] -= 1
+            if error is None:
+                usage["successes"] += 1
+                return
+            usage["failures"] += 1
+            if is_auth_error(error):
+                pause = self.auth_cooldown
+            elif is_throttle(error):
+                requested = retry_after(error)
+                pause = self.cooldown if requested is None else requested
+            else:
+                return
+            usage["cooldowns"] += 1
+            usage["cooling_until"] = time.monotonic() + pause
+        logging.warning(f"API key {mask_key(key)} cooling down for {pause:.0f}s")
+
+    @contextmanager
+    def lease(self, model=None):
+        """
+        Acquire a key for one call and record how the call went.
+        """
+        key = self.acquire(model)
+        try:
+            yield key
+        except Exception as error:
+            self.release(key, error)
+            raise
+        except BaseException:
+            # Cancelled or closed early: no verdict on the key.
+            with self._lock:
+                self._usage[key]["in_flight"] -= 1
+            raise
+        else:
+            self.release(key)
+
+    def stats(self) -> dict:
+        """
+        Return usage counters per (masked) key.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                mask_key(key): {
+                    "requests": usage["requests"],
+                    "successes": usage["successes"],
+                    "failures": usage["failures"],
+                    "cooldowns": usage["cooldowns"],
+                    "in_flight": usage["in_flight"],
+                    "cooling_down": usage["cooling_until"] > now,
+                }
+                for key, usage in self._usage.items()
+            }
+
+    @classmethod
+    def from_config(cls, settings=None):
+        """
+        Build a pool from ``gemini_api_keys`` (a list or comma-separated
+        string), falling back to the single ``gemini_api_key``.
+        """
+        settings = config if settings is None else settings
+        keys = settings.get("gemini_api_keys") or []
+        if isinstance(keys, str):
+            keys = keys.split(",")
+        keys = [key.strip() for key in keys if key and key.strip()]
+        if not keys and settings.get("gemini_api_key"):
+            keys = [settings["gemini_api_key"]]
+        return cls(
+            keys,
+            strategy=settings.get("key_pool_strategy", "lru"),
+            cooldown=settings.get("key_cooldown", 60.0),
+            auth_cooldown=settings.get("key_auth_cooldown", 600.0),
+        )
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_key_pool(api_key=None) -> KeyPool:
+    """
+    Return the shared pool for ``api_key``, or the configured pool if omitted.
+
+    Passing a single key keeps older callers working: they get a one-key pool
+    that still tracks usage and cooldowns for that key.
+    """
+    with _pools_lock:
+        pool = _pools.get(api_key)
+        if pool is None:
+            pool = KeyPool([api_key]) if api_key else KeyPool.from_config()
+            _pools[api_key] = pool
+    return pool
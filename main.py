@@ -45,6 +45,7 @@ from config import config
 from gemini_api import configure_gemini_model
 from data_store import adjust_data_recursively
 from gui import GUI
+from serve import serve
 from ui import app
 
 
@@ -57,6 +58,11 @@ def main():
         default="gui",
         help="the interface to run (default: gui)",
     )
+    parser.add_argument(
+        "--dev",
+        action="store_true",
+        help="serve the web interface with Flask's development server",
+    )
     args = parser.parse_args()
 
     # Model selection based on user input or other criteria
@@ -87,11 +93,16 @@ def main():
             gui.run()
         except Exception as e:
             print(f"Failed to start GUI: {e}")
-    else:
+    elif args.dev:
         try:
             app.run(debug=True)
         except Exception as e:
             print(f"Failed to start web application: {e}")
+    else:
+        try:
+            serve(app)
+        except Exception as e:
+            print(f"Failed to start web application: {e}")
 
 
 if __name__ == "__main__":
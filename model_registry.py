@@ -0,0 +1,140 @@
+# model_registry.py
+import asyncio
+import threading
+import weakref
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+
+
+def _freeze(generation_config):
+    """
+    Turn a generation config into a hashable registry key component.
+    """
+    if generation_config is None:
+        return None
+    if isinstance(generation_config, dict):
+        return tuple(sorted(generation_config.items()))
+    return repr(generation_config)
+
+
+def _bind_client(model, attribute, client):
+    """
+    Attach ``client`` to a fresh ``GenerativeModel`` in place of its default.
+
+    This relies on a private attribute of google-generativeai, whose version
+    is pinned in requirements.txt; if it changes, fail instead of quietly
+    calling the model with the default key.
+    """
+    if getattr(model, attribute, False) is not None:
+        raise RuntimeError(
+            f"GenerativeModel.{attribute} is not supported by "
+            f"google-generativeai {genai.__version__}; see requirements.txt"
+        )
+    setattr(model, attribute, client)
+
+
+class ModelRegistry:
+    """
+    A process-wide, thread-safe cache of ``GenerativeModel`` handles.
+
+    Each handle is built once per ``(api key, model name, generation config)``
+    and reused. Instead of calling ``genai.configure`` (which swaps the global
+    client and throws away every gRPC channel built so far), each API key gets
+    its own ``GenerativeServiceClient`` that is attached to the models using
+    that key, so modules with different keys no longer fight over global state.
+    Models requested without a key fall back to the SDK's default client.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._clients = {}
+        # Async gRPC channels are bound to the loop that first uses them, so
+        # async handles are kept per event loop.
+        self._async_models = weakref.WeakKeyDictionary()
+
+    def get_model(self, model_name, api_key=None, generation_config=None):
+        """
+        Return the shared model handle, building it on first use.
+
+        :param model_name: The Gemini model, e.g. ``"gemini-pro"``.
+        :param api_key: The API key to call the model with.
+        :param generation_config: Optional generation settings bound to the model.
+        """
+        key = (api_key, model_name, _freeze(generation_config))
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name, generation_config=generation_config
+                )
+                if api_key:
+                    # GenerativeModel only creates a default client when none
+                    # is set, so this binds the handle to its own key.
+                    _bind_client(model, "_client", self._client(api_key))
+                self._models[key] = model
+        return model
+
+    def get_async_model(self, model_name, api_key=None, generation_config=None):
+        """
+        Return a model handle for ``generate_content_async`` on the running loop.
+
+        Handles and their async clients are built once per event loop and
+        reused by every coroutine running on it.
+        """
+        loop = asyncio.get_running_loop()
+        key = (api_key, model_name, _freeze(generation_config))
+        with self._lock:
+            models = self._async_models.setdefault(loop, {})
+            model = models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name, generation_config=generation_config
+                )
+                if api_key:
+                    client = models.get(("client", api_key))
+                    if client is None:
+                        client = glm.GenerativeServiceAsyncClient(
+                            client_options={"api_key": api_key}
+                        )
+                        models[("client", api_key)] = client
+                    _bind_client(model, "_async_client", client)
+                models[key] = model
+        return model
+
+    def _client(self, api_key):
+        client = self._clients.get(api_key)
+        if client is None:
+            client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+            self._clients[api_key] = client
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._clients.clear()
+            self._async_models.clear()
+
+    def __len__(self):
+        return len(self._models)
+
+
+registry = ModelRegistry()
+
+
+def get_model(model_name, api_key=None, generation_config=None):
+    """
+    Return the shared model handle from the process-wide registry.
+    """
+    return registry.get_model(model_name, api_key, generation_config)
+
+
+def get_async_model(model_name, api_key=None, generation_config=None):
+    """
+    Return the shared async model handle for the running event loop.
+    """
+    return registry.get_async_model(model_name, api_key, generation_config)
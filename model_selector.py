@@ -1,10 +1,25 @@
 # model_selector.py
 
-import functools
+from config import config
 from dynamic_gemini_model import DynamicGeminiModel  # Import DynamicGeminiModel
-
-# Define a Data Structure for Responses
-responses_cache = {}
+from response_cache import PersistentCache, ResponseCache, TieredCache
+from scheduler import NORMAL
+
+# Two-tier response cache: a bounded in-process LRU over a SQLite store that
+# survives restarts and is shared by every worker process using the same path.
+response_cache = TieredCache(
+    ResponseCache(
+        max_entries=config.get("model_cache_memory_entries", 256),
+        max_bytes=config.get("model_cache_memory_bytes", 16 * 1024 * 1024),
+        ttl=config.get("model_cache_ttl"),
+    ),
+    PersistentCache(
+        config.get("model_cache_path", "model_cache.sqlite3"),
+        max_entries=config.get("model_cache_max_entries", 10000),
+        max_bytes=config.get("model_cache_max_bytes", 256 * 1024 * 1024),
+        ttl=config.get("model_cache_ttl"),
+    ),
+)
 
 # Dynamic Model Selection Using Tuples
 model_criteria = {
@@ -29,31 +44,36 @@ def configure_model(model_name):
     # Add configurations for other models
 
 
-@functools.lru_cache(maxsize=1000)  # Adjust maxsize based on requirements
 def get_cached_response(request_key):
-    return responses_cache.get(request_key, None)
+    return response_cache.get(request_key)
 
 
-def process_request(input_data, task_details):
-    request_key = (input_data["content"], task_details["task_type"])
+def process_request(input_data, task_details, priority=NORMAL):
+    criteria = (input_data["type"], task_details["task_type"])
+    model_name = select_gemini_model(criteria)
+    request_key = (
+        input_data["content"],
+        input_data["type"],
+        task_details["task_type"],
+        model_name,
+    )
     cached_response = get_cached_response(request_key)
 
     if cached_response is not None:
         return cached_response
 
-    criteria = (input_data["type"], task_details["task_type"])
-    model_name = select_gemini_model(criteria)
     model = configure_model(model_name)
 
     # Generate response using model
-    dynamic_model = DynamicGeminiModel(
-        api_key="your_api_key"
-    )  # Create an instance of DynamicGeminiModel with api_key
+    # Model handles are shared through model_registry, so this is cheap.
+    dynamic_model = DynamicGeminiModel()
     response = dynamic_model.generate_response(
-        input_data, task_details
+        prompt=input_data["content"],
+        is_image_present=input_data["type"] == "multimodal",
+        priority=priority,
     )  # Use the generate_response method
 
-    responses_cache[request_key] = response
+    response_cache.set(request_key, response)
     return response
 
 
@@ -0,0 +1,285 @@
+# multimodal_batch.py
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from batch_jobs import Progress, write_record
+from multimodal_input import MultimodalInputProcessor
+from scheduler import BATCH
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
+
+
+def iter_directory(directory, prompt=None):
+    """
+    Yield ``{"id", "image", "prompt"}`` for every image in ``directory``.
+
+    A ``<name>.txt`` file next to an image overrides ``prompt`` for it.
+    """
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        stem, extension = os.path.splitext(entry.name)
+        if not entry.is_file() or extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+        sidecar = os.path.join(directory, f"{stem}.txt")
+        text = prompt
+        if os.path.exists(sidecar):
+            with open(sidecar) as file:
+                text = file.read().strip()
+        yield {"id": entry.name, "image": entry.path, "prompt": text}
+
+
+def iter_manifest(path, prompt=None):
+    """
+    Yield the items of a JSONL manifest of ``{"image", "prompt", "id"?}`` lines.
+
+    Relative image paths are resolved against the manifest's directory, and
+    lines without a prompt use ``prompt``.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as file:
+        for line, raw in enumerate(file):
+            if not raw.strip():
+                continue
+            record = json.loads(raw)
+            yield {
+                "id": record.get("id", line),
+                "image": os.path.join(base, record["image"]),
+                "prompt": record.get("prompt", prompt),
+            }
+
+
+def prepare_image(path):
+    """
+    Decode, downscale and encode one image for upload; runs in a worker process.
+
+    :return: The inline-data part and the preprocessing report.
+    """
+    return MultimodalInputProcessor.preprocess_image(path)
+
+
+class StageStats:
+    """
+    Item count, busy time and active wall time of one pipeline stage.
+    """
+
+    def __init__(self):
+        self.items = 0
+        self.failures = 0
+        self.busy = 0.0
+        self.bytes = 0
+        self.bytes_saved = 0
+        self.first_start = None
+        self.last_end = None
+
+    def record(self, started, seconds, failed=False, size=0, saved=0):
+        self.items += 1
+        self.failures += failed
+        self.busy += seconds
+        self.bytes += size
+        self.bytes_saved += saved
+        if self.first_start is None:
+            self.first_start = started
+        self.last_end = time.perf_counter()
+
+    def as_dict(self) -> dict:
+        wall = (self.last_end - self.first_start) if self.items else 0.0
+        return {
+            "items": self.items,
+            "failures": self.failures,
+            "bytes": self.bytes,
+            "bytes_saved": self.bytes_saved,
+            "busy_seconds": self.busy,
+            "wall_seconds": wall,
+            "items_per_second": self.items / wall if wall else 0.0,
+        }
+
+
+async def run_image_batch(
+    items,
+    output_path,
+    vision_api,
+    decode_workers=None,
+    concurrency=8,
+    queue_size=None,
+    call_timeout=60.0,
+    total=None,
+    progress=True,
+):
+    """
+    Describe many images with ``gemini-pro-vision``.
+
+    Images are decoded, downscaled and re-encoded in a process pool. The payloads go through
+    a bounded queue to ``concurrency`` async Gemini callers, so decoding the
+    next images overlaps waiting on the network, and neither stage can run
+    ahead of the other by more than ``queue_size`` images. Results are
+    appended to ``output_path`` as ``{"id", "image", "prompt", "text"}``
+    lines, with ``error`` instead of ``text`` on failure.
+
+    :param items: ``{"id", "image", "prompt"}`` dicts, read lazily.
+    :param output_path: The JSONL file results are written to.
+    :param vision_api: A ``GeminiVisionProAPI``.
+    :param decode_workers: Worker processes (default: CPU count).
+    :param concurrency: Maximum Gemini calls in flight.
+    :param queue_size: Decoded images buffered for the callers.
+    :param call_timeout: Seconds allowed for each Gemini call.
+    :param total: Number of items, for the ETA; optional.
+    :param progress: Print a live throughput/ETA line to stderr.
+    :return: Per-stage statistics: ``decode``, ``generate`` and ``total``.
+    """
+    decode_workers = decode_workers or os.cpu_count() or 1
+    queue = asyncio.Queue(maxsize=queue_size or 2 * concurrency)
+    loop = asyncio.get_running_loop()
+    decode_stats, generate_stats = StageStats(), StageStats()
+    status = Progress(total or 0, label="images") if progress else None
+    started = time.perf_counter()
+
+    async def decode(pool, item):
+        decode_started = time.perf_counter()
+        try:
+            blob, report = await loop.run_in_executor(
+                pool, prepare_image, item["image"]
+            )
+        except Exception as error:
+            decode_stats.record(decode_started, 0.0, failed=True)
+            return item, None, error
+        decode_stats.record(
+            decode_started,
+            report["seconds"],
+            size=report["output_bytes"],
+            saved=report["bytes_saved"],
+        )
+        return item, blob, None
+
+    async def produce(pool):
+        # Keep every worker busy without decoding far ahead of the callers.
+        window = set()
+        try:
+            for item in items:
+                if len(window) >= 2 * decode_workers:
+                    done, window = await asyncio.wait(
+                        window, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        await queue.put(task.result())
+                window.add(asyncio.ensure_future(decode(pool, item)))
+            for task in asyncio.as_completed(window):
+                await queue.put(await task)
+        finally:
+            for task in window:
+                task.cancel()
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consume(output):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            item, blob, error = job
+            record = {
+                "id": item["id"],
+                "image": item["image"],
+                "prompt": item["prompt"],
+            }
+            if error is None:
+                call_started = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(
+                        vision_api.generate_content_async(
+                            item["prompt"], blob, priority=BATCH
+                        ),
+                        call_timeout,
+                    )
+                    record["text"] = response.text
+                except Exception as call_error:
+                    error = call_error
+                generate_stats.record(
+                    call_started,
+                    time.perf_counter() - call_started,
+                    failed=error is not None,
+                )
+            if error is not None:
+                record["error"] = f"{type(error).__name__}: {error}"
+            write_record(output, record)
+            if status is not None:
+                status.update()
+
+    # Spawned rather than forked workers: forking a process that already runs
+    # gRPC and event loop threads can deadlock the child.
+    pool = ProcessPoolExecutor(
+        decode_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+    with pool, open(output_path, "wb") as output:
+        # A task of its own, so a failed consumer or a cancelled batch stops
+        # the producer too instead of leaving it blocked on a full queue.
+        tasks = [asyncio.ensure_future(produce(pool))]
+        tasks += [asyncio.ensure_future(consume(output)) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    if status is not None:
+        status.finish()
+    elapsed = time.perf_counter() - started
+    processed = generate_stats.items + decode_stats.failures
+    return {
+        "decode": decode_stats.as_dict(),
+        "generate": generate_stats.as_dict(),
+        "total": {
+            "items": processed,
+            "wall_seconds": elapsed,
+            "items_per_second": processed / elapsed if elapsed else 0.0,
+        },
+    }
+
+
+def report_stages(stats, stream=None):
+    """
+    Print one throughput line per pipeline stage.
+    """
+    stream = stream or sys.stderr
+    for stage in ("decode", "generate", "total"):
+        values = stats[stage]
+        stream.write(
+            f"{stage:<9} {values['items']:7d} items"
+            f"  {values['items_per_second']:8.1f} items/s"
+            f"  wall {values['wall_seconds']:8.2f}s"
+        )
+        if "busy_seconds" in values:
+            stream.write(
+                f"  busy {values['busy_seconds']:8.2f}s"
+                f"  failures {values['failures']}"
+            )
+        if values.get("bytes"):
+            stream.write(
+                f"  upload {values['bytes'] / 1e6:.1f} MB"
+                f"  saved {values['bytes_saved'] / 1e6:.1f} MB"
+            )
+        stream.write("\n")
+
+
+def load_items(source, prompt=None):
+    """
+    Return the items of a directory or JSONL manifest and their count.
+
+    :raises ValueError: If an item has no prompt of its own and ``prompt`` is
+        not given; checked before any image is read.
+    """
+    read = iter_directory if os.path.isdir(source) else iter_manifest
+    total, missing = 0, []
+    for item in read(source, prompt):
+        total += 1
+        if not item["prompt"]:
+            missing.append(str(item["id"]))
+    if missing:
+        raise ValueError(
+            f"{len(missing)} item(s) have no prompt (e.g. {', '.join(missing[:3])});"
+            " pass a default prompt"
+        )
+    return read(source, prompt), total
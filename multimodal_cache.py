@@ -0,0 +1,116 @@
+# multimodal_cache.py
+import hashlib
+import logging
+import threading
+
+from config import config
+from multimodal_input import MultimodalInputProcessor
+from response_cache import PersistentCache
+
+
+def fingerprint(source, chunk_size=1024 * 1024) -> str:
+    """
+    Return a fast BLAKE2b digest of bytes or of a file object's remaining data.
+
+    Streams (including a werkzeug ``FileStorage``) are hashed chunk by chunk
+    and rewound, so the upload can still be read afterwards.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+        return digest.hexdigest()
+    stream = getattr(source, "stream", source)
+    position = stream.tell()
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(position)
+    return digest.hexdigest()
+
+
+def normalize_prompt(prompt) -> str:
+    return " ".join(prompt.split())
+
+
+class MultimodalResultCache:
+    """
+    A content-addressed on-disk cache of image+prompt analyses.
+
+    Results are keyed on the digest of the normalized image (the preprocessed
+    JPEG), the whitespace-normalized prompt and the model, so the same picture
+    re-encoded or re-uploaded under another name still hits. The digest of
+    the raw upload is stored as a second key, which lets an identical
+    re-submission skip preprocessing as well and return in milliseconds.
+    """
+
+    def __init__(self, cache=None):
+        """
+        :param cache: The ``PersistentCache`` holding the analyses; one sized
+            from the ``multimodal_cache_*`` config keys is created if omitted.
+        """
+        if cache is None:
+            cache = PersistentCache(
+                config.get("multimodal_cache_path", "multimodal_cache.sqlite3"),
+                max_entries=config.get("multimodal_cache_max_entries", 10000),
+                max_bytes=config.get("multimodal_cache_max_bytes", 64 * 1024 * 1024),
+            )
+        self.cache = cache
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.upload_hits = 0
+        self.misses = 0
+
+    def fetch(self, upload, prompt, model, analyze):
+        """
+        Return the cached analysis for ``upload`` and ``prompt``, or compute it.
+
+        :param upload: The image as a path, file object or ``FileStorage``.
+        :param prompt: The text sent with the image.
+        :param model: Name of the model the analysis comes from.
+        :param analyze: Called with the preprocessed image part on a miss; its
+            return value is cached and returned.
+        """
+        prompt = normalize_prompt(prompt)
+        upload_key = ("upload", fingerprint(upload), prompt, model)
+        analysis = self.cache.get(upload_key)
+        if analysis is not None:
+            self._count(hit=True, upload_hit=True)
+            return analysis
+        image, report = MultimodalInputProcessor.preprocess_image(upload)
+        logging.info(
+            f"Preprocessed upload: {report['input_bytes']} -> "
+            f"{report['output_bytes']} bytes ({report['bytes_saved']} saved) "
+            f"in {report['seconds'] * 1000:.1f} ms"
+        )
+        image_key = ("image", fingerprint(image["data"]), prompt, model)
+        analysis = self.cache.get(image_key)
+        self._count(hit=analysis is not None)
+        if analysis is None:
+            analysis = analyze(image)
+            self.cache.set(image_key, analysis)
+        self.cache.set(upload_key, analysis)
+        return analysis
+
+    def _count(self, hit, upload_hit=False):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.upload_hits += upload_hit
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        """
+        Return the hit ratio of this process and the size of the store.
+        """
+        store = self.cache.stats()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "upload_hits": self.upload_hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": store["entries"],
+                "bytes": store["bytes"],
+                "evictions": store["evictions"],
+            }
@@ -0,0 +1,326 @@
+# rate_limiter.py
+import asyncio
+import threading
+import time
+from collections import deque
+
+from config import config
+from resilience import is_throttle
+
+# Per-minute budgets used when the config has no "rate_limits" entry for a
+# model. Models not listed here (and not configured) are not throttled until
+# the upstream first answers 429; see ``RateLimiter.on_throttled``.
+DEFAULT_LIMITS = {
+    "gemini-pro": {"requests_per_minute": 60},
+    "gemini-pro-vision": {"requests_per_minute": 60},
+}
+
+
+def estimate_tokens(content):
+    """
+    Rough token count of a prompt (about four characters per token).
+
+    Non-text parts such as images are not counted.
+    """
+    if isinstance(content, str):
+        return max(1, len(content) // 4) if content else 0
+    if isinstance(content, (list, tuple)):
+        return sum(estimate_tokens(part) for part in content)
+    return 0
+
+
+class TokenBucket:
+    """
+    A token bucket that hands out reservations in arrival order.
+
+    A reservation may drive the bucket negative; the debt is the time the
+    caller has to wait, so later callers queue up behind earlier ones instead
+    of racing for refilled tokens.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now) -> float:
+        """
+        Take ``amount`` tokens and return the seconds until they are covered.
+        """
+        self.refill(now)
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Client-side request and token budgets for one model and API key.
+
+    The rate backs off multiplicatively whenever the upstream throttles a call
+    (HTTP 429 / ``ResourceExhausted``) and recovers additively on success, so
+    the limiter settles just under the quota actually being enforced. A
+    limiter without a request budget counts the requests it lets through, and
+    on the first 429 adopts the rate observed over the last minute as its
+    budget, so unconfigured endpoints adapt too.
+    """
+
+    # Seconds of recent requests used to estimate an unconfigured budget.
+    OBSERVE_SECONDS = 60.0
+
+    def __init__(
+        self,
+        name,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        burst_seconds=6.0,
+        min_fraction=0.1,
+        recovery=0.05,
+    ):
+        """
+        :param name: Label used in metrics.
+        :param requests_per_minute: Request budget, or None for no limit.
+        :param tokens_per_minute: Token budget, or None for no limit.
+        :param burst_seconds: Seconds of budget that may be spent at once.
+        :param min_fraction: Lowest fraction of the budget the rate backs off to.
+        :param recovery: Fraction of the budget regained after each success.
+        """
+        self.name = name
+        self.burst_seconds = burst_seconds
+        self.min_fraction = min_fraction
+        self.recovery = recovery
+        self.fraction = 1.0
+        self._lock = threading.Lock()
+        self._buckets = []
+        for per_minute in (requests_per_minute, tokens_per_minute):
+            if per_minute:
+                rate = per_minute / 60.0
+                bucket = TokenBucket(rate, max(1.0, rate * burst_seconds))
+                bucket.base_rate = rate
+                self._buckets.append(bucket)
+            else:
+                self._buckets.append(None)
+        self._sent = deque(maxlen=10000) if self._buckets[0] is None else None
+        self.requests = 0
+        self.refunded = 0
+        self.throttled = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def reserve(self, tokens=1) -> float:
+        """
+        Reserve one request and ``tokens`` tokens; return how long to wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            for bucket, amount in zip(self._buckets, (1, tokens)):
+                if bucket is not None:
+                    wait = max(wait, bucket.reserve(min(amount, bucket.capacity), now))
+            if self._sent is not None:
+                self._sent.append(now)
+            self.requests += 1
+            if wait > 0:
+                self.waited += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def try_reserve(self, tokens=1) -> bool:
+        """
+        Reserve one request and ``tokens`` tokens only if no wait is needed.
+
+        For optional extra calls, such as hedges, that are not worth queueing.
+        """
+        with self._lock:
+            now = time.monotonic()
+            charges = [
+                (bucket, min(amount, bucket.capacity))
+                for bucket, amount in zip(self._buckets, (1, tokens))
+                if bucket is not None
+            ]
+            for bucket, amount in charges:
+                bucket.refill(now)
+                if bucket.tokens < amount:
+                    return False
+            for bucket, amount in charges:
+                bucket.tokens -= amount
+            if self._sent is not None:
+                self._sent.append(now)
+            self.requests += 1
+            return True
+
+    def refund(self, tokens=1) -> None:
+        """
+        Give back a reservation whose request was never sent.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for bucket, amount in zip(self._buckets, (1, tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    bucket.tokens = min(
+                        bucket.capacity, bucket.tokens + min(amount, bucket.capacity)
+                    )
+            self.refunded += 1
+
+    def headroom(self) -> float:
+        """
+        Fraction of the burst budget currently unspent (negative when queued).
+        """
+        with self._lock:
+            now = time.monotonic()
+            levels = []
+            for bucket in self._buckets:
+                if bucket is not None:
+                    bucket.refill(now)
+                    levels.append(bucket.tokens / bucket.capacity)
+            return min(levels, default=1.0) * self.fraction
+
+    async def acquire(self, tokens=1) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # Cancelled before sending (a superseded query, a stopped
+                # batch): the budget is free for the next caller.
+                self.refund(tokens)
+                raise
+
+    def acquire_sync(self, tokens=1) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _scale(self, fraction):
+        now = time.monotonic()
+        self.fraction = fraction
+        for bucket in self._buckets:
+            if bucket is not None:
+                bucket.refill(now)
+                bucket.rate = bucket.base_rate * fraction
+
+    def _observed_bucket(self, now):
+        # Requests per second over the recent window; the bucket starts empty
+        # so the calls queued behind the 429 are paced, not sent as a burst.
+        horizon = now - self.OBSERVE_SECONDS
+        while self._sent and self._sent[0] < horizon:
+            self._sent.popleft()
+        span = max(1.0, now - self._sent[0]) if self._sent else 1.0
+        rate = max(1, len(self._sent)) / span
+        bucket = TokenBucket(rate, max(1.0, rate * self.burst_seconds))
+        bucket.base_rate = rate
+        bucket.tokens = 0.0
+        return bucket
+
+    def on_throttled(self) -> None:
+        with self._lock:
+            self.throttled += 1
+            if self._buckets[0] is None:
+                self._buckets[0] = self._observed_bucket(time.monotonic())
+                self._sent = None
+                self.fraction = 1.0
+            self._scale(max(self.min_fraction, self.fraction / 2))
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self.fraction < 1.0:
+                self._scale(min(1.0, self.fraction + self.recovery))
+
+    def _outcome(self, error):
+        if error is None:
+            self.on_success()
+        elif is_throttle(error):
+            self.on_throttled()
+
+    async def call_async(self, func, tokens=1):
+        """
+        Wait for budget, await ``func()`` and adapt the rate to the outcome.
+        """
+        await self.acquire(tokens)
+        try:
+            result = await func()
+        except Exception as error:
+            self._outcome(error)
+            raise
+        self._outcome(None)
+        return result
+
+    def call(self, func, tokens=1):
+        """
+        Blocking counterpart of ``call_async``.
+        """
+        self.acquire_sync(tokens)
+        try:
+            result = func()
+        except Exception as error:
+            self._outcome(error)
+            raise
+        self._outcome(None)
+        return result
+
+    def stats(self) -> dict:
+        """
+        Return request, throttle and queue wait metrics.
+        """
+        with self._lock:
+            bucket = self._buckets[0]
+            return {
+                "requests": self.requests,
+                "requests_per_minute": bucket.rate * 60 if bucket else None,
+                "refunded": self.refunded,
+                "throttled": self.throttled,
+                "rate_fraction": self.fraction,
+                "queued": self.waited,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+                "mean_wait": self.total_wait / self.requests if self.requests else 0.0,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model, api_key=None) -> RateLimiter:
+    """
+    Return the limiter shared by every call to ``model`` with ``api_key``.
+
+    Budgets come from the ``rate_limits`` config entry for the model, e.g.
+    ``{"gemini-pro": {"requests_per_minute": 60, "tokens_per_minute": 32000}}``,
+    falling back to ``DEFAULT_LIMITS``.
+    """
+    key = (model, api_key)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limits = config.get("rate_limits", {}).get(model) or DEFAULT_LIMITS.get(
+                model, {}
+            )
+            limiter = RateLimiter(
+                model,
+                requests_per_minute=limits.get("requests_per_minute"),
+                tokens_per_minute=limits.get("tokens_per_minute"),
+            )
+            _limiters[key] = limiter
+    return limiter
+
+
+def limiter_stats() -> dict:
+    """
+    Return the metrics of every limiter, keyed by model and then masked key.
+    """
+    from key_pool import mask_key
+
+    with _limiters_lock:
+        limiters = list(_limiters.items())
+    stats = {}
+    for (model, api_key), limiter in limiters:
+        stats.setdefault(model, {})[mask_key(api_key)] = limiter.stats()
+    return stats
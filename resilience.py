@@ -0,0 +1,314 @@
+# resilience.py
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import aiohttp
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # The Gemini SDK is optional for the HTTP-only paths.
+    google_exceptions = None
+
+from config import config
+from scheduler import DeadlineExceeded
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit breaker is open.
+    """
+
+    def __init__(self, endpoint, retry_in):
+        super().__init__(f"Circuit open for {endpoint}; retry in {retry_in:.1f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def _google_retryable():
+    if google_exceptions is None:
+        return ()
+    return (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+    )
+
+
+def is_retryable(error) -> bool:
+    """
+    Return whether ``error`` is transient (throttling, 5xx, connection loss).
+    """
+    if isinstance(error, DeadlineExceeded):
+        # The caller no longer wants the answer; retrying cannot help.
+        return False
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+    if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, _google_retryable())
+
+
+def is_throttle(error) -> bool:
+    """
+    Return whether ``error`` means the caller exceeded its quota (HTTP 429).
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429
+    if google_exceptions is None:
+        return False
+    return isinstance(
+        error, (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)
+    )
+
+
+def retry_after(error):
+    """
+    Return the delay in seconds requested by a ``Retry-After`` header, if any.
+    """
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter that honors ``Retry-After``.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=30.0):
+        """
+        :param max_attempts: Total attempts per call, including the first.
+        :param base_delay: Backoff ceiling in seconds before the first retry.
+        :param max_delay: Upper bound of the backoff ceiling.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, error) -> float:
+        """
+        Seconds to wait before retry number ``attempt`` (starting at 1).
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        backoff = random.uniform(0, ceiling)
+        requested = retry_after(error)
+        return backoff if requested is None else max(backoff, requested)
+
+
+class CircuitBreaker:
+    """
+    A per-endpoint breaker: closed, open after repeated failures, then half-open.
+
+    While open, calls fail fast with ``CircuitOpenError``. After
+    ``reset_timeout`` one trial call is let through; its success closes the
+    breaker and its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """
+        :raises CircuitOpenError: If the endpoint should not be called now.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            waited = time.monotonic() - self.opened_at
+            if self.state == self.OPEN and waited >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            raise CircuitOpenError(self.endpoint, max(0.0, self.reset_timeout - waited))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"Circuit opened for {self.endpoint}")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """
+        Forget a trial call that ended without a verdict (e.g. cancelled).
+        """
+        with self._lock:
+            self.trial_in_flight = False
+
+
+class Resilience:
+    """
+    Retries and circuit breakers for every upstream endpoint.
+
+    Transient failures (see ``is_retryable``) are retried according to the
+    policy and count towards the endpoint's breaker; other errors are raised
+    immediately and leave the breaker alone. Throttling (HTTP 429) is retried
+    after ``Retry-After`` but never counts as a failure: it means one key is
+    over its quota, which the key pool handles by cooling that key down, not
+    that the endpoint is unhealthy for every caller.
+    """
+
+    def __init__(self, policy=None, failure_threshold=5, reset_timeout=30.0):
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    endpoint, self.failure_threshold, self.reset_timeout
+                )
+                self._breakers[endpoint] = breaker
+                self._counters[endpoint] = {
+                    "calls": 0,
+                    "retries": 0,
+                    "failures": 0,
+                    "throttled": 0,
+                    "short_circuits": 0,
+                }
+        return breaker
+
+    def _count(self, endpoint, counter):
+        with self._lock:
+            self._counters[endpoint][counter] += 1
+
+    def _attempt(self, endpoint, breaker):
+        self._count(endpoint, "calls")
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            self._count(endpoint, "short_circuits")
+            raise
+
+    def _should_retry(self, endpoint, breaker, attempt, error) -> bool:
+        if not is_retryable(error):
+            breaker.release()
+            return False
+        if is_throttle(error):
+            self._count(endpoint, "throttled")
+            breaker.release()
+        else:
+            breaker.record_failure()
+        if attempt >= self.policy.max_attempts:
+            self._count(endpoint, "failures")
+            return False
+        self._count(endpoint, "retries")
+        logging.warning(f"Retrying {endpoint} after attempt {attempt}: {error}")
+        return True
+
+    async def call_async(self, endpoint, func):
+        """
+        Await ``func()`` with retries and the endpoint's circuit breaker.
+
+        :param endpoint: Name of the upstream endpoint the call goes to.
+        :param func: A zero-argument coroutine function making one attempt.
+        """
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            attempt += 1
+            self._attempt(endpoint, breaker)
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as error:
+                if not self._should_retry(endpoint, breaker, attempt, error):
+                    raise
+                await asyncio.sleep(self.policy.delay(attempt, error))
+                continue
+            breaker.record_success()
+            return result
+
+    def call(self, endpoint, func):
+        """
+        Call ``func()`` with retries and the endpoint's circuit breaker.
+
+        The blocking counterpart of ``call_async`` for synchronous clients.
+        """
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            attempt += 1
+            self._attempt(endpoint, breaker)
+            try:
+                result = func()
+            except Exception as error:
+                if not self._should_retry(endpoint, breaker, attempt, error):
+                    raise
+                time.sleep(self.policy.delay(attempt, error))
+                continue
+            breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        """
+        Return breaker state and retry counters for every endpoint.
+        """
+        with self._lock:
+            items = list(self._breakers.items())
+            counters = {name: dict(values) for name, values in self._counters.items()}
+        return {
+            endpoint: dict(
+                counters[endpoint],
+                state=breaker.state,
+                consecutive_failures=breaker.failures,
+            )
+            for endpoint, breaker in items
+        }
+
+
+resilience = Resilience(
+    RetryPolicy(
+        max_attempts=config.get("retry_max_attempts", 4),
+        base_delay=config.get("retry_base_delay", 0.5),
+        max_delay=config.get("retry_max_delay", 30.0),
+    ),
+    failure_threshold=config.get("breaker_failure_threshold", 5),
+    reset_timeout=config.get("breaker_reset_timeout", 30.0),
+)
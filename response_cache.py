@@ -0,0 +1,324 @@
+# response_cache.py
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def response_size(value) -> int:
+    """
+    Estimate the size in bytes of a cached value.
+
+    Lists of generated texts are measured by their encoded length; anything
+    else falls back to ``sys.getsizeof``.
+    """
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (list, tuple)):
+        return sum(response_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at")
+
+    def __init__(self, value, size, expires_at):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    An in-memory LRU cache with per-entry TTL, bounded by entry count and bytes.
+
+    Lookups never block, so the cache can be consulted directly from coroutines
+    (unlike ``functools.lru_cache``, which cannot wrap an ``async def``) as
+    well as from worker threads.
+    """
+
+    def __init__(
+        self,
+        max_entries=1024,
+        max_bytes=16 * 1024 * 1024,
+        ttl=300.0,
+        sizeof=response_size,
+    ):
+        """
+        :param max_entries: Maximum number of entries kept.
+        :param max_bytes: Maximum total size of the kept values.
+        :param ttl: Default seconds an entry stays valid, or None for no expiry.
+        :param sizeof: Function estimating the size of a value in bytes.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Return the value cached for ``key``, or ``default`` if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is not None
+                and entry.expires_at is not None
+                and entry.expires_at <= time.monotonic()
+            ):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def set(self, key, value, ttl=None) -> None:
+        """
+        Cache ``value`` for ``key``, evicting least recently used entries to make room.
+
+        :param ttl: Seconds this entry stays valid, overriding the cache default.
+        """
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, size, expires_at)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key).size
+
+    def stats(self) -> dict:
+        """
+        Return hit, miss and eviction counters along with the current size.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+        }
+
+
+class PersistentCache:
+    """
+    An on-disk LRU cache backed by SQLite that survives restarts.
+
+    Several processes (e.g. Flask workers) can share one database file: SQLite
+    runs in WAL mode so readers never block the writer, and every write plus
+    its eviction pass happens in one immediate transaction. Each thread uses
+    its own connection, opened lazily on first use, and a process forked
+    after a connection was opened (e.g. a gunicorn worker) opens its own.
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=256 * 1024 * 1024, ttl=None):
+        """
+        :param path: The SQLite database file.
+        :param max_entries: Maximum number of rows kept.
+        :param max_bytes: Maximum total size of the stored values.
+        :param ttl: Default seconds an entry stays valid, or None for no expiry.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def digest(key) -> str:
+        """
+        Return a stable digest of ``key`` usable across processes.
+        """
+        return hashlib.sha256(pickle.dumps(key, protocol=4)).hexdigest()
+
+    def get(self, key, default=None):
+        """
+        Return the value stored for ``key``, or ``default`` if it is missing or expired.
+        """
+        digest = self.digest(key)
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT value, expires_at FROM entries WHERE key = ?", (digest,)
+        ).fetchone()
+        if row is not None and row[1] is not None and row[1] <= now:
+            connection.execute("DELETE FROM entries WHERE key = ?", (digest,))
+            row = None
+        if row is None:
+            self.misses += 1
+            return default
+        connection.execute(
+            "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, digest)
+        )
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None) -> None:
+        """
+        Store ``value`` for ``key`` and evict least recently used rows beyond the limits.
+
+        :param ttl: Seconds this entry stays valid, overriding the cache default.
+        """
+        blob = pickle.dumps(value, protocol=4)
+        if len(blob) > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (self.digest(key), blob, len(blob), expires_at, now),
+            )
+            self._evict(connection)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _evict(self, connection):
+        count, total = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        cursor = connection.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at"
+        )
+        doomed = []
+        for digest, size in cursor:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((digest,))
+            count -= 1
+            total -= size
+        connection.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def delete(self, key) -> None:
+        self._connection().execute(
+            "DELETE FROM entries WHERE key = ?", (self.digest(key),)
+        )
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM entries")
+
+    def close(self) -> None:
+        """
+        Close this thread's connection to the database.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def stats(self) -> dict:
+        """
+        Return this process's hit, miss and eviction counters and the store size.
+        """
+        count, total = (
+            self._connection()
+            .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries")
+            .fetchone()
+        )
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total,
+        }
+
+
+class TieredCache:
+    """
+    A bounded in-process ``ResponseCache`` in front of a ``PersistentCache``.
+
+    Memory hits never touch the disk; disk hits are promoted into memory, and
+    writes go to both tiers.
+    """
+
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self.disk.get(key)
+        if value is None:
+            return default
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None) -> None:
+        self.memory.set(key, value, ttl)
+        self.disk.set(key, value, ttl)
+
+    def delete(self, key) -> None:
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def stats(self) -> dict:
+        return {"memory": self.memory.stats(), "disk": self.disk.stats()}
@@ -0,0 +1,300 @@
+# scheduler.py
+import asyncio
+import threading
+import time
+from collections import deque
+
+from config import config
+
+INTERACTIVE, NORMAL, BATCH = "interactive", "normal", "batch"
+PRIORITIES = (INTERACTIVE, NORMAL, BATCH)
+
+# Share of the slots each class gets while all of them are backlogged.
+DEFAULT_WEIGHTS = {INTERACTIVE: 8, NORMAL: 4, BATCH: 1}
+# Seconds a request of each class may wait for a slot (None: no deadline).
+DEFAULT_DEADLINES = {INTERACTIVE: 30.0, NORMAL: 120.0, BATCH: None}
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """
+    Raised when a request is still queued for a slot at its deadline.
+    """
+
+    def __init__(self, endpoint, priority, waited):
+        super().__init__(
+            f"{priority} request to {endpoint} not started after {waited:.1f}s"
+        )
+        self.endpoint = endpoint
+        self.priority = priority
+
+
+class _Waiter:
+    __slots__ = ("priority", "enqueued", "granted", "future", "loop", "event")
+
+    def __init__(self, priority, loop=None):
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = None if loop is not None else threading.Event()
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Scheduler:
+    """
+    Orders the outbound calls to one upstream by priority class.
+
+    At most ``max_in_flight`` calls run at once. When a slot frees up it goes
+    to the class with the lowest pass (stride scheduling): each admission
+    advances its class's pass by ``1 / weight``, so backlogged classes share
+    the slots in proportion to their weights, and a class that was idle
+    starts level with the busiest one rather than with banked credit. Ties go
+    to the more urgent class, so an interactive call jumps ahead of queued
+    batch work, while batch work still gets its share and takes every slot
+    nobody else wants. A call queued for more than ``max_wait`` seconds is
+    admitted next whatever its class, so none starves.
+
+    Calls queued past their deadline fail with ``DeadlineExceeded`` rather
+    than being sent late. Slots are handed out in priority order before the
+    rate limiter, which keeps the limiter's first-come queue short.
+    """
+
+    def __init__(
+        self,
+        endpoint,
+        max_in_flight=16,
+        weights=None,
+        deadlines=None,
+        max_wait=60.0,
+    ):
+        """
+        :param endpoint: Label used in errors and metrics.
+        :param max_in_flight: Calls allowed to run at once.
+        :param weights: Relative share of each class, by class name.
+        :param deadlines: Default seconds each class may queue, by class name.
+        :param max_wait: Seconds after which a queued call is served first.
+        :raises ValueError: If a weight is not positive.
+        """
+        self.endpoint = endpoint
+        self.max_in_flight = max_in_flight
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        for priority, weight in self.weights.items():
+            if not weight > 0:
+                raise ValueError(
+                    f"Weight of {priority!r} must be positive, not {weight!r}"
+                )
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._pass = {priority: 0.0 for priority in PRIORITIES}
+        self._virtual = 0.0
+        self.in_flight = 0
+        self._counters = {
+            priority: {
+                "admitted": 0,
+                "expired": 0,
+                "aged": 0,
+                "in_flight": 0,
+                "total_wait": 0.0,
+                "max_wait": 0.0,
+            }
+            for priority in PRIORITIES
+        }
+
+    def deadline(self, priority=NORMAL, timeout=None):
+        """
+        Return the ``time.monotonic()`` deadline for a new request.
+
+        Compute it once per request and pass it to every attempt, so retries
+        do not extend it.
+
+        :param timeout: Seconds allowed, overriding the class default.
+        """
+        timeout = self.deadlines[priority] if timeout is None else timeout
+        return None if timeout is None else time.monotonic() + timeout
+
+    def _enqueue(self, priority, loop=None):
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority {priority!r}")
+        waiter = _Waiter(priority, loop)
+        with self._lock:
+            queue = self._queues[priority]
+            if not queue:
+                self._pass[priority] = max(self._pass[priority], self._virtual)
+            queue.append(waiter)
+            self._dispatch()
+        return waiter
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight:
+            heads = [queue[0] for queue in self._queues.values() if queue]
+            if not heads:
+                return
+            oldest = min(heads, key=lambda waiter: waiter.enqueued)
+            now = time.monotonic()
+            if now - oldest.enqueued >= self.max_wait:
+                waiter = oldest
+                self._counters[waiter.priority]["aged"] += 1
+            else:
+                # min() keeps the first of equal passes: the most urgent class.
+                waiter = min(heads, key=lambda waiter: self._pass[waiter.priority])
+            priority = waiter.priority
+            self._queues[priority].popleft()
+            self._virtual = self._pass[priority]
+            self._pass[priority] += 1.0 / self.weights[priority]
+            self.in_flight += 1
+            waited = now - waiter.enqueued
+            counters = self._counters[priority]
+            counters["admitted"] += 1
+            counters["in_flight"] += 1
+            counters["total_wait"] += waited
+            counters["max_wait"] = max(counters["max_wait"], waited)
+            waiter.granted = True
+            waiter.wake()
+
+    def _abandon(self, waiter) -> bool:
+        """
+        Take a waiter out of its queue; False if it was granted a slot first.
+        """
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queues[waiter.priority].remove(waiter)
+            self._counters[waiter.priority]["expired"] += 1
+            return True
+
+    def release(self, priority) -> None:
+        """
+        Give back a slot taken with ``acquire`` or ``acquire_sync``.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._counters[priority]["in_flight"] -= 1
+            self._dispatch()
+
+    def _expired(self, waiter):
+        return DeadlineExceeded(
+            self.endpoint, waiter.priority, time.monotonic() - waiter.enqueued
+        )
+
+    async def acquire(self, priority=NORMAL, deadline=None) -> None:
+        """
+        Wait for a slot; the caller must ``release`` it afterwards.
+
+        :param deadline: ``time.monotonic()`` value after which to give up.
+        :raises DeadlineExceeded: If no slot was free before the deadline.
+        """
+        waiter = self._enqueue(priority, asyncio.get_running_loop())
+        if waiter.granted:
+            return
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise self._expired(waiter) from None
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self.release(priority)
+            raise
+
+    def acquire_sync(self, priority=NORMAL, deadline=None) -> None:
+        """
+        Blocking counterpart of ``acquire``.
+        """
+        waiter = self._enqueue(priority)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not waiter.event.wait(timeout) and self._abandon(waiter):
+            raise self._expired(waiter)
+
+    async def call_async(self, func, priority=NORMAL, deadline=None):
+        """
+        Await ``func()`` once a slot is free for its class.
+
+        :param func: A zero-argument coroutine function making one call.
+        :param priority: ``INTERACTIVE``, ``NORMAL`` or ``BATCH``.
+        :param deadline: ``time.monotonic()`` value by which the call must
+            have started; see ``deadline()``.
+        """
+        await self.acquire(priority, deadline)
+        try:
+            return await func()
+        finally:
+            self.release(priority)
+
+    def call(self, func, priority=NORMAL, deadline=None):
+        """
+        Blocking counterpart of ``call_async``.
+        """
+        self.acquire_sync(priority, deadline)
+        try:
+            return func()
+        finally:
+            self.release(priority)
+
+    def stats(self) -> dict:
+        """
+        Return queue depth, slots in use and wait times for each class.
+        """
+        with self._lock:
+            classes = {}
+            for priority in PRIORITIES:
+                counters = dict(self._counters[priority])
+                admitted = counters["admitted"]
+                counters["queued"] = len(self._queues[priority])
+                counters["mean_wait"] = (
+                    counters["total_wait"] / admitted if admitted else 0.0
+                )
+                classes[priority] = counters
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "classes": classes,
+            }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(endpoint) -> Scheduler:
+    """
+    Return the scheduler shared by every call to ``endpoint``.
+
+    Settings come from the ``scheduler`` config entry, e.g.
+    ``{"max_in_flight": 16, "weights": {"batch": 2}, "deadlines": {...}}``.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(endpoint)
+        if scheduler is None:
+            settings = config.get("scheduler", {})
+            scheduler = Scheduler(
+                endpoint,
+                max_in_flight=settings.get("max_in_flight", 16),
+                weights=settings.get("weights"),
+                deadlines=settings.get("deadlines"),
+                max_wait=settings.get("max_wait", 60.0),
+            )
+            _schedulers[endpoint] = scheduler
+    return scheduler
+
+
+def scheduler_stats() -> dict:
+    """
+    Return the metrics of every scheduler, keyed by endpoint.
+    """
+    with _schedulers_lock:
+        schedulers = list(_schedulers.items())
+    return {endpoint: scheduler.stats() for endpoint, scheduler in schedulers}
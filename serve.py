@@ -0,0 +1,127 @@
+# serve.py
+"""
+Production server for the Flask UI: gunicorn with threaded worker processes.
+
+Usage:
+    python serve.py
+    WEB_WORKERS=4 WEB_THREADS=16 PORT=8000 python serve.py
+
+Each worker builds its Gemini model handles when it starts rather than on
+its first request. On SIGTERM workers stop accepting connections and finish
+the requests in flight, for up to ``web_graceful_timeout`` seconds, before
+exiting.
+"""
+
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+from config import config
+
+
+def warm_up():
+    """
+    Build the model handles and async clients the UI will use.
+    """
+    from background_loop import run_sync
+    from dynamic_gemini_model import DynamicGeminiModel
+    from model_registry import get_async_model, get_model, registry
+    import ui
+
+    # gRPC channels must not be shared across a fork: drop any handle the
+    # master built before forking this worker.
+    registry.clear()
+
+    keys = set(ui.gemini_api.key_pool.keys) | set(ui.text_model.key_pool.keys)
+    models = (DynamicGeminiModel.TEXT_MODEL, DynamicGeminiModel.VISION_MODEL)
+    for key in keys:
+        for model_name in models:
+            get_model(model_name, key)
+
+    async def build_async_handles():
+        # Async clients belong to the loop they are used on: the shared one.
+        for key in keys:
+            for model_name in models:
+                get_async_model(model_name, key)
+
+    run_sync(build_async_handles())
+
+
+def post_worker_init(worker):
+    try:
+        warm_up()
+    except Exception as e:
+        # A cold worker still serves requests; it just pays setup on first use.
+        worker.log.warning(f"Worker {worker.pid} warm-up failed: {e}")
+    else:
+        worker.log.info(f"Worker {worker.pid} warmed up")
+
+
+def worker_exit(server, worker):
+    from background_loop import stop_shared_loop
+
+    ui = sys.modules.get("ui")
+    if ui is not None:
+        # Let queued-job threads finish what they are running; jobs still
+        # queued are picked up by the other workers.
+        ui.jobs.stop(config.get("web_graceful_timeout", 30))
+    stop_shared_loop()
+
+
+def server_options(**overrides) -> dict:
+    """
+    Return the gunicorn settings from the config, updated with ``overrides``.
+    """
+    host = os.getenv("HOST", "0.0.0.0")
+    port = os.getenv("PORT", "80")
+    options = {
+        "bind": f"{host}:{port}",
+        "workers": config.get("web_workers", os.cpu_count() or 1),
+        "threads": config.get("web_threads", 8),
+        "worker_class": "gthread",
+        # Vision calls can take tens of seconds; do not kill busy workers.
+        "timeout": config.get("web_timeout", 120),
+        "graceful_timeout": config.get("web_graceful_timeout", 30),
+        "keepalive": 5,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+    }
+    options.update(overrides)
+    return options
+
+
+class WebServer(BaseApplication):
+    """
+    Runs a WSGI app under gunicorn without a separate config file.
+
+    When no app is given each worker imports ``ui.app`` after it is forked,
+    so no gRPC channel or thread is ever shared across a fork.
+    """
+
+    def __init__(self, app=None, **overrides):
+        self.application = app
+        self.options = server_options(**overrides)
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        if self.application is None:
+            from ui import app
+
+            return app
+        return self.application
+
+
+def serve(app=None, **overrides):
+    """
+    Serve ``app`` (``ui.app`` by default) until the server is stopped.
+    """
+    WebServer(app, **overrides).run()
+
+
+if __name__ == "__main__":
+    serve()
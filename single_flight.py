@@ -0,0 +1,63 @@
+# single_flight.py
+import asyncio
+
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one in-flight call.
+
+    The first caller for a key starts the work; every caller that arrives while
+    it is still running awaits the same task instead of starting its own. A
+    caller that is cancelled only stops waiting; the shared work is cancelled
+    once no caller is waiting for it any more.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def do(self, key, func):
+        """
+        Run ``func()`` for ``key``, or join the call already in flight for it.
+
+        :param key: A hashable key identifying equivalent calls.
+        :param func: A zero-argument coroutine function doing the work.
+        :return: The result of the shared call.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            self.misses += 1
+            call = _Call(asyncio.ensure_future(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.hits += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        """
+        Return the coalescing counters.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "in_flight": len(self._calls),
+        }
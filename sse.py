@@ -0,0 +1,80 @@
+# sse.py
+import json
+import logging
+import queue
+import time
+
+from background_loop import shared_loop
+
+# Sent while the model is silent: a write is the only way a WSGI server
+# notices that the client has gone away.
+KEEPALIVE = ": keep-alive\n\n"
+_END = object()
+
+
+def format_event(event, data) -> str:
+    """
+    Encode one Server-Sent Event whose data is ``data`` as a JSON line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def generation_events(chunks, started=None, keepalive=15.0):
+    """
+    Relay an async stream of text chunks to a WSGI response as SSE frames.
+
+    ``chunks`` is iterated on the shared background loop. The frames are a
+    ``ttfb`` event before the first chunk, one ``chunk`` event per chunk, then
+    ``done`` with the total time, or ``error`` if the stream fails. Times are
+    measured from ``started`` (a ``time.perf_counter()`` value, default now).
+
+    When the client disconnects the server closes this generator, and the
+    task iterating ``chunks`` is cancelled, which cancels the upstream call.
+
+    :param chunks: An async iterable of strings.
+    :param started: When the request arrived.
+    :param keepalive: Seconds of silence after which a comment is sent.
+    """
+    started = time.perf_counter() if started is None else started
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for chunk in chunks:
+                items.put(chunk)
+        except Exception as error:
+            items.put(_Failure(error))
+        finally:
+            items.put(_END)
+
+    future = shared_loop().submit(pump())
+    count = 0
+    try:
+        while True:
+            try:
+                item = items.get(timeout=keepalive)
+            except queue.Empty:
+                yield KEEPALIVE
+                continue
+            if item is _END:
+                break
+            if isinstance(item, _Failure):
+                logging.error(f"Streamed generation failed: {item.error}")
+                yield format_event("error", {"message": str(item.error)})
+                return
+            if count == 0:
+                yield format_event("ttfb", {"seconds": time.perf_counter() - started})
+            count += 1
+            yield format_event("chunk", {"text": item})
+        yield format_event(
+            "done", {"seconds": time.perf_counter() - started, "chunks": count}
+        )
+    finally:
+        # A no-op once the stream has finished; on a disconnect it cancels
+        # the task and with it the gRPC call.
+        future.cancel()
@@ -1,5 +1,14 @@
+import asyncio
+import io
+import json
+import queue
+import threading
+import time
+from collections import deque
+import aiohttp
 import pytest
-from unittest.mock import Mock, patch
+from aiohttp import web
+from unittest.mock import AsyncMock, Mock, patch
 from main import main
 from gui import GUI
 from api_handler import APIHandler
@@ -55,17 +64,1396 @@ def test_setup_logging(caplog):
 
 @pytest.mark.asyncio
 async def test_make_async_request():
-    gui = GUI()
+    gui = Mock()
     api_handler = APIHandler(gui)
-    api_handler.data_validation = Mock()
+    api_handler.data_validation = Mock(strict=False)
+    api_handler.data_validation.validate_and_extract.return_value = ["value"]
+    body = b'{"predictions": [{"generated_text": "value"}]}'
 
     with patch("aiohttp.ClientSession.get") as mock_get:
-        mock_get.return_value.__aenter__.return_value.json = Mock(
-            return_value={"predictions": [{"generated_text": "value"}]}
-        )
+        resp = mock_get.return_value.__aenter__.return_value
+        resp.raise_for_status = Mock()
+        resp.content_length = len(body)
+        resp.read = AsyncMock(return_value=body)
         await api_handler.make_async_request("query")
         mock_get.assert_called_once_with("https://api.example.com/generate?query=query")
-        api_handler.data_validation.validate_response.assert_called_once_with(
+        api_handler.data_validation.validate_and_extract.assert_called_once_with(
             {"predictions": [{"generated_text": "value"}]}
         )
         api_handler.gui.display_responses.assert_called_once_with(["value"])
+
+
+async def _start_stub_server(handler):
+    """
+    Serve ``handler`` on an ephemeral localhost port and return (runner, url).
+    """
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app, handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/generate"
+
+
+async def _echo_generate(request):
+    return web.json_response(
+        {"predictions": [{"generated_text": request.query["query"]}]}
+    )
+
+
+@pytest.mark.asyncio
+async def test_make_async_request_reuses_pooled_session():
+    runner, url = await _start_stub_server(_echo_generate)
+    try:
+        api_handler = APIHandler(base_url=url)
+        assert api_handler._session is None
+        assert await api_handler.make_async_request("one") == ["one"]
+        session = api_handler._session
+        assert await api_handler.make_async_request("two") == ["two"]
+        assert api_handler._session is session
+        await api_handler.close()
+        assert session.closed
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_make_async_requests_bounds_concurrency_and_reports_errors():
+    in_flight = {"now": 0, "max": 0}
+
+    async def generate(request):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        query = request.query["query"]
+        await asyncio.sleep(0.01 * (int(query) % 3) if query.isdigit() else 0)
+        in_flight["now"] -= 1
+        if query == "bad":
+            return web.json_response({"predictions": []})
+        return web.json_response({"predictions": [{"generated_text": query}]})
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        async with APIHandler(base_url=url) as api_handler:
+            queries = [str(i) for i in range(20)] + ["bad"]
+            results = [
+                result
+                async for result in api_handler.make_async_requests(
+                    iter(queries), concurrency=4, ordered=True
+                )
+            ]
+        assert in_flight["max"] <= 4
+        assert [result.item for result in results] == queries
+        assert [result.value for result in results[:-1]] == [[q] for q in queries[:-1]]
+        assert not results[-1].ok
+        assert isinstance(results[-1].error, ValueError)
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_identical_in_flight_queries_are_coalesced():
+    calls = []
+
+    async def generate(request):
+        calls.append(request.query["query"])
+        await asyncio.sleep(0.05)
+        return web.json_response(
+            {"predictions": [{"generated_text": request.query["query"]}]}
+        )
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        async with APIHandler(base_url=url) as api_handler:
+            results = await asyncio.gather(
+                *(api_handler.make_async_request(" same  query") for _ in range(5)),
+                api_handler.make_async_request("other"),
+            )
+            stats = api_handler.stats()
+        assert results == [["same query"]] * 5 + [["other"]]
+        assert sorted(calls) == ["other", "same query"]
+        assert stats["coalesce_hits"] == 4
+        assert stats["coalesce_misses"] == 2
+    finally:
+        await runner.cleanup()
+
+
+def test_response_cache_evicts_by_entries_bytes_and_ttl():
+    from response_cache import ResponseCache
+
+    cache = ResponseCache(max_entries=2, max_bytes=10, ttl=None)
+    cache.set("a", ("aaaa",))
+    cache.set("b", ("bbbb",))
+    assert cache.get("a") == ("aaaa",)
+    cache.set("c", ("cccc",))  # over max_entries: evicts "b", the least recent
+    assert cache.get("b") is None
+    cache.set("d", ("dddddddd",))  # over max_bytes
+    assert cache.get("d") == ("dddddddd",)
+    assert cache.bytes <= 10
+    cache.set("e", ("e",), ttl=-1)
+    assert cache.get("e") is None
+    stats = cache.stats()
+    assert stats["evictions"] == 3
+    assert stats["expirations"] == 1
+    assert stats["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_skips_request_and_validation():
+    calls = []
+
+    async def generate(request):
+        calls.append(request.query["query"])
+        return await _echo_generate(request)
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        async with APIHandler(base_url=url) as api_handler:
+            assert await api_handler.make_async_request("cached") == ["cached"]
+            api_handler.data_validation = Mock()
+            assert await api_handler.make_async_request("cached") == ["cached"]
+            api_handler.data_validation.validate_and_extract.assert_not_called()
+            stats = api_handler.stats()
+        assert calls == ["cached"]
+        assert stats["cache_hits"] == 1
+        assert stats["cache_misses"] == 1
+    finally:
+        await runner.cleanup()
+
+
+def test_persistent_cache_survives_restart_and_evicts_lru(tmp_path):
+    from response_cache import PersistentCache
+
+    path = str(tmp_path / "cache.sqlite3")
+    cache = PersistentCache(path, max_entries=2)
+    cache.set(("a", "text"), "A")
+    cache.set(("b", "text"), "B")
+    assert cache.get(("a", "text")) == "A"
+    cache.set(("c", "text"), "C")
+    cache.close()
+
+    reopened = PersistentCache(path, max_entries=2)
+    assert reopened.get(("a", "text")) == "A"
+    assert reopened.get(("b", "text")) is None
+    assert reopened.get(("c", "text")) == "C"
+    assert reopened.stats()["entries"] == 2
+
+    # A worker forked after the connection was opened must not share it.
+    inherited = reopened._connection()
+    with patch("response_cache.os.getpid", return_value=-1):
+        assert reopened._connection() is not inherited
+        assert reopened.get(("c", "text")) == "C"
+
+
+def test_process_request_uses_tiered_cache(tmp_path):
+    import model_selector
+    from response_cache import PersistentCache, ResponseCache, TieredCache
+
+    cache = TieredCache(
+        ResponseCache(), PersistentCache(str(tmp_path / "cache.sqlite3"))
+    )
+    input_data = {"content": "hello", "type": "text"}
+    task_details = {"task_type": "content_generation"}
+    with patch.object(model_selector, "response_cache", cache), patch.object(
+        model_selector, "DynamicGeminiModel"
+    ) as mock_model:
+        mock_model.return_value.generate_response.return_value = "generated"
+        assert model_selector.process_request(input_data, task_details) == "generated"
+        assert model_selector.process_request(input_data, task_details) == "generated"
+        cache.memory.clear()
+        assert model_selector.process_request(input_data, task_details) == "generated"
+    mock_model.return_value.generate_response.assert_called_once_with(
+        prompt="hello", is_image_present=False, priority="normal"
+    )
+    assert cache.stats()["disk"]["hits"] == 1
+
+
+def test_background_loop_runs_coroutines_off_the_calling_thread():
+    from background_loop import BackgroundLoop
+
+    loop = BackgroundLoop().start()
+    try:
+
+        async def whoami():
+            await asyncio.sleep(0)
+            return threading.current_thread().name
+
+        assert loop.run(whoami(), timeout=5) == "asyncio-background"
+        slow = loop.submit(asyncio.sleep(10))
+        slow.cancel()
+        assert slow.cancelled()
+    finally:
+        loop.stop()
+    assert loop.loop.is_closed()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_aborts_upstream_connection():
+    started = asyncio.Event()
+    aborted = asyncio.Event()
+
+    async def generate(request):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            aborted.set()
+            raise
+        return await _echo_generate(request)
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        async with APIHandler(base_url=url) as api_handler:
+            task = asyncio.ensure_future(api_handler.make_async_request("stale"))
+            await asyncio.wait_for(started.wait(), 5)
+            task.cancel()
+            await asyncio.wait_for(aborted.wait(), 5)
+            assert api_handler.stats()["coalesce_in_flight"] == 0
+    finally:
+        await runner.cleanup()
+
+
+def _headless_gui():
+    """
+    Build a GUI without a display: Tk widgets and the loop are mocks.
+    """
+    gui = GUI.__new__(GUI)
+    gui.root = Mock()
+    # Coroutines handed to the mocked loop are closed rather than run.
+    gui.loop = Mock(submit=Mock(side_effect=lambda coro: coro.close() or Mock()))
+    gui.api_handler = Mock(make_async_request=AsyncMock(return_value=[]))
+    gui.query_entry = Mock(get=Mock(return_value="query"))
+    gui.show_progress = Mock()
+    gui.results, gui.stream_chunks = queue.Queue(), queue.Queue()
+    gui.pending, gui.streams, gui.generation = {}, {}, 0
+    gui.render_queue, gui.render_id = deque(), None
+    gui.stream_model = None
+    return gui
+
+
+def test_new_generation_drops_lines_queued_for_rendering():
+    gui = _headless_gui()
+    gui.display_responses(["old\n" * 1000])
+    assert len(gui.render_queue) == 1001
+    gui.handle_user_input()
+    assert not gui.render_queue and gui.generation == 1
+
+
+def test_new_generation_cancels_a_stalled_stream_at_once():
+    from background_loop import BackgroundLoop
+
+    closed = []
+
+    class StalledModel:
+        async def stream_response_async(self, prompt):
+            try:
+                yield "first"
+                await asyncio.Event().wait()  # The next chunk never comes.
+            finally:
+                closed.append(prompt)
+
+    gui = _headless_gui()
+    gui.loop = BackgroundLoop().start()
+    gui.stream_model = StalledModel()
+    try:
+        gui.handle_stream_input()
+        assert gui.stream_chunks.get(timeout=5) == (1, "first")
+        gui.handle_user_input()
+        assert gui.stream_chunks.get(timeout=1) == (1, None)
+        assert closed == ["query"] and gui.streams[1][0].cancelled()
+    finally:
+        gui.loop.stop()
+
+
+class _FakeStreamingModel:
+    """
+    Stands in for genai.GenerativeModel, emitting chunks on a fixed schedule.
+    """
+
+    def __init__(self, chunks, delay):
+        self.chunks = chunks
+        self.delay = delay
+
+    def generate_content(self, prompt, stream=False):
+        def emit():
+            for text in self.chunks:
+                time.sleep(self.delay)
+                yield Mock(text=text)
+
+        return emit() if stream else Mock(text="".join(self.chunks))
+
+
+def test_stream_response_yields_chunks_and_records_metrics():
+    from dynamic_gemini_model import DynamicGeminiModel
+
+    model = DynamicGeminiModel(api_key="test-key")
+    fake = _FakeStreamingModel(["Hello, ", "streaming ", "world"], 0.02)
+    with patch("dynamic_gemini_model.get_model", return_value=fake):
+        assert list(model.stream_response("hi")) == ["Hello, ", "streaming ", "world"]
+    metrics = model.last_metrics
+    assert metrics.chunks == 3
+    assert 0.02 <= metrics.time_to_first_token < metrics.total_time
+    assert metrics.total_time >= 0.06
+    assert metrics.tokens_per_second > 0
+
+
+def test_model_registry_reuses_handles_without_global_configure():
+    from model_registry import ModelRegistry
+
+    registry = ModelRegistry()
+    with patch("google.generativeai.configure") as mock_configure:
+        first = registry.get_model("gemini-pro", "key-a")
+        assert registry.get_model("gemini-pro", "key-a") is first
+        other_key = registry.get_model("gemini-pro", "key-b")
+        tuned = registry.get_model("gemini-pro", "key-a", {"temperature": 0.9})
+    mock_configure.assert_not_called()
+    assert other_key is not first and tuned is not first
+    assert first._client is tuned._client
+    assert first._client is not other_key._client
+    assert len(registry) == 3
+
+
+def test_model_registry_calls_the_model_with_its_own_key():
+    import google.ai.generativelanguage as glm
+    from model_registry import ModelRegistry
+
+    used_keys = []
+
+    def generate_content(client, request):
+        used_keys.append(client._transport._credentials.token)
+        return glm.GenerateContentResponse(
+            candidates=[{"content": {"parts": [{"text": "hi"}]}}]
+        )
+
+    registry = ModelRegistry()
+    with patch.object(
+        glm.GenerativeServiceClient, "generate_content", autospec=True
+    ) as mock_generate, patch(
+        "google.generativeai.client.get_default_generative_client",
+        side_effect=AssertionError("default client used"),
+    ):
+        mock_generate.side_effect = generate_content
+        for key in ("key-a", "key-b", "key-a"):
+            assert registry.get_model("gemini-pro", key).generate_content("q").text
+    assert used_keys == ["key-a", "key-b", "key-a"]
+
+
+class _FakeAsyncGemini:
+    """
+    Async stand-in for the Gemini clients; prompts set their own latency.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _generate(self, text):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(float(text.split(":")[1]) if ":" in text else 0.01)
+            return Mock(text=text.upper())
+        finally:
+            self.in_flight -= 1
+
+    async def generate_content_async(self, contents):
+        text = contents if isinstance(contents, str) else contents[0]
+        return await self._generate(text)
+
+    async def generate_response_async(self, prompt, priority=None):
+        return (await self._generate(prompt)).text
+
+
+@pytest.mark.asyncio
+async def test_generate_many_bounds_concurrency_and_times_out():
+    from gemini_batch import generate_many
+
+    fake = _FakeAsyncGemini()
+    vision = Mock()
+    vision.generate_content_async = (
+        lambda text, image, priority=None: fake.generate_content_async([text, image])
+    )
+    items = ["a", "b", ("describe", "image-bytes"), "slow:1", "c", "d"]
+    results = [
+        result
+        async for result in generate_many(
+            items, text_model=fake, vision_api=vision, concurrency=2, call_timeout=0.2
+        )
+    ]
+    assert [result.value for result in results if result.ok] == [
+        "A",
+        "B",
+        "DESCRIBE",
+        "C",
+        "D",
+    ]
+    assert isinstance(results[3].error, asyncio.TimeoutError)
+    assert fake.max_in_flight == 2
+
+    results = [
+        result
+        async for result in generate_many(
+            ["slow:0.1"] * 4, text_model=fake, concurrency=1, deadline=0.15
+        )
+    ]
+    assert [result.ok for result in results] == [True, False, False, False]
+
+
+def test_sync_generate_response_wraps_async_path():
+    from dynamic_gemini_model import DynamicGeminiModel
+
+    model = DynamicGeminiModel(api_key="test-key")
+    with patch("dynamic_gemini_model.get_async_model", return_value=_FakeAsyncGemini()):
+        assert model.generate_response("hello") == "HELLO"
+
+
+def test_fast_validation_matches_response_model_rules():
+    data_validation = DataValidation()
+    data = {
+        "predictions": [{"generated_text": "a", "score": 1}, {"generated_text": "b"}]
+    }
+    assert data_validation.validate_and_extract(data) == ["a", "b"]
+    assert DataValidation(strict=True).validate_and_extract(data) == ["a", "b"]
+    for invalid in ({}, {"predictions": []}, {"predictions": [{"invalid_key": 1}]}):
+        with pytest.raises(ValueError):
+            data_validation.validate_and_extract(invalid)
+        with pytest.raises(ValueError):
+            ResponseModel(**invalid)
+    assert data_validation.validate_batch([data, data]) == [["a", "b"], ["a", "b"]]
+    with pytest.raises(ValueError, match="Response 1"):
+        data_validation.validate_batch([data, {"predictions": []}])
+
+
+def test_prediction_stream_parser_handles_arbitrary_chunking():
+    from json_decoding import PredictionStreamParser, decode
+
+    data = {
+        "model": "x",
+        "predictions": [
+            {"generated_text": "café [1], {2}", "score": 0.5},
+            {"generated_text": 'quote " and \\\\ slash', "tokens": [1, 2]},
+        ],
+    }
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    assert decode(body) == data
+    for size in (1, 2, 3, 7, len(body)):
+        parser = PredictionStreamParser()
+        for start in range(0, len(body), size):
+            parser.feed(body[start : start + size])
+        assert parser.close() == [p["generated_text"] for p in data["predictions"]]
+
+    parser = PredictionStreamParser()
+    parser.feed(body[:-10])
+    with pytest.raises(ValueError):
+        parser.close()
+    parser = PredictionStreamParser()
+    with pytest.raises(ValueError):
+        parser.feed(b'{"predictions": [{"text": "missing"}]}')
+
+
+def test_prediction_stream_parser_only_reads_the_top_level_key():
+    from json_decoding import PredictionStreamParser
+
+    data = {
+        "note": 'the "predictions": [ key, quoted',
+        "meta": {"predictions": [{"generated_text": "nested"}], "n": -1.5e3},
+        "flag": True,
+        "predictions": [{"generated_text": "real", "extra": [1, {"a": "]"}]}],
+    }
+    body = json.dumps(data).encode("utf-8")
+    for size in (1, 5, len(body)):
+        parser = PredictionStreamParser()
+        for start in range(0, len(body), size):
+            parser.feed(body[start : start + size])
+        assert parser.close() == ["real"]
+    parser = PredictionStreamParser()
+    parser.feed(b'{"note": "\\"predictions\\": [{\\"generated_text\\": 1}]"}')
+    with pytest.raises(ValueError, match="No predictions"):
+        parser.close()
+
+
+@pytest.mark.asyncio
+async def test_large_bodies_are_stream_decoded():
+    async def generate(request):
+        predictions = [{"generated_text": f"t{i}"} for i in range(2000)]
+        return web.json_response({"predictions": predictions})
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        async with APIHandler(base_url=url, stream_threshold=1024) as api_handler:
+            responses = await api_handler.make_async_request("big")
+            stats = api_handler.stats()
+        assert responses == [f"t{i}" for i in range(2000)]
+        assert stats["decode_count"] == 1
+        assert stats["decoded_bytes"] > 1024
+        assert stats["decode_seconds"] > 0
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_chunked_bodies_are_buffered_until_they_pass_the_threshold():
+    from json_decoding import PredictionStreamParser
+
+    async def generate(request):
+        count = int(request.query["query"])
+        body = json.dumps(
+            {"predictions": [{"generated_text": f"t{i}"} for i in range(count)]}
+        ).encode()
+        response = web.StreamResponse()  # No Content-Length: chunked.
+        await response.prepare(request)
+        for start in range(0, len(body), 100):
+            await response.write(body[start : start + 100])
+        await response.write_eof()
+        return response
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        async with APIHandler(base_url=url, stream_threshold=1024) as api_handler:
+            with patch(
+                "api_handler.PredictionStreamParser", wraps=PredictionStreamParser
+            ) as parser:
+                decoder = Mock(wraps=api_handler.decoder)
+                api_handler.decoder = decoder
+                assert await api_handler.make_async_request("3") == ["t0", "t1", "t2"]
+                decoder.assert_called_once()
+                parser.assert_not_called()
+                responses = await api_handler.make_async_request("2000")
+                assert responses == [f"t{i}" for i in range(2000)]
+                parser.assert_called_once()
+                decoder.assert_called_once()
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried_and_open_the_breaker():
+    from resilience import CircuitOpenError, Resilience, RetryPolicy
+
+    faults = {"flaky": 2, "down": 10**6}
+    hits = {"flaky": 0, "down": 0}
+
+    async def generate(request):
+        query = request.query["query"]
+        hits[query] += 1
+        if hits[query] <= faults[query]:
+            return web.Response(status=503, headers={"Retry-After": "0"})
+        return await _echo_generate(request)
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        resilience = Resilience(
+            RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.01),
+            failure_threshold=3,
+            reset_timeout=60,
+        )
+        async with APIHandler(base_url=url, resilience=resilience) as api_handler:
+            assert await api_handler.make_async_request("flaky") == ["flaky"]
+            stats = api_handler.stats()["resilience"]
+            assert stats["retries"] == 2
+            assert stats["state"] == "closed"
+
+            assert await api_handler.make_async_request("down") == []
+            assert hits["down"] == 3
+            assert api_handler.stats()["resilience"]["state"] == "open"
+            with pytest.raises(CircuitOpenError):
+                await api_handler._fetch("fails fast")
+        assert hits["down"] == 3
+        assert resilience.stats()[url]["short_circuits"] == 1
+    finally:
+        await runner.cleanup()
+
+
+def test_throttling_is_retried_without_opening_the_breaker():
+    from key_pool import KeyPool
+    from resilience import CircuitOpenError, Resilience, RetryPolicy
+
+    resilience = Resilience(
+        RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.01),
+        failure_threshold=2,
+        reset_timeout=60,
+    )
+    pool = KeyPool(["key-a", "key-b"], cooldown=60)
+    throttled = aiohttp.ClientResponseError(
+        Mock(real_url="u"), (), status=429, headers={"Retry-After": "0"}
+    )
+
+    def call():
+        with pool.lease() as key:
+            if key == "key-a":
+                raise throttled
+            return key
+
+    for _ in range(3):
+        assert resilience.call("gemini", call) == "key-b"
+    stats = resilience.stats()["gemini"]
+    assert stats["state"] == "closed" and stats["consecutive_failures"] == 0
+    assert stats["throttled"] >= 1 and stats["failures"] == 0
+    # Retry-After: 0 puts the key straight back into rotation.
+    assert not any(usage["cooling_down"] for usage in pool.stats().values())
+
+    # Real failures still open it: the third attempt is short-circuited.
+    unavailable = aiohttp.ClientResponseError(Mock(real_url="u"), (), status=503)
+    with pytest.raises(CircuitOpenError):
+        resilience.call("gemini", Mock(side_effect=unavailable))
+    assert resilience.stats()["gemini"]["state"] == "open"
+
+
+def test_rate_limiter_queues_fairly_and_adapts_to_throttling():
+    from rate_limiter import RateLimiter
+
+    limiter = RateLimiter("m", requests_per_minute=600, burst_seconds=0.2)
+    # Two requests fit in the burst; later ones queue 0.1s apart in order.
+    waits = [limiter.reserve() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[1] < waits[2] < waits[3]
+    assert waits[3] == pytest.approx(0.2, abs=0.01)
+
+    throttled = aiohttp.ClientResponseError(None, (), status=429)
+    with pytest.raises(aiohttp.ClientResponseError):
+        limiter.call(Mock(side_effect=throttled))
+    assert limiter.fraction == 0.5
+    assert limiter.call(lambda: "ok") == "ok"
+    assert limiter.fraction == pytest.approx(0.55)
+
+    stats = limiter.stats()
+    assert stats["requests"] == 6
+    assert stats["throttled"] == 1
+    assert stats["queued"] >= 2
+    assert stats["max_wait"] >= waits[3]
+
+    tokens = RateLimiter("t", tokens_per_minute=6000, burst_seconds=1)
+    assert tokens.reserve(100) == 0.0
+    assert tokens.reserve(50) == pytest.approx(0.5, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_api_handler_without_a_budget_slows_down_after_a_429():
+    from rate_limiter import RateLimiter
+    from resilience import Resilience, RetryPolicy
+
+    hits = []
+
+    async def generate(request):
+        hits.append(request.query["query"])
+        if len(hits) == 10:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        return await _echo_generate(request)
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        limiter = RateLimiter(url)
+        async with APIHandler(
+            base_url=url,
+            limiter=limiter,
+            resilience=Resilience(RetryPolicy(base_delay=0.001, max_delay=0.01)),
+        ) as api_handler:
+            for i in range(9):
+                assert await api_handler.make_async_request(f"q{i}") == [f"q{i}"]
+            assert limiter.stats()["requests_per_minute"] is None
+            started = time.monotonic()
+            for i in range(9, 14):
+                assert await api_handler.make_async_request(f"q{i}") == [f"q{i}"]
+            elapsed = time.monotonic() - started
+        stats = limiter.stats()
+        # Ten requests in well under a second were learned as 10/s and
+        # halved: the calls after the 429 are paced instead of sent at once.
+        assert stats["throttled"] == 1 and stats["queued"] >= 5
+        assert stats["requests_per_minute"] < 600
+        assert elapsed >= 0.6
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_refunds_cancelled_reservations_and_reports_per_key():
+    from rate_limiter import RateLimiter, get_limiter, limiter_stats
+
+    limiter = RateLimiter("m", requests_per_minute=600, burst_seconds=0.1)
+    assert limiter.reserve() == 0.0
+    waiting = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0.01)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    # The cancelled caller's slot goes to the next one instead of being lost.
+    assert limiter.reserve() == pytest.approx(0.09, abs=0.02)
+    assert limiter.stats()["refunded"] == 1
+
+    get_limiter("stats-model", "key-aaaa")
+    get_limiter("stats-model", "key-bbbb")
+    assert len(limiter_stats()["stats-model"]) == 2
+
+
+def test_key_pool_balances_keys_and_cools_down_failing_ones():
+    from dynamic_gemini_model import DynamicGeminiModel
+    from key_pool import KeyPool, mask_key
+    from resilience import Resilience, RetryPolicy
+
+    pool = KeyPool(["key-a", "key-b", "key-c"], cooldown=60, auth_cooldown=600)
+    assert [pool.acquire(hold=False) for _ in range(4)] == [
+        "key-a",
+        "key-b",
+        "key-c",
+        "key-a",
+    ]
+
+    used = []
+
+    def fake_model(model_name, key):
+        used.append(key)
+        if key == "key-b":
+            return Mock(
+                generate_content_async=Mock(
+                    side_effect=aiohttp.ClientResponseError(Mock(real_url="u"), (), status=429)
+                )
+            )
+        return _FakeAsyncGemini()
+
+    model = DynamicGeminiModel(key_pool=pool)
+    fast_retries = Resilience(RetryPolicy(base_delay=0.001, max_delay=0.001))
+    with patch("dynamic_gemini_model.get_async_model", side_effect=fake_model), patch(
+        "dynamic_gemini_model.resilience", fast_retries
+    ):
+        assert model.generate_response("one") == "ONE"
+        assert model.generate_response("two") == "TWO"
+        assert model.generate_response("three") == "THREE"
+    # key-b was throttled once, retried on key-c, then left out of rotation.
+    assert used == ["key-b", "key-c", "key-a", "key-c"]
+
+    stats = pool.stats()
+    key_b = mask_key("key-b")
+    assert stats[key_b]["cooling_down"] and stats[key_b]["failures"] == 1
+    assert stats[mask_key("key-c")]["successes"] == 2
+    assert all(usage["in_flight"] == 0 for usage in stats.values())
+
+    pool.release(pool.acquire(), aiohttp.ClientResponseError(Mock(real_url="u"), (), status=403))
+    assert pool.stats()[mask_key("key-a")]["cooldowns"] == 1
+    key = pool.acquire()
+    assert key == "key-c"
+    pool.release(key, aiohttp.ClientResponseError(Mock(real_url="u"), (), status=429))
+    # Every key is cooling down: the one that recovers first is used.
+    assert pool.acquire(hold=False) == "key-b"
+
+    # Keys sharing a suffix are still reported separately.
+    assert len(KeyPool(["first-same", "other-same"]).stats()) == 2
+
+
+def test_stream_holds_its_key_until_the_stream_ends():
+    from dynamic_gemini_model import DynamicGeminiModel
+    from key_pool import KeyPool, mask_key
+
+    throttled = aiohttp.ClientResponseError(Mock(real_url="u"), (), status=429)
+
+    def chunks(stream=False):
+        yield Mock(text="partial ")
+        raise throttled
+
+    pool = KeyPool(["key-a"])
+    model = DynamicGeminiModel(key_pool=pool)
+    fake = Mock(generate_content=lambda prompt, stream: chunks())
+    with patch("dynamic_gemini_model.get_model", return_value=fake):
+        stream = model.stream_response("hi")
+        assert next(stream) == "partial "
+        assert pool.stats()[mask_key("key-a")]["in_flight"] == 1
+        with pytest.raises(aiohttp.ClientResponseError):
+            next(stream)
+    usage = pool.stats()[mask_key("key-a")]
+    # The error raised mid-stream reached the lease and cooled the key down.
+    assert usage["cooling_down"] and usage["in_flight"] == 0
+
+    pool = KeyPool(["key-b"])
+    model = DynamicGeminiModel(key_pool=pool)
+    with patch("dynamic_gemini_model.get_model", return_value=fake):
+        stream = model.stream_response("hi")
+        next(stream)
+        stream.close()
+    usage = pool.stats()[mask_key("key-b")]
+    assert usage["in_flight"] == 0 and not usage["cooling_down"]
+
+
+@pytest.mark.asyncio
+async def test_hedger_races_a_backup_for_slow_calls_within_budget():
+    from hedging import Hedger
+
+    hedger = Hedger(percentile=0.9, max_extra=0.2, min_samples=4)
+    delays = []
+    cancelled = []
+
+    async def call():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    delays.extend([0.01] * 4)
+    for _ in range(4):
+        assert await hedger.call("ep", call) == 0.01
+    assert hedger.stats()["ep"]["hedges"] == 0
+
+    # Slow primary, fast hedge: the hedge wins and the primary is cancelled.
+    delays.extend([1.0, 0.01])
+    started = asyncio.get_running_loop().time()
+    assert await hedger.call("ep", call) == 0.01
+    assert asyncio.get_running_loop().time() - started < 0.5
+    assert cancelled == [1.0]
+
+    # A second hedge would exceed a fifth of the calls so far (2 of 6).
+    delays.append(0.1)
+    assert await hedger.call("ep", call) == 0.1
+    assert delays == []
+    stats = hedger.stats()["ep"]
+    assert stats["calls"] == 6
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    assert stats["extra_load"] <= 0.2
+    # The window holds the primaries' latencies: the cancelled 1.0s primary
+    # counts for its time so far, not the 0.01s of the hedge that beat it.
+    assert sorted(hedger._windows["ep"].samples)[-2] >= 0.015
+
+
+@pytest.mark.asyncio
+async def test_hedges_need_rate_limit_budget_of_their_own():
+    from hedging import Hedger
+    from rate_limiter import RateLimiter
+
+    hedger = Hedger(percentile=0.5, max_extra=1.0, min_samples=1)
+    limiter = RateLimiter("hedged", requests_per_minute=60, burst_seconds=3)
+    delays = [0.05, 1.0, 0.01, 0.2]
+
+    async def call():
+        await asyncio.sleep(delays.pop(0))
+        return "ok"
+
+    def limited():
+        return limiter.call_async(
+            lambda: hedger.call("ep", call, limiter.try_reserve)
+        )
+
+    assert await limited() == "ok"
+    # Slow primary: the hedge takes the last request in the burst and wins.
+    assert await limited() == "ok"
+    assert limiter.stats()["requests"] == 3
+    # With the budget spent, a slow call goes unhedged rather than over quota.
+    assert await hedger.call("ep", call, limiter.try_reserve) == "ok"
+    assert delays == [] and limiter.stats()["requests"] == 3
+    stats = hedger.stats()["ep"]
+    assert stats["hedges"] == 1 and stats["no_budget"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedger_times_requests_without_their_queue_wait():
+    from hedging import Hedger
+    from scheduler import Scheduler
+
+    async def generate(request):
+        await asyncio.sleep(0.05)
+        return await _echo_generate(request)
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        hedger = Hedger(min_samples=1)
+        async with APIHandler(
+            base_url=url, hedger=hedger, scheduler=Scheduler(url, max_in_flight=1)
+        ) as api_handler:
+            queries = [f"q{i}" for i in range(6)]
+            results = await asyncio.gather(
+                *(api_handler.make_async_request(query) for query in queries)
+            )
+        assert results == [[query] for query in queries]
+        # The last request queued for about 0.25s behind the others, but only
+        # the time it spent on the wire is a latency sample.
+        assert 0.05 <= max(hedger._windows[url].samples) < 0.2
+        assert hedger.stats()[url]["hedges"] == 0
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_query_file_batch_writes_incrementally_and_resumes(tmp_path):
+    from batch_jobs import run_query_file
+
+    source = tmp_path / "queries.jsonl"
+    lines = [json.dumps({"id": i, "query": f"q{i}"}) for i in range(20)]
+    lines[3] = json.dumps("plain string query")
+    lines[7] = "{not json"
+    lines[9] = ""
+    source.write_text("\n".join(lines) + "\n")
+    output = tmp_path / "out.jsonl"
+    seen = []
+    release = asyncio.Event()
+
+    async def generate(request):
+        query = request.query["query"]
+        seen.append(query)
+        if query == "q12":
+            await release.wait()
+        return await _echo_generate(request)
+
+    runner, url = await _start_stub_server(generate)
+    try:
+        async with APIHandler(base_url=url) as api_handler:
+            # Interrupt the run while q12 is stuck.
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    run_query_file(
+                        api_handler, source, output, concurrency=4, progress=False
+                    ),
+                    0.5,
+                )
+        first_run = set(seen)
+        # Simulate a result written after the last checkpoint save.
+        with open(output, "ab") as file:
+            file.write(b'{"line": 99, "partial": true}\n')
+
+        release.set()
+        seen.clear()
+        async with APIHandler(base_url=url) as api_handler:
+            summary = await run_query_file(
+                api_handler, source, output, concurrency=4, progress=False
+            )
+    finally:
+        await runner.cleanup()
+
+    assert "q12" in seen and not first_run & (set(seen) - {"q12"})
+    assert summary["succeeded"] + summary["skipped"] + summary["failed"] >= 19
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(record["line"] for record in records) == [
+        i for i in range(20) if i != 9
+    ]
+    by_line = {record["line"]: record for record in records}
+    assert by_line[3]["responses"] == ["plain string query"]
+    assert "error" in by_line[7]
+    assert by_line[12] == {"line": 12, "id": 12, "query": "q12", "responses": ["q12"]}
+
+
+@pytest.mark.asyncio
+async def test_image_batch_decodes_in_processes_and_streams_jsonl(tmp_path):
+    import PIL.Image
+    from multimodal_batch import load_items, run_image_batch
+
+    images = tmp_path / "images"
+    images.mkdir()
+    for name, size in (("a.png", (40, 30)), ("b.jpg", (64, 64)), ("c.png", (8, 8))):
+        PIL.Image.new("RGB", size, "red").save(images / name)
+    (images / "b.txt").write_text("What is in b?")
+    (images / "broken.png").write_bytes(b"not an image")
+    (images / "notes.md").write_text("ignored")
+
+    class FakeVision:
+        async def generate_content_async(self, text, blob, priority=None):
+            await asyncio.sleep(0.01)
+            return Mock(text=f"{text}|{blob['mime_type']}|{len(blob['data']) > 0}")
+
+    items, total = load_items(str(images), prompt="Describe")
+    output = tmp_path / "out.jsonl"
+    stats = await run_image_batch(
+        items,
+        output,
+        FakeVision(),
+        decode_workers=2,
+        concurrency=2,
+        total=total,
+        progress=False,
+    )
+    records = {
+        record["id"]: record
+        for record in map(json.loads, output.read_text().splitlines())
+    }
+    assert total == 4 and set(records) == {"a.png", "b.jpg", "broken.png", "c.png"}
+    assert records["a.png"]["text"] == "Describe|image/jpeg|True"
+    assert records["b.jpg"]["text"] == "What is in b?|image/jpeg|True"
+    assert "error" in records["broken.png"]
+    assert stats["decode"]["items"] == 4 and stats["decode"]["failures"] == 1
+    assert stats["generate"]["items"] == 3
+    assert stats["total"]["items"] == 4
+
+
+@pytest.mark.asyncio
+async def test_image_batch_rejects_missing_prompts_and_cancels_cleanly(tmp_path):
+    import PIL.Image
+    from multimodal_batch import load_items, run_image_batch
+
+    images = tmp_path / "images"
+    images.mkdir()
+    for name in ("a.png", "b.png", "c.png"):
+        PIL.Image.new("RGB", (8, 8), "red").save(images / name)
+    (images / "a.txt").write_text("Only a has a prompt")
+    with pytest.raises(ValueError, match="2 item"):
+        load_items(str(images))
+
+    class StuckVision:
+        async def generate_content_async(self, text, blob, priority=None):
+            await asyncio.Event().wait()
+
+    items, _ = load_items(str(images), prompt="Describe")
+    batch = asyncio.ensure_future(
+        run_image_batch(
+            items,
+            tmp_path / "out.jsonl",
+            StuckVision(),
+            decode_workers=1,
+            concurrency=1,
+            queue_size=1,
+            progress=False,
+        )
+    )
+    await asyncio.sleep(3)
+    batch.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await batch
+    await asyncio.sleep(0)
+    leftover = asyncio.all_tasks() - {asyncio.current_task()}
+    assert not leftover
+
+
+def test_preprocess_image_downscales_and_orients_uploads_from_the_stream():
+    import PIL.Image
+    from werkzeug.datastructures import FileStorage
+    from multimodal_input import MultimodalInputProcessor
+
+    photo = PIL.Image.effect_noise((1200, 800), 50).convert("RGB")
+    exif = PIL.Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise to display.
+    encoded = io.BytesIO()
+    photo.save(encoded, format="JPEG", quality=95, exif=exif)
+    upload = FileStorage(stream=io.BytesIO(encoded.getvalue()), filename="p.jpg")
+
+    blob, report = MultimodalInputProcessor.preprocess_image(
+        upload, max_edge=300, quality=70
+    )
+    result = PIL.Image.open(io.BytesIO(blob["data"]))
+    assert blob["mime_type"] == "image/jpeg"
+    assert result.format == "JPEG" and result.mode == "RGB"
+    assert result.size == (200, 300)
+    assert report["original_size"] == (1200, 800)
+    assert report["input_bytes"] == len(encoded.getvalue())
+    assert report["bytes_saved"] == report["input_bytes"] - len(blob["data"]) > 0
+
+    transparent = io.BytesIO()
+    PIL.Image.new("RGBA", (50, 40), (255, 0, 0, 0)).save(transparent, format="PNG")
+    transparent.seek(0)
+    blob, report = MultimodalInputProcessor.preprocess_image(transparent)
+    result = PIL.Image.open(io.BytesIO(blob["data"]))
+    assert result.size == (50, 40)
+    assert result.getpixel((0, 0)) == pytest.approx((255, 255, 255), abs=2)
+
+
+def test_multimodal_result_cache_hits_on_identical_and_reencoded_images(tmp_path):
+    import PIL.Image
+    from werkzeug.datastructures import FileStorage
+    from multimodal_cache import MultimodalResultCache
+    from response_cache import PersistentCache
+
+    screenshot = PIL.Image.effect_noise((64, 48), 30).convert("RGB")
+
+    def upload(**save_options):
+        data = io.BytesIO()
+        screenshot.save(data, format="PNG", **save_options)
+        return FileStorage(stream=io.BytesIO(data.getvalue()), filename="s.png")
+
+    cache = MultimodalResultCache(PersistentCache(str(tmp_path / "results.sqlite3")))
+    analyze = Mock(return_value={"text": "a screenshot", "analysis": "..."})
+
+    first = cache.fetch(upload(), "What is this?", "gemini-pro-vision", analyze)
+    assert first == {"text": "a screenshot", "analysis": "..."}
+    assert analyze.call_count == 1
+    assert analyze.call_args[0][0]["mime_type"] == "image/jpeg"
+
+    with patch("multimodal_cache.MultimodalInputProcessor.preprocess_image") as pre:
+        again = cache.fetch(upload(), " What is  this? ", "gemini-pro-vision", analyze)
+    assert again == first and not pre.called
+
+    # Same pixels, different encoding: found through the normalized image.
+    reencoded = upload(compress_level=1, optimize=False)
+    assert cache.fetch(reencoded, "What is this?", "gemini-pro-vision", analyze) == first
+    assert analyze.call_count == 1
+
+    cache.fetch(upload(), "Something else?", "gemini-pro-vision", analyze)
+    assert analyze.call_count == 2
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["upload_hits"], stats["misses"]) == (2, 1, 2)
+    assert stats["hit_ratio"] == 0.5
+    assert stats["entries"] == 5 and stats["bytes"] > 0
+
+
+def test_web_server_uses_threaded_workers_and_warms_up_models():
+    from flask import Flask
+    from model_registry import registry
+    from serve import WebServer, post_worker_init, server_options
+
+    options = server_options(workers=3, bind="127.0.0.1:0")
+    assert options["worker_class"] == "gthread"
+    assert options["workers"] == 3 and options["threads"] >= 1
+    assert options["graceful_timeout"] > 0
+
+    app = Flask("stub")
+    server = WebServer(app, workers=2, threads=4)
+    assert server.load() is app
+    assert (server.cfg.workers, server.cfg.threads) == (2, 4)
+
+    registry.clear()
+    worker = Mock(pid=1)
+    post_worker_init(worker)
+    worker.log.info.assert_called_once()
+    assert len(registry) >= 2
+
+
+def test_sse_endpoint_streams_timed_chunks_and_cancels_on_disconnect():
+    import ui
+
+    async def chunks(prompt):
+        for text in ("Hel", "lo"):
+            await asyncio.sleep(0.01)
+            yield text
+
+    with patch.object(ui.text_model, "stream_response_async", chunks):
+        response = ui.app.test_client().get("/events?text=hi")
+    assert response.mimetype == "text/event-stream"
+    events = [
+        frame.split("\n")[0].split(": ", 1)[1]
+        for frame in response.get_data(as_text=True).strip().split("\n\n")
+    ]
+    assert events == ["ttfb", "chunk", "chunk", "done"]
+    assert 'data: {"text": "Hel"}' in response.get_data(as_text=True)
+
+    cancelled = threading.Event()
+
+    async def endless(prompt):
+        try:
+            yield "first"
+            await asyncio.sleep(60)
+        finally:
+            cancelled.set()
+
+    with patch.object(ui.text_model, "stream_response_async", endless):
+        response = ui.app.test_client().get("/events?text=hi", buffered=False)
+        frames = iter(response.response)
+        assert b"event: ttfb" in next(frames)
+        assert b'"first"' in next(frames)
+        # What the WSGI server does when the client goes away.
+        response.close()
+    assert cancelled.wait(1)
+
+
+def test_job_queue_accepts_polls_and_pushes_back_when_full(tmp_path):
+    import ui
+    from job_queue import JobQueue
+
+    gate = threading.Event()
+
+    def handler(payload):
+        gate.wait(5)
+        if payload["text"] == "boom":
+            raise ValueError("bad image")
+        return {"text": payload["text"], "size": len(payload["image"])}
+
+    job_queue = JobQueue(
+        str(tmp_path / "jobs.sqlite3"), handler, workers=1, max_depth=1, max_results=2
+    )
+    client = ui.app.test_client()
+
+    def submit(text):
+        return client.post(
+            "/jobs", data={"text": text, "image": (io.BytesIO(b"img"), "a.jpg")}
+        )
+
+    with patch.object(ui, "jobs", job_queue):
+        first = submit("first")
+        assert first.status_code == 202
+        first_id = first.get_json()["id"]
+        assert first.headers["Location"] == f"/jobs/{first_id}"
+        while job_queue.get(first_id)["status"] != "running":
+            time.sleep(0.01)
+        second_id = submit("boom").get_json()["id"]
+        # One job running and one queued: the queue is at its depth.
+        full = submit("third")
+        assert full.status_code == 429 and "Retry-After" in full.headers
+
+        assert client.get(f"/jobs/{first_id}").get_json()["status"] == "running"
+        started = time.monotonic()
+        assert client.get(f"/jobs/{first_id}?wait=0.2").get_json()["status"] == (
+            "running"
+        )
+        assert time.monotonic() - started >= 0.2
+        gate.set()
+        done = client.get(f"/jobs/{first_id}?wait=5").get_json()
+        assert done["status"] == "done"
+        assert done["result"] == {"text": "first", "size": 3}
+        failed = client.get(f"/jobs/{second_id}?wait=5").get_json()
+        assert failed["status"] == "failed" and "bad image" in failed["error"]
+
+        # Only the two newest finished jobs are kept.
+        third_id = submit("third").get_json()["id"]
+        assert client.get(f"/jobs/{third_id}?wait=5").get_json()["status"] == "done"
+        assert client.get(f"/jobs/{first_id}").status_code == 404
+        stats = client.get("/job-stats").get_json()
+        assert stats["rejected"] == 1 and stats["completed"] == 2
+        assert stats["failed"] == 1 and stats["queued"] == 0
+    job_queue.stop()
+
+
+def test_job_queue_counts_every_job_finished_by_concurrent_workers(tmp_path):
+    from job_queue import JobQueue
+
+    def handler(number):
+        if number % 3 == 0:
+            raise ValueError(number)
+        return number
+
+    job_queue = JobQueue(
+        str(tmp_path / "jobs.sqlite3"), handler, workers=8, max_depth=200
+    )
+    try:
+        ids = [job_queue.submit(number) for number in range(120)]
+        for job_id in ids:
+            assert job_queue.wait(job_id, 30)["status"] in ("done", "failed")
+        stats = job_queue.stats()
+    finally:
+        job_queue.stop()
+    assert stats["submitted"] == 120
+    assert stats["completed"] == 80 and stats["failed"] == 40
+
+
+def test_idle_job_queue_fails_lost_jobs_and_drops_expired_ones(tmp_path):
+    from job_queue import JobQueue
+
+    job_queue = JobQueue(
+        str(tmp_path / "jobs.sqlite3"),
+        lambda payload: payload,
+        workers=1,
+        poll_interval=0.01,
+        stale_after=60,
+        purge_interval=0.0,
+    )
+    now = time.time()
+    connection = job_queue._connection()
+    # A job whose worker died mid-run, and a result that has expired.
+    connection.execute(
+        "INSERT INTO jobs (id, status, created_at, started_at) VALUES (?, ?, ?, ?)",
+        ("lost", "running", now - 120, now - 120),
+    )
+    connection.execute(
+        "INSERT INTO jobs (id, status, created_at, finished_at, expires_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        ("old", "done", now - 120, now - 100, now - 1),
+    )
+    try:
+        job_queue.start()
+        deadline = time.monotonic() + 5
+        while job_queue.get("lost")["status"] == "running":
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        job_queue.stop()
+    assert job_queue.get("lost")["error"] == "worker lost"
+    assert connection.execute("SELECT id FROM jobs").fetchall() == [("lost",)]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_orders_by_priority_shares_slots_and_enforces_deadlines():
+    from scheduler import BATCH, INTERACTIVE, NORMAL, DeadlineExceeded, Scheduler
+
+    scheduler = Scheduler("test", max_in_flight=1)
+    order = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        await gate.wait()
+
+    def job(name):
+        async def run():
+            order.append(name)
+            await asyncio.sleep(0)
+
+        return run
+
+    held = asyncio.ensure_future(scheduler.call_async(blocker, BATCH))
+    await asyncio.sleep(0)
+    calls = [scheduler.call_async(job(f"b{i}"), BATCH) for i in range(3)]
+    calls += [scheduler.call_async(job(f"i{i}"), INTERACTIVE) for i in range(10)]
+    calls.append(scheduler.call_async(job("n0"), NORMAL))
+    tasks = [asyncio.ensure_future(call) for call in calls]
+    await asyncio.sleep(0.01)
+    stats = scheduler.stats()["classes"]
+    assert (stats[BATCH]["queued"], stats[INTERACTIVE]["queued"]) == (3, 10)
+
+    # A queued call gives up at its deadline instead of being sent late.
+    with pytest.raises(DeadlineExceeded):
+        await scheduler.call_async(
+            job("late"), INTERACTIVE, deadline=time.monotonic() + 0.02
+        )
+    gate.set()
+    await asyncio.gather(held, *tasks)
+
+    # Interactive work jumps the queue, but batch still gets its share.
+    assert order[0] == "i0" and "late" not in order
+    assert order.index("n0") < order.index("b0") < order.index("i9")
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0
+    assert stats["classes"][INTERACTIVE]["expired"] == 1
+    assert stats["classes"][BATCH]["max_wait"] >= 0.01
+
+    # A request that waits past max_wait is served first whatever its class.
+    scheduler = Scheduler("test", max_in_flight=1, max_wait=0.0)
+    order.clear()
+    gate.clear()
+    held = asyncio.ensure_future(scheduler.call_async(blocker))
+    await asyncio.sleep(0)
+    tasks = [asyncio.ensure_future(scheduler.call_async(job("b"), BATCH))]
+    await asyncio.sleep(0.001)
+    tasks.append(asyncio.ensure_future(scheduler.call_async(job("i"), INTERACTIVE)))
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(held, *tasks)
+    assert order == ["b", "i"]
+    assert scheduler.stats()["classes"][BATCH]["aged"] == 1
+
+    # A zero weight would divide by zero at the first admission of its class.
+    with pytest.raises(ValueError, match="batch"):
+        Scheduler("test", weights={BATCH: 0})
+
+
+@pytest.mark.asyncio
+async def test_api_handler_schedules_single_queries_as_interactive():
+    from scheduler import BATCH, INTERACTIVE, Scheduler
+
+    scheduler = Scheduler("api")
+    api_handler = APIHandler(scheduler=scheduler)
+    with patch.object(api_handler, "_request_once", return_value=["ok"]):
+        assert await api_handler.make_async_request("one") == ["ok"]
+        results = [r async for r in api_handler.make_async_requests(["a", "b"])]
+    assert [r.value for r in results if r.ok] == [["ok"], ["ok"]]
+    classes = api_handler.stats()["scheduler"]["classes"]
+    assert classes[INTERACTIVE]["admitted"] == 1
+    assert classes[BATCH]["admitted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_query_file_batch_restarts_when_output_was_deleted(tmp_path):
+    from batch_jobs import Checkpoint, run_query_file
+
+    source = tmp_path / "queries.jsonl"
+    source.write_text("\n".join(json.dumps(f"q{i}") for i in range(5)) + "\n")
+    output = tmp_path / "out.jsonl"
+    # A finished run whose output has since been deleted.
+    checkpoint = Checkpoint(f"{output}.checkpoint")
+    for line in range(5):
+        checkpoint.mark(line)
+    checkpoint.save(500)
+
+    runner, url = await _start_stub_server(_echo_generate)
+    try:
+        async with APIHandler(base_url=url) as api_handler:
+            summary = await run_query_file(api_handler, source, output, progress=False)
+    finally:
+        await runner.cleanup()
+
+    assert summary == {"succeeded": 5, "failed": 0, "skipped": 0}
+    records = [json.loads(line) for line in output.read_bytes().splitlines()]
+    assert sorted(record["line"] for record in records) == list(range(5))
+    assert b"\0" not in output.read_bytes()
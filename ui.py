@@ -1,24 +1,141 @@
 # ui.py
+import io
 import os
-from flask import Flask, request, render_template
+import time
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    request,
+    render_template,
+    stream_with_context,
+)
+from config import config
+from dynamic_gemini_model import DynamicGeminiModel
+from job_queue import QueueFull, JobQueue
+from multimodal_cache import MultimodalResultCache
 from multimodal_input import MultimodalInputProcessor
 from gemini_vision_pro_api import GeminiVisionProAPI
 from response_handler import GeminiResponseHandler
+from rate_limiter import limiter_stats
+from scheduler import INTERACTIVE, NORMAL, scheduler_stats
+from sse import generation_events
 
 app = Flask(__name__)
 gemini_api = GeminiVisionProAPI(api_key=os.getenv("API_KEY"))
+text_model = DynamicGeminiModel(api_key=os.getenv("API_KEY"))
+result_cache = MultimodalResultCache()
+# Longest a GET /jobs/<id> may hold the connection, kept under proxy timeouts.
+MAX_LONG_POLL = 30.0
+
+
+def analyze_upload(upload, text, priority=NORMAL):
+    def analyze(image):
+        response = gemini_api.generate_content(text, image, priority)
+        return GeminiResponseHandler.analyze_response(response)
+
+    return result_cache.fetch(upload, text, gemini_api.MODEL, analyze)
+
+
+def run_job(payload):
+    return analyze_upload(io.BytesIO(payload["image"]), payload["text"])
+
+
+jobs = JobQueue(
+    config.get("job_queue_path", "jobs.sqlite3"),
+    run_job,
+    workers=config.get("job_workers", 4),
+    max_depth=config.get("job_queue_depth", 64),
+    ttl=config.get("job_result_ttl", 3600),
+    max_results=config.get("job_max_results", 1000),
+)
 
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
         text = MultimodalInputProcessor.process_text_input(request.form["text"])
-        image = MultimodalInputProcessor.process_image_input(request.files["image"])
-        response = gemini_api.generate_content(text, image)
-        analysis = GeminiResponseHandler.analyze_response(response)
+        analysis = analyze_upload(request.files["image"], text, INTERACTIVE)
         return render_template("result.html", analysis=analysis)
     return render_template("index.html")
 
 
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Queue an image analysis and return its id without waiting for it.
+    """
+    text = MultimodalInputProcessor.process_text_input(request.form["text"])
+    payload = {"text": text, "image": request.files["image"].read()}
+    try:
+        job_id = jobs.submit(payload)
+    except QueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "5"
+        return response, 429
+    location = f"/jobs/{job_id}"
+    return jsonify({"id": job_id, "url": location}), 202, {"Location": location}
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """
+    Return a job's state; ``?wait=N`` holds the request up to N seconds
+    for the job to finish.
+    """
+    wait = min(request.args.get("wait", 0, type=float), MAX_LONG_POLL)
+    job = jobs.wait(job_id, wait) if wait > 0 else jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job"}), 404
+    return jsonify(job)
+
+
+@app.route("/job-stats")
+def job_stats():
+    return jsonify(jobs.stats())
+
+
+@app.route("/scheduler-stats")
+def scheduler_metrics():
+    return jsonify(scheduler_stats())
+
+
+@app.route("/rate-limit-stats")
+def rate_limit_metrics():
+    return jsonify(limiter_stats())
+
+
+@app.route("/cache-stats")
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+
+@app.route("/stream", methods=["POST"])
+def stream():
+    text = MultimodalInputProcessor.process_text_input(request.form["text"])
+    return Response(
+        stream_with_context(text_model.stream_response(text)), mimetype="text/plain"
+    )
+
+
+@app.route("/events", methods=["GET", "POST"])
+def events():
+    """
+    Stream a text generation as Server-Sent Events.
+
+    ``EventSource`` can only issue GET requests, so the prompt is read from
+    the ``text`` query parameter as well as from a form.
+    """
+    started = time.perf_counter()
+    text = MultimodalInputProcessor.process_text_input(request.values.get("text", ""))
+    if not text.strip():
+        return jsonify({"error": "text is required"}), 400
+    return Response(
+        generation_events(text_model.stream_response_async(text), started),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     app.run(host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", 80)))
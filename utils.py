@@ -1,5 +1,4 @@
 import logging
-from functools import lru_cache
 
 def setup_logging():
     logging.basicConfig(level=logging.INFO,
@@ -23,42 +22,3 @@ def configure_logging(level, output):
 
 def integrate_with_system(system_name, config):
     pass
-
-@lru_cache(maxsize=128)
-def cache_responses(query, response):
-    """
-    This function caches the responses from the API for a given query.
-import logging
-from functools import lru_cache
-
-def setup_logging():
-    logging.basicConfig(level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S')
-
-def enhanced_logging():
-    pass
-
-def secure_api_call(endpoint):
-    pass
-
-def log_error(e):
-    pass
-
-def security_audit():
-    pass
-
-def configure_logging(level, output):
-    pass
-
-def integrate_with_system(system_name, config):
-    pass
-
-@lru_cache(maxsize=128)
-def cache_responses(query, response):
-    """
-    This function caches the responses from the API for a given query.
-    The lru_cache decorator is from the API for a given query.
-    The lru_cache decorator is used to limit the cache size to the last 128 queries.
-    """
-    return response
\ No newline at end of file